@@ -105,6 +105,157 @@ class ModelAnalysis(object):
 
         return kmid * (rhigh - rlow) / (self.rmid * (khigh - klow))
 
+    def _adjoint(self):
+        """Linearizes the model at the steady state. Returns the rates of
+        all reactions, the index p of the product reaction and the vector
+        v = dr_p/dy J^-1 dypdr.
+
+        By the implicit function theorem, the steady state responds to a
+        parameter as J dy/dx = -dypdr dr/dx, where dr/dx are the partial
+        derivatives of the rates at fixed concentrations. The total
+        derivative of the product rate is therefore dr_p/dx - v . dr/dx,
+        and a single linear solve with the transposed Jacobian gives the
+        response to any number of parameters."""
+        model = self.model
+        r, drdy, jac = model.linearize(self.U)
+        dypdr = np.array(model.dypdr, dtype=float)
+        p = model._reactions.index(self.product_reaction)
+        w = np.linalg.solve(jac.T, drdy[p])
+        return r, p, np.dot(w, dypdr)
+
+    def _rate_constants(self, T):
+        """Updates all reactions at temperature T and returns their forward
+        and reverse rate constants, with coverage-dependent rate constants
+        evaluated at the steady state."""
+        model = self.model
+        subs = {}
+        for species in self.species_symbols + model.vacancy:
+            if species.symbol is not None:
+                subs[species.symbol] = self.U[species.label]
+
+        nrxns = len(model._reactions)
+        kfor = np.zeros(nrxns)
+        krev = np.zeros(nrxns)
+        for j, reaction in enumerate(model._reactions):
+            reaction.update(T=T, Asite=model.Asite, L=model.z, force=True)
+            for k, out in [(reaction.kfor, kfor), (reaction.krev, krev)]:
+                if isinstance(k, sym.Basic):
+                    k = k.subs(subs)
+                    # Symbols of species that are not in the model
+                    k = k.subs({atom: 0 for atom in k.atoms(sym.Symbol)})
+                out[j] = float(k)
+        return kfor, krev
+
+    def _fluxes(self, kfor, krev):
+        """Forward and reverse rates of all reactions at the steady-state
+        concentrations, with the given rate constants"""
+        model = self.model
+        y = model._get_initial_values(self.U)
+        vac = [self.U[vacancy.label] for vacancy in model.vacancy]
+        yfix = model._get_fixed_concentrations(self.U)
+        return model.massaction.fluxes(y, vac, kfor, krev, yfix)
+
+    def _drdp(self, perturb, h):
+        """Derivatives of all rates at the steady-state concentrations
+        w.r.t. a parameter. perturb(x) changes the parameter by x and
+        returns the temperature at which the rate constants are evaluated.
+
+        The parameter only enters through the rate constants, so this takes
+        no steady-state solves, and as the logarithms of the rate constants
+        are (nearly) linear in the free energies, central differences are
+        accurate for any small step h."""
+        rates = []
+        for x in [h, -h]:
+            try:
+                rfor, rrev = self._fluxes(*self._rate_constants(perturb(x)))
+                rates.append(rfor - rrev)
+            finally:
+                perturb(-x)
+        self._rate_constants(self.model.T)
+        return (rates[0] - rates[1]) / (2 * h)
+
+    def degree_of_rate_control_all(self):
+        """Campbell's degree of rate control of every reaction, from the
+        implicit function theorem at the steady state instead of finite
+        differences.
+
+        Scaling both rate constants of reaction j by the same factor scales
+        its rate, so at fixed concentrations dr/dln(k_j) is r_j times the
+        j-th unit vector. Returns a dictionary mapping reaction names onto
+        their degree of rate control."""
+        model = self.model
+        r, p, v = self._adjoint()
+        drc = -v * r
+        drc[p] += r[p]
+
+        names = {}
+        for name, reaction in model.reactions.items():
+            names[reaction] = name
+        return collections.OrderedDict((names[reaction], drc[j] / r[p])
+                                       for j, reaction in
+                                       enumerate(model._reactions))
+
+    def thermodynamic_rate_control_all(self, dg=None):
+        """Thermodynamic rate control of every species of the model, like
+        thermodynamic_rate_control, but from the implicit function theorem
+        at the steady state. The free energies only change the rate
+        constants, so neither the model is rebuilt nor the steady state
+        solved again. Returns a dictionary mapping species names onto their
+        thermodynamic rate control."""
+        T = self.model.T
+        if dg is None:
+            dg = 0.001 * kB * T
+
+        species = self.model._species
+        drdg = np.zeros((len(self.model._reactions), len(species)))
+        for i, sp in enumerate(species):
+            def perturb(x, sp=sp):
+                sp.dE += x
+                return T
+            drdg[:, i] = self._drdp(perturb, dg)
+
+        r, p, v = self._adjoint()
+        trc = drdg[p] - np.dot(v, drdg)
+        return collections.OrderedDict((sp.label, -kB * T * trc[i] / r[p])
+                                       for i, sp in enumerate(species))
+
+    def rate_order_all(self):
+        """Reaction orders of the product reaction in the concentrations of
+        all fixed species, like rate_order, but from the implicit function
+        theorem at the steady state. At fixed coverages, c dr/dc of a
+        reaction is the order of c in its forward rate times the forward
+        rate, minus the same for the reverse rate. Returns a dictionary
+        mapping species names onto reaction orders."""
+        model = self.model
+        rfor, rrev = self._fluxes(*self._rate_constants(model.T))
+
+        # The fixed species follow the variables and vacancies in the
+        # reaction orders
+        start = model.nvariables + len(model.vacancy)
+        fixed = slice(start, start + len(model._fixed_species))
+        Nf, Nr = model.massaction.orders
+        drdlnc = Nf[:, fixed] * rfor[:, np.newaxis] \
+            - Nr[:, fixed] * rrev[:, np.newaxis]
+
+        r, p, v = self._adjoint()
+        orders = drdlnc[p] - np.dot(v, drdlnc)
+        return collections.OrderedDict((species.label, orders[k] / r[p])
+                                       for k, species in
+                                       enumerate(model._fixed_species))
+
+    def apparent_activation_energy(self, dT=0.01):
+        """Apparent activation energy kB T^2 dln(r)/dT of the product
+        reaction, like activation_barrier, but from the implicit function
+        theorem at the steady state."""
+        T = self.model.T
+
+        def perturb(x):
+            return T + x
+        drdT = self._drdp(perturb, dT)
+
+        r, p, v = self._adjoint()
+        return kB * T**2 * (drdT[p] - np.dot(v, drdT)) / r[p]
+
     def thermodynamic_rate_control(self, names, dg=None):
         T = self.model.T
         if dg is None:
@@ -0,0 +1,259 @@
+"""On-disk cache of compiled solver modules
+
+Python cannot load the same extension module twice, so a compiled module
+is a process-wide singleton. Every model whose network hashes to the same
+key shares one module, and with it the module's global parameters (kfor,
+krev, yfix), initial values and integrator state. A model must therefore
+load its own parameters into the module again before using it whenever
+another model may have used it in the meantime (see
+Model._activate_solver)."""
+
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+import numpy as np
+
+
+# Default cache size limit, in megabytes
+DEFAULT_CACHE_SIZE = 500
+
+
+def get_cache_dir():
+    """Returns the directory used to store compiled modules.
+
+    Defaults to $XDG_CACHE_HOME/micki (usually ~/.cache/micki), and can be
+    overridden with the MICKI_CACHE_DIR environment variable."""
+    if 'MICKI_CACHE_DIR' in os.environ:
+        cachedir = os.environ['MICKI_CACHE_DIR']
+    else:
+        base = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+        cachedir = os.path.join(base, 'micki')
+    if not os.path.isdir(cachedir):
+        try:
+            os.makedirs(cachedir)
+        except OSError:
+            # Another process may have created it in the meantime
+            if not os.path.isdir(cachedir):
+                raise
+    return cachedir
+
+
+def get_cache_size():
+    """Returns the maximum size of the cache in bytes.
+
+    Set with the MICKI_CACHE_SIZE environment variable (in megabytes)."""
+    size = float(os.environ.get('MICKI_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+    return int(size * 1024**2)
+
+
+# Descriptions of the toolchain, by link flags
+_toolchains = {}
+
+
+def _compiler_version():
+    """First line of the Fortran compiler's version string, or an empty
+    string if it cannot be run"""
+    fc = os.environ.get('FC', 'gfortran')
+    try:
+        out = subprocess.check_output([fc, '--version'],
+                                      stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    lines = out.decode('utf-8', 'replace').splitlines()
+    return lines[0] if lines else ''
+
+
+def _library_dirs(extra_args):
+    dirs = [arg[2:] for arg in extra_args.split() if arg.startswith('-L')]
+    for var in ['LIBRARY_PATH', 'LD_LIBRARY_PATH']:
+        dirs += [d for d in os.environ.get(var, '').split(os.pathsep) if d]
+    dirs += ['/usr/local/lib', '/usr/local/lib64', '/usr/lib', '/usr/lib64',
+             '/usr/lib/x86_64-linux-gnu']
+    return dirs
+
+
+def _find_library(name, dirs):
+    """Path, size and modification time of the library linked with -lname,
+    which change whenever the library is upgraded"""
+    for dname in dirs:
+        for ext in ['.so', '.a', '.dylib']:
+            path = os.path.join(dname, 'lib' + name + ext)
+            if os.path.exists(path):
+                path = os.path.realpath(path)
+                stat = os.stat(path)
+                return '{} {} {}'.format(path, stat.st_size, stat.st_mtime)
+    return name
+
+
+def get_toolchain(extra_args):
+    """Describes the f2py and Fortran compiler versions and the libraries
+    (SUNDIALS, LAPACK, ...) linked by extra_args, so that modules built
+    with another toolchain are not re-used."""
+    if extra_args not in _toolchains:
+        from numpy.f2py import __version__ as f2py_version
+        dirs = _library_dirs(extra_args)
+        libs = [_find_library(arg[2:], dirs) for arg in extra_args.split()
+                if arg.startswith('-l')]
+        _toolchains[extra_args] = '\n'.join(
+            [getattr(f2py_version, 'version', str(f2py_version)),
+             _compiler_version()] + libs)
+    return _toolchains[extra_args]
+
+
+def get_key(*texts):
+    """Hashes the generated sources and build flags into a cache key."""
+    sha = hashlib.sha1()
+    # Compiled modules are only valid for the interpreter and numpy
+    # version that built them.
+    sha.update(sys.version.encode('utf-8'))
+    sha.update(np.__version__.encode('utf-8'))
+    for text in texts:
+        sha.update(text.encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def _find_module_file(dname, modname):
+    matches = glob.glob(os.path.join(dname, modname + '*.so'))
+    if matches:
+        return matches[0]
+    return None
+
+
+def _import(dname, modname):
+    # Import the module on-the-fly with __import__. This is kind of a hack.
+    if modname in sys.modules:
+        return sys.modules[modname]
+    sys.path.insert(0, dname)
+    try:
+        module = __import__(modname)
+    finally:
+        sys.path.remove(dname)
+    return module
+
+
+def load_module(modname, cachedir=None):
+    """Imports a previously compiled module from the cache.
+
+    Returns None if the module has not been compiled yet."""
+    if modname in sys.modules:
+        return sys.modules[modname]
+    if cachedir is None:
+        cachedir = get_cache_dir()
+    fname = _find_module_file(cachedir, modname)
+    if fname is None:
+        return None
+    # Mark the module as recently used for LRU eviction
+    try:
+        os.utime(fname, None)
+    except OSError:
+        pass
+    return _import(cachedir, modname)
+
+
+def compile_module(program, pyf, modname, extra_args, cachedir=None):
+    """Compiles a module with f2py, stores it in the cache and imports it."""
+    from numpy import f2py
+
+    if cachedir is None:
+        cachedir = get_cache_dir()
+
+    # Build in a private temp directory so that concurrent builds of the
+    # same module don't step on each other's toes.
+    dname = tempfile.mkdtemp(dir=cachedir)
+    fname = os.path.join(dname, modname + '.f90')
+    pyfname = os.path.join(dname, modname + '.pyf')
+    with open(pyfname, 'w') as f:
+        f.write(pyf)
+
+    cwd = os.getcwd()
+    os.chdir(dname)
+    try:
+        f2py.compile(program, modulename=modname,
+                     extra_args=extra_args + ' ' + pyfname,
+                     source_fn=fname, verbose=0)
+    finally:
+        os.chdir(cwd)
+
+    try:
+        sofile = _find_module_file(dname, modname)
+        if sofile is None:
+            raise RuntimeError('Failed to compile module {}!'.format(modname))
+        # Keep the generated source next to the module for debugging
+        target = os.path.join(cachedir, os.path.basename(sofile))
+        shutil.move(fname, os.path.join(cachedir, modname + '.f90'))
+        # Renaming within the same filesystem is atomic, so other processes
+        # never see a half-written module.
+        os.rename(sofile, target)
+    finally:
+        shutil.rmtree(dname)
+
+    evict(cachedir, keep=modname)
+    return _import(cachedir, modname)
+
+
+def get_module(program, pyf_template, extra_args, prefix='micki_', **kwargs):
+    """Returns the compiled module for the given program, compiling it only
+    if it is not already in the cache.
+
+    pyf_template is formatted with modname and any additional keyword
+    arguments. Models of the same network share the returned module, see
+    the notes at the top of this file."""
+    key = get_key(program, pyf_template.format(modname='', **kwargs),
+                  extra_args, get_toolchain(extra_args))
+    modname = prefix + key[:20]
+    cachedir = get_cache_dir()
+    module = load_module(modname, cachedir)
+    if module is None:
+        pyf = pyf_template.format(modname=modname, **kwargs)
+        module = compile_module(program, pyf, modname, extra_args, cachedir)
+    return module
+
+
+def evict(cachedir=None, maxsize=None, keep=None):
+    """Deletes least recently used modules until the cache fits in maxsize
+    bytes."""
+    if cachedir is None:
+        cachedir = get_cache_dir()
+    if maxsize is None:
+        maxsize = get_cache_size()
+
+    # Group files by module name, e.g. micki_XXX.f90 and micki_XXX.*.so
+    entries = {}
+    for fname in os.listdir(cachedir):
+        path = os.path.join(cachedir, fname)
+        if not os.path.isfile(path):
+            continue
+        modname = fname.split('.')[0]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        size, mtime = entries.get(modname, (0, 0.))
+        entries[modname] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+    total = sum(size for size, mtime in entries.values())
+    for modname in sorted(entries, key=lambda name: entries[name][1]):
+        if total <= maxsize:
+            break
+        if modname == keep or modname in sys.modules:
+            continue
+        for path in glob.glob(os.path.join(cachedir, modname + '.*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= entries[modname][0]
+
+
+def clear(cachedir=None):
+    """Removes all compiled modules from the cache."""
+    evict(cachedir, maxsize=0)
@@ -11,9 +11,78 @@ f90_template = """module solve_ida
    real*8 :: rates({nrates})
    real*8 :: dypdr({neq}, {nrates})
    integer :: dvacdy({nvac}, {neq})
+   real*8 :: kfor({nrates}), krev({nrates})
+   real*8 :: yfix({nfix})
+   real*8 :: rampbeta = 0.d0, ramptemp0 = 0.d0, ramptref = 1.d0
+   real*8 :: rampfor(3, {nrates}), ramprev(3, {nrates})
 
 end module solve_ida
 
+subroutine set_params(nratesin, kforin, krevin, nfixin, yfixin)
+
+   use solve_ida, only: kfor, krev, yfix
+
+   implicit none
+
+   integer, intent(in) :: nratesin, nfixin
+   real*8, intent(in) :: kforin(nratesin), krevin(nratesin)
+   real*8, intent(in) :: yfixin(nfixin)
+
+   kfor = kforin
+   krev = krevin
+   yfix = yfixin
+
+end subroutine set_params
+
+subroutine set_ramp(nratesin, temp0in, betain, trefin, rampforin, ramprevin)
+
+   ! Linear temperature ramp T(t) = temp0 + beta t. While beta is nonzero,
+   ! the rate constants are evaluated at T(t) from their modified Arrhenius
+   ! fits ln k = a + n ln(T / tref) - theta (1 / T - 1 / tref), stored as
+   ! (a, n, theta) in rampfor and ramprev, instead of being taken from
+   ! kfor and krev.
+
+   use solve_ida, only: rampbeta, ramptemp0, ramptref, rampfor, ramprev
+
+   implicit none
+
+   integer, intent(in) :: nratesin
+   real*8, intent(in) :: temp0in, betain, trefin
+   real*8, intent(in) :: rampforin(3, nratesin), ramprevin(3, nratesin)
+
+   ramptemp0 = temp0in
+   rampbeta = betain
+   ramptref = trefin
+   rampfor = rampforin
+   ramprev = ramprevin
+
+end subroutine set_ramp
+
+subroutine ramp_rate_constants(t, kf, kr)
+
+   ! Rate constants at time t, see set_ramp
+
+   use solve_ida, only: kfor, krev, rampbeta, ramptemp0, ramptref, rampfor, ramprev
+
+   implicit none
+
+   real*8, intent(in) :: t
+   real*8, intent(out) :: kf({nrates}), kr({nrates})
+   real*8 :: temp, lt, it
+
+   if (rampbeta == 0) then
+      kf = kfor
+      kr = krev
+   else
+      temp = ramptemp0 + rampbeta * t
+      lt = log(temp / ramptref)
+      it = 1.d0 / temp - 1.d0 / ramptref
+      kf = exp(rampfor(1, :) + rampfor(2, :) * lt - rampfor(3, :) * it)
+      kr = exp(ramprev(1, :) + ramprev(2, :) * lt - ramprev(3, :) * it)
+   end if
+
+end subroutine ramp_rate_constants
+
 subroutine initialize(neqin, y0in, rtol, atol, ipar, rpar, id_vec)
 
    use solve_ida, only: neq, iout, rout, y0, yp0, mas, diff, dypdr, dvacdy
@@ -30,6 +99,8 @@ subroutine initialize(neqin, y0in, rtol, atol, ipar, rpar, id_vec)
    integer :: i
    integer :: meth, itmeth
    integer :: myid
+   ! The sizes of a sparse matrix are long ints in SUNDIALS
+   integer*8 :: neq8, nnz8
 
    dypdr = 0
 {dypdrcalc}
@@ -72,72 +143,427 @@ subroutine initialize(neqin, y0in, rtol, atol, ipar, rpar, id_vec)
 !   call fidalapackdensesetjac(1, ier)
 
 !Uncomment these lines for Sundials 4.X (and comment about the above)
-  call FSUNDenseMatInit(2, neq, neq, ier)
-  call FSUNLAPACKDENSEINIT(2, ier)
-  call FIDALSINIT(ier)
+{linsolinit}
 
 end subroutine initialize
 
-subroutine find_steady_state(neqin, nrates, dt, maxiter, epsilon, t1, u1, du1, r1)
+subroutine reinitialize(neqin, y0in, rtol, atol, id_vec)
 
-   use solve_ida, only: y0, yp0, iout, rout, rates, dypdr
+   use solve_ida, only: neq, y0, yp0, diff
 
    implicit none
 
-   integer, intent(in) :: neqin, nrates, maxiter
+   integer, intent(in) :: neqin
+   real*8, intent(in) :: y0in(neqin), rtol, atol(*)
+   real*8, intent(in) :: id_vec(neqin)
+   real*8 :: rpar(1)
+   integer :: ipar(1)
+   real*8 :: t0, yptmp(neqin)
+   integer :: iatol, ier
+
+   iatol = 2
+   t0 = 0
+   y0 = y0in
+   yp0 = 0
+   yptmp = 0
+   diff = id_vec
+
+   ! Calculate yp with the new initial values and parameters
+   call fidaresfun(0.d0, y0, yptmp, yp0, ipar, rpar, ier)
+
+   ! Re-use the already-allocated IDA memory
+   call fidareinit(t0, y0, yp0, iatol, rtol, atol, ier)
+
+end subroutine reinitialize
+
+subroutine find_steady_state(neqin, nrates, dt, maxiter, epsilon, newton, t1, u1, du1, r1, niter, resnorm, &
+      converged, usednewton)
+
+   implicit none
+
+   integer, intent(in) :: neqin, nrates, maxiter, newton
    real*8, intent(in) :: dt, epsilon
 
+   real*8, intent(out) :: t1, u1(neqin), du1(neqin), r1(nrates), resnorm
+   integer, intent(out) :: niter, converged, usednewton
+
+   call steady_state(neqin, nrates, dt, maxiter, epsilon, newton, t1, u1, du1, r1, niter, resnorm, converged, &
+      usednewton)
+
+end subroutine find_steady_state
+
+subroutine find_steady_state_batch(neqin, nrates, nfixin, ncond, kforin, krevin, yfixin, y0in, rtol, atol, id_vec, &
+      dt, maxiter, epsilon, newton, t1, u1, du1, r1, niter, resnorm, converged, usednewton)
+
+   implicit none
+
+   integer, intent(in) :: neqin, nrates, nfixin, ncond, maxiter, newton
+   real*8, intent(in) :: kforin(nrates, ncond), krevin(nrates, ncond)
+   real*8, intent(in) :: yfixin(nfixin, ncond), y0in(neqin, ncond)
+   real*8, intent(in) :: rtol, atol(neqin), id_vec(neqin)
+   real*8, intent(in) :: dt, epsilon
+
+   real*8, intent(out) :: t1(ncond), u1(neqin, ncond), du1(neqin, ncond)
+   real*8, intent(out) :: r1(nrates, ncond), resnorm(ncond)
+   integer, intent(out) :: niter(ncond), converged(ncond), usednewton(ncond)
+
+   integer :: k
+
+   ! All conditions share the same compiled network and IDA memory, only
+   ! the parameters and initial values change between them.
+   do k = 1, ncond
+      call set_params(nrates, kforin(:, k), krevin(:, k), nfixin, yfixin(:, k))
+      call reinitialize(neqin, y0in(:, k), rtol, atol, id_vec)
+      call steady_state(neqin, nrates, dt, maxiter, epsilon, newton, t1(k), u1(:, k), du1(:, k), r1(:, k), &
+         niter(k), resnorm(k), converged(k), usednewton(k))
+   end do
+
+end subroutine find_steady_state_batch
+
+subroutine steady_state(neqin, nrates, dt, maxiter, epsilon, newton, t1, u1, du1, r1, niter, resnorm, converged, &
+      usednewton)
+
+   use solve_ida, only: y0, kfor, krev, yfix
+
+   implicit none
+
+   integer, intent(in) :: neqin, nrates, maxiter, newton
+   real*8, intent(in) :: dt, epsilon
+
+   real*8, intent(out) :: t1, u1(neqin), du1(neqin), r1(nrates), resnorm
+   integer, intent(out) :: niter, converged, usednewton
+
+   real*8 :: rho, dt0, tau0
+   integer :: nnewton
+
+   call initial_time_step(neqin, kfor, krev, yfix, y0, dt, dt0, tau0, rho)
+
+   converged = 0
+   usednewton = 0
+   nnewton = 0
+
+   ! Solve the steady-state equations directly, and only integrate in time
+   ! if that fails
+   if (newton /= 0) then
+      call newton_steady_state(neqin, nrates, kfor, krev, yfix, y0, tau0, rho, maxiter, epsilon, t1, u1, du1, r1, &
+         nnewton, resnorm, converged)
+      usednewton = converged
+   end if
+
+   if (converged == 0) then
+      call transient_steady_state(neqin, nrates, dt0, rho, maxiter, epsilon, t1, u1, du1, r1, niter, resnorm, &
+         converged)
+   else
+      niter = 0
+   end if
+   niter = niter + nnewton
+
+end subroutine steady_state
+
+subroutine find_steady_state_newton(neqin, nrates, nfixin, kforin, krevin, yfixin, y0in, dt, maxiter, epsilon, &
+      t1, u1, du1, r1, niter, resnorm, converged)
+
+   ! Newton steady-state search that does not depend on the parameters and
+   ! initial values stored in the module or on the (global) IDA memory, so
+   ! it may run in several threads at once. Besides its arguments, it only
+   ! reads diff, dypdr and dvacdy, which initialize and reinitialize set
+   ! from the generated code and from the algebraic variables of the
+   ! model, which are the same for every model sharing the module
+
+   implicit none
+
+   integer, intent(in) :: neqin, nrates, nfixin, maxiter
+   real*8, intent(in) :: kforin(nrates), krevin(nrates), yfixin(nfixin), y0in(neqin)
+   real*8, intent(in) :: dt, epsilon
+
+   real*8, intent(out) :: t1, u1(neqin), du1(neqin), r1(nrates), resnorm
+   integer, intent(out) :: niter, converged
+
+   real*8 :: rho, dt0, tau0
+
+   call initial_time_step(neqin, kforin, krevin, yfixin, y0in, dt, dt0, tau0, rho)
+   call newton_steady_state(neqin, nrates, kforin, krevin, yfixin, y0in, tau0, rho, maxiter, epsilon, t1, u1, du1, &
+      r1, niter, resnorm, converged)
+
+end subroutine find_steady_state_newton
+
+subroutine initial_time_step(neqin, kfor, krev, yfix, yin, dt, dt0, tau0, rho)
+
+   ! Initial time steps of the transient integration (dt0) and of the
+   ! Newton search (tau0). Unless given, dt0 is the fastest timescale of
+   ! the system at the initial conditions, and tau0 is at least 60 s, as
+   ! the pseudo-transient continuation stagnates if it starts from a tiny
+   ! time step.
+
+   implicit none
+
+   integer, intent(in) :: neqin
+   real*8, intent(in) :: kfor({nrates}), krev({nrates}), yfix({nfix})
+   real*8, intent(in) :: yin(neqin), dt
+   real*8, intent(out) :: dt0, tau0, rho
+
+   call spectral_radius(neqin, kfor, krev, yfix, yin, rho)
+   dt0 = dt
+   tau0 = dt
+   if (dt0 <= 0) then
+      dt0 = 1.d0
+      if (rho > 0) then
+         dt0 = 1.d0 / rho
+      end if
+      tau0 = max(60.d0, dt0)
+   end if
+
+end subroutine initial_time_step
+
+subroutine spectral_radius(neqin, kfor, krev, yfix, yin, rho)
+
+   ! Upper bound on the spectral radius of the Jacobian of the differential
+   ! equations (its infinity norm)
+
+   use solve_ida, only: diff
+
+   implicit none
+
+   integer, intent(in) :: neqin
+   real*8, intent(in) :: kfor({nrates}), krev({nrates}), yfix({nfix})
+   real*8, intent(in) :: yin(neqin)
+   real*8, intent(out) :: rho
+
+   real*8, allocatable :: jac(:, :)
+   integer :: i, ier
+
+   allocate(jac(neqin, neqin))
+   call steady_jacobian(neqin, kfor, krev, yfix, yin, 0.d0, jac, ier)
+
+   rho = 0.d0
+   do i = 1, neqin
+      if (diff(i) /= 0) then
+         rho = max(rho, sum(abs(jac(i, :))))
+      end if
+   end do
+   deallocate(jac)
+
+end subroutine spectral_radius
+
+subroutine newton_steady_state(neqin, nrates, kfor, krev, yfix, y0, dt, rho, maxiter, epsilon, t1, u1, du1, r1, &
+      niter, resnorm, converged)
+
+   ! Pseudo-transient continuation: damped Newton steps on the steady-state
+   ! equations, regularized by an implicit Euler time step tau that grows
+   ! as the residual decreases (switched evolution relaxation). Gives up
+   ! if the residual has not halved in nstallmax iterations. The Jacobian
+   ! is factorised as a dense matrix, so models using the sparse solver
+   ! do not call this (see Model._get_newton).
+
+   use solve_ida, only: diff, dvacdy
+
+   implicit none
+
+   integer, intent(in) :: neqin, nrates, maxiter
+   real*8, intent(in) :: kfor({nrates}), krev({nrates}), yfix({nfix}), y0(neqin)
+   real*8, intent(in) :: dt, rho, epsilon
+
+   real*8, intent(out) :: t1, u1(neqin), du1(neqin), r1(nrates), resnorm
+   integer, intent(out) :: niter, converged
+
+   real*8 :: y(neqin), vac({nvac}), dvac({nvac})
+   real*8 :: res(neqin), restrial(neqin)
+   real*8 :: dy(neqin), ytrial(neqin)
+   real*8 :: tau, fnorm, fnormtrial, alpha, growth, fbest
+   ! On the heap rather than the stack, which is small in threads
+   real*8, allocatable :: jac(:, :)
+   integer, allocatable :: ipiv(:)
+   integer :: i, ier, nstall
+   integer, parameter :: nstallmax = 50
+
+   allocate(jac(neqin, neqin), ipiv(neqin))
+   converged = 0
+   t1 = 0.d0
+   u1 = y0
+   tau = dt
+
+   call steady_residual(neqin, kfor, krev, yfix, u1, r1, res, ier)
+   fnorm = maxval(abs(res))
+   fbest = fnorm
+   nstall = 0
+
+   niter = 0
+   do while (niter < maxiter)
+      if (converged == 1 .or. fnorm < epsilon) then
+         converged = 1
+         exit
+      end if
+      niter = niter + 1
+
+      ! jac = J - M / tau
+      call steady_jacobian(neqin, kfor, krev, yfix, u1, 1.d0 / tau, jac, ier)
+      dy = -res
+      call dgesv(neqin, 1, jac, neqin, ipiv, dy, neqin, ier)
+
+      alpha = 0.d0
+      fnormtrial = fnorm
+      if (ier == 0) then
+         ! Damp the step so that neither the concentrations nor the empty
+         ! sites (which follow from the site balance) become negative.
+         ! Concentrations that are already zero are kept at zero.
+         do i = 1, neqin
+            if (u1(i) <= 0 .and. dy(i) < 0) then
+               dy(i) = 0.d0
+            end if
+         end do
+         y = u1
+         vac = 0
+{vaccalc}
+         dvac = matmul(dvacdy, dy)
+         alpha = 1.d0
+         do i = 1, neqin
+            if (u1(i) > 0 .and. u1(i) + dy(i) < 0) then
+               alpha = min(alpha, 0.99d0 * u1(i) / (-dy(i)))
+            end if
+         end do
+         do i = 1, {nvac}
+            if (vac(i) > 0 .and. vac(i) + dvac(i) < 0) then
+               alpha = min(alpha, 0.99d0 * vac(i) / (-dvac(i)))
+            end if
+         end do
+
+         ytrial = u1 + alpha * dy
+         call steady_residual(neqin, kfor, krev, yfix, ytrial, r1, restrial, ier)
+         fnormtrial = maxval(abs(restrial))
+      end if
+
+      if (ier == 0 .and. fnormtrial < 10 * fnorm) then
+         growth = min(10.d0, max(0.1d0, fnorm / fnormtrial))
+         ! Keep growing the time step while the residual does not increase,
+         ! even if damped steps only reduce it a little
+         if (fnormtrial <= fnorm) then
+            growth = max(growth, 2.d0)
+         end if
+         ! Once full Newton steps no longer change the concentrations, the
+         ! residual is limited by round-off error. Shorter steps may only
+         ! have stalled on a slow timescale, so grow the time step instead.
+         if (all(abs(ytrial - u1) <= 1d-10 * abs(u1))) then
+            if (tau * rho > 1d10) then
+               converged = 1
+            end if
+            growth = 10.d0
+         end if
+         u1 = ytrial
+         res = restrial
+         t1 = t1 + alpha * tau
+         tau = min(tau * growth, 1d20)
+         fnorm = fnormtrial
+      else
+         tau = tau / 4
+         ! Newton has stalled
+         if (tau < dt * 1d-10) then
+            exit
+         end if
+      end if
+
+      if (fnorm < 0.5d0 * fbest) then
+         fbest = fnorm
+         nstall = 0
+      else
+         nstall = nstall + 1
+         if (nstall >= nstallmax .and. converged == 0) then
+            exit
+         end if
+      end if
+   end do
+
+   if (fnorm < epsilon) then
+      converged = 1
+   end if
+   resnorm = fnorm
+   if (converged == 1) then
+      du1 = diff * res
+      call ratecalc({neq}, u1, kfor, krev, yfix, r1)
+   end if
+   deallocate(jac, ipiv)
+
+end subroutine newton_steady_state
+
+subroutine transient_steady_state(neqin, nrates, dt, rho, maxiter, epsilon, t1, u1, du1, r1, niter, resnorm, &
+      converged)
+
+   ! Integrates the differential equations until the residual drops below
+   ! epsilon. The output times grow geometrically, starting from dt, so
+   ! that all timescales of the system are covered in few iterations. As
+   ! in the Newton search, the steady state is also reached once the
+   ! concentrations stop changing over output intervals that are long
+   ! compared with the fastest timescale 1 / rho, with the residual
+   ! limited by round-off error.
+
+   use solve_ida, only: y0, yp0, kfor, krev, yfix
+
+   implicit none
+
+   integer, intent(in) :: neqin, nrates, maxiter
+   real*8, intent(in) :: dt, rho, epsilon
+
    real*8 :: rpar(1)
    integer :: ipar(1)
 
-   real*8, intent(out) :: t1, u1(neqin), du1(neqin), r1(nrates)
+   real*8, intent(out) :: t1, u1(neqin), du1(neqin), r1(nrates), resnorm
+   integer, intent(out) :: niter, converged
 
-   real*8 :: tout, epsilon2
-   real*8 :: dutmp(neqin), du0(neqin)
+   real*8 :: tout, dtout, tprev
+   real*8 :: dutmp(neqin), du0(neqin), uprev(neqin)
    integer :: itask, ier
-   integer :: i
-
-   logical :: converged = .FALSE.
 
-   epsilon2 = epsilon**2
-   i = 0
+   niter = 0
    itask = 1
    tout = 0.0d0
+   dtout = dt
    u1 = y0
    du1 = yp0
    t1 = 0.d0
    du0 = 0.d0
+   converged = 0
 
    call fidacalcic(1, dt, ier)
 
-   do while (.not. converged)
-      if (tout - t1 < dt * 0.01) then
-         tout = tout + dt
+   call fidaresfun(0.d0, u1, du0, dutmp, ipar, rpar, ier)
+   resnorm = maxval(abs(dutmp))
+
+   do while (niter < maxiter)
+      if (resnorm < epsilon) then
+         converged = 1
+         exit
       end if
 
+      if (tout - t1 < dtout * 0.01) then
+         tout = tout + dtout
+         dtout = min(2 * dtout, 1d20)
+      end if
+
+      uprev = u1
+      tprev = t1
       call fidasolve(tout, t1, u1, du1, itask, ier)
 
-      i = i + 1
+      niter = niter + 1
 
       call fidaresfun(tout, u1, du0, dutmp, ipar, rpar, ier)
+      resnorm = maxval(abs(dutmp))
 
-      if (maxval(dutmp**2) < epsilon2) then
-         converged = .TRUE.
-      end if
-      if (i >= maxiter) then
-         print *, "ODE NOT CONVERGED!"
+      if ((t1 - tprev) * rho > 1d10 .and. all(abs(u1 - uprev) <= 1d-10 * abs(u1))) then
+         converged = 1
          exit
       end if
    end do
+
+   if (resnorm < epsilon) then
+      converged = 1
+   end if
    
-   call ratecalc({neq}, u1)
-   r1 = rates
+   call ratecalc({neq}, u1, kfor, krev, yfix, r1)
 
-end subroutine find_steady_state
+end subroutine transient_steady_state
 
 subroutine solve(neqin, nrates, nt, tfinal, t1, u1, du1, r1)
 
-   use solve_ida, only: y0, yp0, iout, rout, rates
+   use solve_ida, only: y0, yp0, rates, yfix
 
    implicit none
 
@@ -152,6 +578,7 @@ subroutine solve(neqin, nrates, nt, tfinal, t1, u1, du1, r1)
    real*8, intent(out) :: r1(nrates, nt)
 
    real*8 :: dt, tout
+   real*8 :: kf({nrates}), kr({nrates})
    integer :: itask, ier
    integer :: i
 
@@ -163,8 +590,8 @@ subroutine solve(neqin, nrates, nt, tfinal, t1, u1, du1, r1)
    u1(:, 1) = y0
    du1(:, 1) = yp0
    t1(1) = 0.d0
-   call ratecalc({neq}, u1(:, 1))
-   r1(:, 1) = rates
+   call ramp_rate_constants(0.d0, kf, kr)
+   call ratecalc({neq}, u1(:, 1), kf, kr, yfix, r1(:, 1))
 
 
 !   call fidacalcic(1, dt, ier)
@@ -189,7 +616,7 @@ end subroutine finalize
 
 subroutine fidaresfun(tres, yin, ypin, res, ipar, rpar, reserr)
 
-   use solve_ida, only: neq, diff, dypdr, rates
+   use solve_ida, only: neq, diff, dypdr, rates, yfix
 
    implicit none
 
@@ -198,32 +625,50 @@ subroutine fidaresfun(tres, yin, ypin, res, ipar, rpar, reserr)
    real*8, intent(in) :: tres, rpar(*)
    real*8, intent(in) :: yin(neq), ypin(neq)
    real*8, intent(out) :: res(neq)
-   real*8 :: y(neq)
+   real*8 :: kf({nrates}), kr({nrates})
 
-   integer :: i
+   ! The rates at the last residual evaluation are the output of solve
+   call ramp_rate_constants(tres, kf, kr)
+   call steady_residual(neq, kf, kr, yfix, yin, rates, res, reserr)
 
-   reserr = 0
+   res = res - diff * ypin
+   
+end subroutine fidaresfun
 
-   y = yin
-   res = 0
+subroutine steady_residual(neqin, kfor, krev, yfix, yin, r, res, reserr)
 
+   ! Rates and right-hand side of the differential equations, with reserr
+   ! flagging negative concentrations
 
-   do i = 1, neq
-      if (y(i) < -1d-10)  then
-!         y(i) = 0.d0
+   use solve_ida, only: dypdr
+
+   implicit none
+
+   integer, intent(in) :: neqin
+   real*8, intent(in) :: kfor({nrates}), krev({nrates}), yfix({nfix})
+   real*8, intent(in) :: yin(neqin)
+   real*8, intent(out) :: r({nrates}), res(neqin)
+   integer, intent(out) :: reserr
+
+   integer :: i
+
+   reserr = 0
+
+   do i = 1, neqin
+      if (yin(i) < -1d-10)  then
          reserr = 1
       endif
    enddo
 
-   call ratecalc({neq}, y)
+   call ratecalc({neq}, yin, kfor, krev, yfix, r)
 
-   res = matmul(dypdr, rates) - diff * ypin
-   
-end subroutine fidaresfun
+   res = matmul(dypdr, r)
+
+end subroutine steady_residual
 
 subroutine fidadjac(neqin, t, yin, ypin, r, jac, cj, ewt, h, ipar, rpar, wk1, wk2, wk3, djacerr)
 
-   use solve_ida, only: mas, dypdr, dvacdy
+   use solve_ida, only: yfix
     
    implicit none
    
@@ -232,13 +677,59 @@ subroutine fidadjac(neqin, t, yin, ypin, r, jac, cj, ewt, h, ipar, rpar, wk1, wk
    real*8 :: t, h, cj, rpar(*)
    real*8 :: yin(neqin), ypin(neqin), r(neqin), ewt(*), jac(neqin, neqin)
    real*8 :: wk1(*), wk2(*), wk3(*)
-   real*8 :: y(neqin), drdy({nrates}, {neq}), drdvac({nrates}, {nvac}), vac({nvac})
+   real*8 :: kf({nrates}), kr({nrates})
+
+   call ramp_rate_constants(t, kf, kr)
+   call steady_jacobian(neqin, kf, kr, yfix, yin, cj, jac, djacerr)
+
+end subroutine fidadjac
+
+subroutine steady_jacobian(neqin, kfor, krev, yfix, yin, cj, jac, djacerr)
+
+   ! Jacobian of the differential equations minus cj times the mass matrix
+
+   use solve_ida, only: mas, dypdr
+
+   implicit none
+
+   integer, intent(in) :: neqin
+   real*8, intent(in) :: kfor({nrates}), krev({nrates}), yfix({nfix})
+   real*8, intent(in) :: yin(neqin), cj
+   real*8, intent(out) :: jac(neqin, neqin)
+   integer, intent(out) :: djacerr
+   real*8, allocatable :: drdy(:, :)
+
+   allocate(drdy({nrates}, {neq}))
+   call ratejac(neqin, kfor, krev, yfix, yin, drdy, djacerr)
+
+   jac = matmul(dypdr, drdy) - cj * mas
+   deallocate(drdy)
+
+end subroutine steady_jacobian
+
+subroutine ratejac(neqin, kfor, krev, yfix, yin, drdy, djacerr)
+
+   ! Derivatives of all rates w.r.t. the variables, including the
+   ! contribution from the vacancies
+
+   use solve_ida, only: dvacdy
+
+   implicit none
+
+   integer, intent(in) :: neqin
+   real*8, intent(in) :: kfor({nrates}), krev({nrates}), yfix({nfix})
+   real*8, intent(in) :: yin(neqin)
+   real*8, intent(out) :: drdy({nrates}, {neq})
+   integer, intent(out) :: djacerr
+   real*8 :: y(neqin), drdvac({nrates}, {nvac}), vac({nvac})
+   real*8 :: kf({nrates}), kr({nrates})
+{jacdecl}
+{latdecl}
 
    integer :: i
 
    djacerr = 0
 
-   jac = 0
    y = yin
 
    do i = 1, neqin
@@ -258,28 +749,60 @@ subroutine fidadjac(neqin, t, yin, ypin, r, jac, cj, ewt, h, ipar, rpar, wk1, wk
       endif
    enddo
 
-   drdy = 0
-{drdycalc}
+   kf = kfor
+   kr = krev
+{latcalc}
 
+   drdy = 0
    drdvac = 0
-{drdvaccalc}
+{drdycalc}
 
    drdy = drdy + matmul(drdvac, dvacdy)
 
-   jac = matmul(dypdr, drdy) - cj * mas
+end subroutine ratejac
 
-end subroutine fidadjac
+subroutine linearize(neqin, nrates, nfixin, kforin, krevin, yfixin, yin, r1, drdy, jac)
 
-subroutine ratecalc(neqin, yin)
+   ! Rates, their derivatives and the Jacobian of the steady-state
+   ! equations at the concentrations yin for the rate constants kforin
+   ! and krevin and the fixed concentrations yfixin. Apart from its
+   ! arguments, this only reads dypdr, which initialize sets from the
+   ! generated code
 
-   use solve_ida, only: rates
+   use solve_ida, only: dypdr
+
+   implicit none
+
+   integer, intent(in) :: neqin, nrates, nfixin
+   real*8, intent(in) :: kforin(nrates), krevin(nrates), yfixin(nfixin)
+   real*8, intent(in) :: yin(neqin)
+   real*8, intent(out) :: r1(nrates), drdy(nrates, neqin), jac(neqin, neqin)
+
+   integer :: ier
+
+   call ratecalc({neq}, yin, kforin, krevin, yfixin, r1)
+   call ratejac(neqin, kforin, krevin, yfixin, yin, drdy, ier)
+   jac = matmul(dypdr, drdy)
+
+end subroutine linearize
+
+subroutine ratecalc(neqin, yin, kfor, krev, yfix, rates)
+
+   ! Rates of all reactions for the rate constants kfor and krev and the
+   ! fixed concentrations yfix. kf and kr are the rate constants including
+   ! the lateral interactions, if there are any.
 
    implicit none
 
    integer, intent(in) :: neqin
    real*8, intent(in) :: yin(neqin)
+   real*8, intent(in) :: kfor({nrates}), krev({nrates}), yfix({nfix})
+   real*8, intent(out) :: rates({nrates})
    real*8 :: y(neqin)
    real*8 :: vac({nvac})
+   real*8 :: kf({nrates}), kr({nrates})
+{ratedecl}
+{latdecl}
 
    integer :: i
 
@@ -295,6 +818,10 @@ subroutine ratecalc(neqin, yin)
       endif
    enddo
 
+   kf = kfor
+   kr = krev
+{latcalc}
+
    rates = 0
 {ratecalc}
 
@@ -365,9 +892,82 @@ subroutine fidapset(tres, yin, ypin, res, cj, ewt, h, ipar, rpar, wk1, wk2, wk3,
 
 end subroutine fidapset
 
+{spjac}
    """
 
 
+# Linear solver setup for the dense Jacobian, factorised with LAPACK
+dense_linsol_template = """  call FSUNDenseMatInit(2, neq, neq, ier)
+  call FSUNLAPACKDENSEINIT(2, ier)
+  call FIDALSINIT(ier)"""
+
+
+# Linear solver setup for the compressed sparse column Jacobian,
+# factorised with KLU
+sparse_linsol_template = """  neq8 = neq
+  nnz8 = {nnz}
+  call FSUNSPARSEMATINIT(2, neq8, neq8, nnz8, 0, ier)
+  call FSUNKLUINIT(2, ier)
+  call FIDALSINIT(ier)
+  call FIDASPARSESETJAC(ier)"""
+
+
+# Sparse Jacobian routine. Only the nonzero derivatives of the rates (dr)
+# are evaluated, and the Jacobian is assembled directly in compressed
+# sparse column format.
+spjac_template = """subroutine fidaspjac(t, cj, yin, ypin, r, n, nnz, jdata, jrvals, jcptrs, h, ipar, rpar, wk1, wk2, wk3, ier)
+
+   use solve_ida, only: diff, yfix
+
+   implicit none
+
+   integer*8 :: n, nnz, ipar(*)
+   integer :: ier
+   real*8 :: t, cj, h, rpar(*)
+   real*8 :: yin({neq}), ypin({neq}), r({neq})
+   real*8 :: wk1(*), wk2(*), wk3(*)
+   real*8 :: jdata({nnz})
+   integer :: jrvals({nnz}), jcptrs({neq1})
+   real*8 :: y({neq}), vac({nvac}), dr({ndr})
+   real*8 :: kf({nrates}), kr({nrates})
+{drdecl}
+{latdecl}
+
+   integer :: i
+
+   ier = 0
+
+   y = yin
+
+   do i = 1, {neq}
+      if (y(i) < -1d-10) then
+         y(i) = 0.d0
+         ier = 1
+      endif
+   enddo
+
+   vac = 0
+{vaccalc}
+
+   do i = 1, {nvac}
+      if (vac(i) < -1d-10) then
+         vac(i) = 0.d0
+         ier = 1
+      endif
+   enddo
+
+   call ramp_rate_constants(t, kf, kr)
+{latcalc}
+
+   dr = 0
+{drcalc}
+
+{jaccalc}
+
+end subroutine fidaspjac
+"""
+
+
 pyf_template = """!    -*- f90 -*-
 ! Note: the context of this file is case sensitive.
 
@@ -384,8 +984,33 @@ python module {modname} ! in
             real*8 dimension({nrates}) :: rates
             real*8 dimension({neq},{nrates}) :: dypdr
             integer dimension({nvac},{neq}) :: dvacdy
+            real*8 dimension({nrates}) :: kfor
+            real*8 dimension({nrates}) :: krev
+            real*8 dimension({nfix}) :: yfix
+            real*8 :: rampbeta
+            real*8 :: ramptemp0
+            real*8 :: ramptref
+            real*8 dimension(3,{nrates}) :: rampfor
+            real*8 dimension(3,{nrates}) :: ramprev
             integer, optional :: neq={neq}
         end module solve_ida
+        subroutine set_params(nratesin,kforin,krevin,nfixin,yfixin) ! in :{modname}:{modname}.f90
+            use solve_ida, only: kfor,krev,yfix
+            integer, optional,intent(in),check(len(kforin)>=nratesin),depend(kforin) :: nratesin=len(kforin)
+            real*8 dimension(nratesin),intent(in) :: kforin
+            real*8 dimension(nratesin),intent(in),depend(nratesin) :: krevin
+            integer, optional,intent(in),check(len(yfixin)>=nfixin),depend(yfixin) :: nfixin=len(yfixin)
+            real*8 dimension(nfixin),intent(in) :: yfixin
+        end subroutine set_params
+        subroutine set_ramp(nratesin,temp0in,betain,trefin,rampforin,ramprevin) ! in :{modname}:{modname}.f90
+            use solve_ida, only: rampbeta,ramptemp0,ramptref,rampfor,ramprev
+            integer, optional,intent(in),check(shape(rampforin,1)==nratesin),depend(rampforin) :: nratesin=shape(rampforin,1)
+            real*8 intent(in) :: temp0in
+            real*8 intent(in) :: betain
+            real*8 intent(in) :: trefin
+            real*8 dimension(3,nratesin),intent(in) :: rampforin
+            real*8 dimension(3,nratesin),intent(in),depend(nratesin) :: ramprevin
+        end subroutine set_ramp
         subroutine initialize(neqin,y0in,rtol,atol,ipar,rpar,id_vec) ! in :{modname}:{modname}.f90
             use solve_ida, only: neq,iout,rout,y0,yp0,mas,diff,dypdr,dvacdy
             integer, optional,intent(in),check(len(y0in)>=neqin),depend(y0in) :: neqin=len(y0in)
@@ -396,18 +1021,87 @@ python module {modname} ! in
             real*8 dimension(*),intent(in) :: rpar
             real*8 dimension(neqin),intent(in),depend(neqin) :: id_vec
         end subroutine initialize
-        subroutine find_steady_state(neqin,nrates,dt,maxiter,epsilon,t1,u1,du1,r1) ! in :{modname}:{modname}.f90
-            use solve_ida, only: y0,yp0,iout,rout,rates,dypdr
+        subroutine reinitialize(neqin,y0in,rtol,atol,id_vec) ! in :{modname}:{modname}.f90
+            use solve_ida, only: neq,y0,yp0,diff
+            integer, optional,intent(in),check(len(y0in)>=neqin),depend(y0in) :: neqin=len(y0in)
+            real*8 dimension(neqin),intent(in) :: y0in
+            real*8 intent(in) :: rtol
+            real*8 dimension(*),intent(in) :: atol
+            real*8 dimension(neqin),intent(in),depend(neqin) :: id_vec
+        end subroutine reinitialize
+        subroutine find_steady_state(neqin,nrates,dt,maxiter,epsilon,newton,t1,u1,du1,r1,niter,resnorm,converged,usednewton) ! in :{modname}:{modname}.f90
             integer intent(in) :: neqin
             integer intent(in) :: nrates
             real*8 intent(in) :: dt
             integer intent(in) :: maxiter
             real*8 intent(in) :: epsilon
+            integer intent(in) :: newton
             real*8 intent(out) :: t1
             real*8 intent(out),dimension(neqin),depend(neqin) :: u1
             real*8 intent(out),dimension(neqin),depend(neqin) :: du1
             real*8 intent(out),dimension(nrates),depend(nrates) :: r1
+            integer intent(out) :: niter
+            real*8 intent(out) :: resnorm
+            integer intent(out) :: converged
+            integer intent(out) :: usednewton
         end subroutine find_steady_state
+        subroutine find_steady_state_newton(neqin,nrates,nfixin,kforin,krevin,yfixin,y0in,dt,maxiter,epsilon,t1,u1,du1,r1,niter,resnorm,converged) ! in :{modname}:{modname}.f90
+            threadsafe
+            integer, optional,intent(in),check(len(y0in)>=neqin),depend(y0in) :: neqin=len(y0in)
+            integer, optional,intent(in),check(len(kforin)>=nrates),depend(kforin) :: nrates=len(kforin)
+            integer, optional,intent(in),check(len(yfixin)>=nfixin),depend(yfixin) :: nfixin=len(yfixin)
+            real*8 dimension(nrates),intent(in) :: kforin
+            real*8 dimension(nrates),intent(in),depend(nrates) :: krevin
+            real*8 dimension(nfixin),intent(in) :: yfixin
+            real*8 dimension(neqin),intent(in) :: y0in
+            real*8 intent(in) :: dt
+            integer intent(in) :: maxiter
+            real*8 intent(in) :: epsilon
+            real*8 intent(out) :: t1
+            real*8 intent(out),dimension(neqin),depend(neqin) :: u1
+            real*8 intent(out),dimension(neqin),depend(neqin) :: du1
+            real*8 intent(out),dimension(nrates),depend(nrates) :: r1
+            integer intent(out) :: niter
+            real*8 intent(out) :: resnorm
+            integer intent(out) :: converged
+        end subroutine find_steady_state_newton
+        subroutine linearize(neqin,nrates,nfixin,kforin,krevin,yfixin,yin,r1,drdy,jac) ! in :{modname}:{modname}.f90
+            integer, optional,intent(in),check(len(yin)>=neqin),depend(yin) :: neqin=len(yin)
+            integer, optional,intent(in),check(len(kforin)>=nrates),depend(kforin) :: nrates=len(kforin)
+            integer, optional,intent(in),check(len(yfixin)>=nfixin),depend(yfixin) :: nfixin=len(yfixin)
+            real*8 dimension(nrates),intent(in) :: kforin
+            real*8 dimension(nrates),intent(in),depend(nrates) :: krevin
+            real*8 dimension(nfixin),intent(in) :: yfixin
+            real*8 dimension(neqin),intent(in) :: yin
+            real*8 intent(out),dimension(nrates),depend(nrates) :: r1
+            real*8 intent(out),dimension(nrates,neqin),depend(nrates,neqin) :: drdy
+            real*8 intent(out),dimension(neqin,neqin),depend(neqin) :: jac
+        end subroutine linearize
+        subroutine find_steady_state_batch(neqin,nrates,nfixin,ncond,kforin,krevin,yfixin,y0in,rtol,atol,id_vec,dt,maxiter,epsilon,newton,t1,u1,du1,r1,niter,resnorm,converged,usednewton) ! in :{modname}:{modname}.f90
+            integer, optional,intent(in),check(shape(y0in,0)==neqin),depend(y0in) :: neqin=shape(y0in,0)
+            integer, optional,intent(in),check(shape(kforin,0)==nrates),depend(kforin) :: nrates=shape(kforin,0)
+            integer, optional,intent(in),check(shape(yfixin,0)==nfixin),depend(yfixin) :: nfixin=shape(yfixin,0)
+            integer, optional,intent(in),check(shape(kforin,1)==ncond),depend(kforin) :: ncond=shape(kforin,1)
+            real*8 dimension(nrates,ncond),intent(in) :: kforin
+            real*8 dimension(nrates,ncond),intent(in),depend(nrates,ncond) :: krevin
+            real*8 dimension(nfixin,ncond),intent(in),depend(ncond) :: yfixin
+            real*8 dimension(neqin,ncond),intent(in),depend(ncond) :: y0in
+            real*8 intent(in) :: rtol
+            real*8 dimension(neqin),intent(in),depend(neqin) :: atol
+            real*8 dimension(neqin),intent(in),depend(neqin) :: id_vec
+            real*8 intent(in) :: dt
+            integer intent(in) :: maxiter
+            real*8 intent(in) :: epsilon
+            integer intent(in) :: newton
+            real*8 intent(out),dimension(ncond),depend(ncond) :: t1
+            real*8 intent(out),dimension(neqin,ncond),depend(neqin,ncond) :: u1
+            real*8 intent(out),dimension(neqin,ncond),depend(neqin,ncond) :: du1
+            real*8 intent(out),dimension(nrates,ncond),depend(nrates,ncond) :: r1
+            integer intent(out),dimension(ncond),depend(ncond) :: niter
+            real*8 intent(out),dimension(ncond),depend(ncond) :: resnorm
+            integer intent(out),dimension(ncond),depend(ncond) :: converged
+            integer intent(out),dimension(ncond),depend(ncond) :: usednewton
+        end subroutine find_steady_state_batch
         subroutine solve(neqin,nrates,nt,tfinal,t1,u1,du1,r1) ! in :{modname}:{modname}.f90
             use solve_ida, only: y0,yp0,iout,rout,rates
             integer intent(in) :: neqin
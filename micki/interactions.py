@@ -0,0 +1,263 @@
+"""Lateral interactions between adsorbates described by a matrix of
+pairwise interaction energies"""
+
+from __future__ import print_function
+
+import numpy as np
+
+from ase.units import kB
+
+
+class LateralInteractions(object):
+    """Coverage dependence of mass-action rate constants due to pairwise
+    lateral interactions.
+
+    The energy of each of the nint interacting species i is shifted by
+
+        L[i] = sum_k E[i, k] * f(c[cols[k]]),  f(x) = max(x - thresholds[k], 0)
+
+    where c are the concentrations ordered as in MassAction and f(x) = x
+    if there are no thresholds. Nts[j, i] and dN[j, i] are the number of
+    times species i appears in the transition state of reaction j, and in
+    its products minus its reactants. Like the coverage-dependent energies
+    in Reaction.update, the shifts change the barriers through the
+    transition state and the transfer coefficient alpha, so that the rate
+    constants become
+
+        kfor[j] * exp(-gfor[j]),  gfor[j] = p1[j] Nts[j].L + p2[j] dN[j].L
+        krev[j] * exp(-grev[j]),  grev[j] = gfor[j] - p3[j] dN[j].L
+
+    with p1 = s / kB T, p2 = alpha s / kB T and p3 = 1 / kB T, s being the
+    scaling factor of dH_act. These depend on the temperature, so they are
+    passed at runtime in yfix after the nfix fixed concentrations, for
+    each of the reactions in self.reactions in turn. They are followed by
+    the nonzero elements of E, the thresholds and the nonzero elements of
+    A = Nts E and B = dN E (the derivatives of Nts.L and dN.L w.r.t. f),
+    so that only the sparsity pattern of E is hard-coded, and changing the
+    interaction energies does not change the generated code. pattern is
+    that sparsity pattern and thresholds whether there are thresholds."""
+
+    def __init__(self, pattern, cols, thresholds, Nts, dN, nconc, nfix):
+        self.pattern = np.array(pattern, dtype=bool)
+        self.nint, self.ncov = self.pattern.shape
+        self.cols = np.array(cols, dtype=int)
+        self.thresholds = bool(thresholds)
+        self.Nts = np.array(Nts, dtype=int)
+        self.dN = np.array(dN, dtype=int)
+        self.nrates = len(self.Nts)
+        self.nconc = nconc
+        self.offset = nfix
+
+        # Only reactions that involve an interacting species are affected
+        self.reactions = np.nonzero(np.any(self.Nts != 0, axis=1)
+                                    | np.any(self.dN != 0, axis=1))[0]
+        # Sparsity patterns of A and B
+        self.Apattern = np.dot(np.abs(self.Nts), self.pattern) > 0
+        self.Bpattern = np.dot(np.abs(self.dN), self.pattern) > 0
+        self._index = dict((j, m) for m, j in enumerate(self.reactions))
+        self._col = dict((i, k) for k, i in enumerate(self.cols))
+
+        # Positions of the runtime parameters in yfix (1-indexed, as they
+        # are printed into the Fortran code) following p1, p2 and p3
+        n = self.offset + 3 * len(self.reactions) + 1
+        self._E = {}
+        for i, k in zip(*np.nonzero(self.pattern)):
+            self._E[i, k] = n
+            n += 1
+        self._thresholds = {}
+        if self.thresholds:
+            for k in range(self.ncov):
+                self._thresholds[k] = n
+                n += 1
+        self._A = {}
+        self._B = {}
+        for pattern, index in [(self.Apattern, self._A),
+                               (self.Bpattern, self._B)]:
+            for m, k in zip(*np.nonzero(pattern[self.reactions])):
+                index[self.reactions[m], k] = n
+                n += 1
+
+    def parameters(self, reactions, E, thresholds):
+        """Returns the runtime parameters of the interactions E (of the
+        same sparsity pattern as self.pattern) and thresholds (or None)
+        stored in yfix, from p1, p2 and p3 of all affected reactions, which
+        have to be up to date, to the nonzero elements of B"""
+        E = np.array(E, dtype=float)
+        params = np.zeros((3, len(self.reactions)))
+        for m, j in enumerate(self.reactions):
+            rxn = reactions[j]
+            beta = 1. / (kB * rxn.T)
+            scale = 1.
+            if rxn.ts is not None:
+                scale = rxn.scale['dH_act']
+                alpha = float(rxn.alpha)
+            elif rxn.method == 'EQUIL':
+                # The forward rate constant is proportional to keq if the
+                # reaction is uphill, and otherwise the reverse one is
+                alpha = 1. if float(rxn.keq) < 1 else 0.
+            elif rxn.method in ['DIEQUIL', 'ER']:
+                raise ValueError("Lateral interactions are not supported "
+                                 "for {} reactions like {}!"
+                                 "".format(rxn.method, rxn))
+            else:
+                alpha = 0.
+            params[:, m] = [scale * beta, alpha * scale * beta, beta]
+        rxns = self.reactions
+        A = np.dot(self.Nts, E)[rxns]
+        B = np.dot(self.dN, E)[rxns]
+        if thresholds is None:
+            thresholds = []
+        return np.concatenate([params.ravel(), E[self.pattern], thresholds,
+                               A[self.Apattern[rxns]],
+                               B[self.Bpattern[rxns]]])
+
+    def _parameters(self, yfix):
+        """p1, p2 and p3 of the affected reactions, E, and the thresholds
+        (or None) from yfix"""
+        n = len(self.reactions)
+        p = np.asarray(yfix, dtype=float)[self.offset:]
+        E = np.zeros((self.nint, self.ncov))
+        nE = len(self._E)
+        E[self.pattern] = p[3 * n:3 * n + nE]
+        thresholds = None
+        if self.thresholds:
+            thresholds = p[3 * n + nE:3 * n + nE + self.ncov]
+        return p[:n], p[n:2 * n], p[2 * n:3 * n], E, thresholds
+
+    def _shifts(self, c, thresholds):
+        """f and its derivative at the concentrations c"""
+        x = c[self.cols]
+        if thresholds is None:
+            return x, np.ones(self.ncov)
+        return (np.maximum(x - thresholds, 0.),
+                np.array(x > thresholds, dtype=float))
+
+    def exponents(self, c, yfix):
+        """gfor and grev of all reactions"""
+        p1, p2, p3, E, thresholds = self._parameters(yfix)
+        f, df = self._shifts(c, thresholds)
+        lat = np.dot(E, f)
+        rxns = self.reactions
+        ts = np.dot(self.Nts[rxns], lat)
+        dn = np.dot(self.dN[rxns], lat)
+        gfor = np.zeros(self.nrates)
+        grev = np.zeros(self.nrates)
+        gfor[rxns] = p1 * ts + p2 * dn
+        grev[rxns] = gfor[rxns] - p3 * dn
+        return gfor, grev
+
+    def derivatives(self, c, yfix):
+        """Derivatives of gfor and grev w.r.t. the concentrations"""
+        p1, p2, p3, E, thresholds = self._parameters(yfix)
+        f, df = self._shifts(c, thresholds)
+        rxns = self.reactions
+        dA = np.dot(self.Nts[rxns], E) * df
+        dB = np.dot(self.dN[rxns], E) * df
+        dgfor = np.zeros((self.nrates, self.nconc))
+        dgrev = np.zeros((self.nrates, self.nconc))
+        rows = rxns[:, np.newaxis]
+        dgfor[rows, self.cols] = p1[:, np.newaxis] * dA \
+            + p2[:, np.newaxis] * dB
+        dgrev[rows, self.cols] = dgfor[rows, self.cols] \
+            - p3[:, np.newaxis] * dB
+        return dgfor, dgrev
+
+    def _p(self, which, j):
+        """Fortran name of p1, p2 or p3 of reaction j"""
+        m = self._index[j]
+        n = len(self.reactions)
+        return 'yfix({})'.format(self.offset + (which - 1) * n + m + 1)
+
+    def fortran_declarations(self):
+        return ['   real*8 :: lat({}), lf({}), ldf({})'.format(
+            self.nint, self.ncov, self.ncov)]
+
+    def fortran_rate_constants(self, names):
+        """Fortran code that multiplies the rate constants kf and kr by
+        exp(-gfor) and exp(-grev). names are the Fortran names of the
+        concentrations, as in MassAction."""
+        code = []
+        for k, i in enumerate(self.cols):
+            if not self.thresholds:
+                code.append('   lf({}) = {}'.format(k + 1, names[i]))
+                code.append('   ldf({}) = 1.d0'.format(k + 1))
+            else:
+                thr = 'yfix({})'.format(self._thresholds[k])
+                code.append('   if ({} > {}) then'.format(names[i], thr))
+                code.append('      lf({}) = {} - {}'.format(k + 1, names[i],
+                                                           thr))
+                code.append('      ldf({}) = 1.d0'.format(k + 1))
+                code.append('   else')
+                code.append('      lf({}) = 0.d0'.format(k + 1))
+                code.append('      ldf({}) = 0.d0'.format(k + 1))
+                code.append('   endif')
+
+        # Sparse matrix-vector product L = E f
+        for i, row in enumerate(self.pattern):
+            terms = ['yfix({}) * lf({})'.format(self._E[i, k], k + 1)
+                     for k in np.nonzero(row)[0]]
+            code.append('   lat({}) = {}'.format(i + 1,
+                                                 ' + '.join(terms) or '0.d0'))
+
+        for j in self.reactions:
+            ts = _fortran_dot(self.Nts[j], 'lat')
+            dn = _fortran_dot(self.dN[j], 'lat')
+            gfor = []
+            if ts is not None:
+                gfor.append('{} * ({})'.format(self._p(1, j), ts))
+            if dn is not None:
+                gfor.append('{} * ({})'.format(self._p(2, j), dn))
+            gfor = ' + '.join(gfor)
+            code.append('   kf({0}) = kf({0}) * exp(-({1}))'.format(j + 1,
+                                                                   gfor))
+            grev = gfor
+            if dn is not None:
+                grev += ' - {} * ({})'.format(self._p(3, j), dn)
+            code.append('   kr({0}) = kr({0}) * exp(-({1}))'.format(j + 1,
+                                                                   grev))
+        return code
+
+    def is_zero(self, j, i):
+        """Whether the rate constants of reaction j are independent of
+        c[i]"""
+        k = self._col.get(i)
+        return (k is None or j not in self._index
+                or not (self.Apattern[j, k] or self.Bpattern[j, k]))
+
+    def fortran_derivative(self, j, i, rfor, rrev):
+        """Fortran code for the derivative of the rate of reaction j w.r.t.
+        c[i] through its rate constants, or None if it is zero. rfor and
+        rrev are the code for its forward and reverse rates (rrev is None
+        for irreversible reactions)."""
+        if self.is_zero(j, i):
+            return None
+        k = self._col[i]
+        dgfor = []
+        if self.Apattern[j, k]:
+            dgfor.append('{} * yfix({})'.format(self._p(1, j),
+                                                self._A[j, k]))
+        if self.Bpattern[j, k]:
+            dgfor.append('{} * yfix({})'.format(self._p(2, j),
+                                                self._B[j, k]))
+        dgfor = ' + '.join(dgfor)
+        code = '-({}) * ({}) * ldf({})'.format(rfor, dgfor, k + 1)
+        if rrev is not None:
+            dgrev = dgfor
+            if self.Bpattern[j, k]:
+                dgrev += ' - {} * yfix({})'.format(self._p(3, j),
+                                                   self._B[j, k])
+            code += ' + ({}) * ({}) * ldf({})'.format(rrev, dgrev, k + 1)
+        return code
+
+
+def _fortran_dot(counts, name):
+    """Fortran code for sum_i counts[i] * name(i), or None if it is zero"""
+    terms = []
+    for i, n in enumerate(counts):
+        if n == 1:
+            terms.append('{}({})'.format(name, i + 1))
+        elif n != 0:
+            terms.append('({}) * {}({})'.format(n, name, i + 1))
+    if not terms:
+        return None
+    return ' + '.join(terms)
@@ -0,0 +1,196 @@
+"""Array-backed representation of mass-action rate expressions"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+class MassAction(object):
+    """Rates of mass-action reactions, described by the orders of each
+    concentration in the forward and reverse rates instead of by symbolic
+    expressions.
+
+    The concentrations c are ordered as the nvariables variables of the
+    differential equations, followed by the nvac vacancies and then the
+    fixed species. Nf[j, i] and Nr[j, i] are the orders of c[i] in the
+    forward and reverse rates of reaction j, such that
+
+        r[j] = kfor[j] * exp(Nf[j] . log(c)) - krev[j] * exp(Nr[j] . log(c))
+
+    Only reactions flagged in active are handled here. The rates and
+    derivatives of all other reactions (e.g. those with coverage-dependent
+    rate constants) are zero. The rate constants of the active reactions
+    may depend on the concentrations through lateral interactions (see
+    micki.interactions)."""
+
+    def __init__(self, Nf, Nr, active, reversible, nvariables, nvac,
+                 interactions=None):
+        self.Nf = np.array(Nf, dtype=int)
+        self.Nr = np.array(Nr, dtype=int)
+        self.nrates, self.nconc = self.Nf.shape
+        self.active = np.array(active, dtype=bool)
+        self.reversible = np.array(reversible, dtype=bool)
+        self.nvariables = nvariables
+        self.nvac = nvac
+        self.interactions = interactions
+
+        # The reverse rate of irreversible reactions is never evaluated
+        self.Nr[~self.reversible] = 0
+        # Orders of all reactions, including the inactive ones
+        self.orders = (self.Nf.copy(), self.Nr.copy())
+        self._all = (self._sparse_orders(self.Nf),
+                     self._sparse_orders(self.Nr))
+        self.Nf[~self.active] = 0
+        self.Nr[~self.active] = 0
+        self._krev_mask = np.array(self.active & self.reversible, dtype=float)
+
+        self._forward = self._sparse_orders(self.Nf)
+        self._reverse = self._sparse_orders(self.Nr)
+
+    @staticmethod
+    def _sparse_orders(N):
+        """Returns the nonzero orders of N, together with the pairs of
+        entries that belong to the same reaction."""
+        rows, cols = np.nonzero(N)
+        orders = N[rows, cols]
+        entries = {}
+        for a, row in enumerate(rows):
+            entries.setdefault(row, []).append(a)
+        pairs = [(a, b) for group in entries.values()
+                 for a in group for b in group if a != b]
+        if pairs:
+            first, second = [np.array(x, dtype=int) for x in zip(*pairs)]
+        else:
+            first = second = np.zeros(0, dtype=int)
+        return rows, cols, orders, first, second
+
+    def _concentrations(self, y, vac, yfix):
+        nfix = self.nconc - self.nvariables - self.nvac
+        return np.concatenate([np.asarray(y, dtype=float),
+                               np.asarray(vac, dtype=float),
+                               np.asarray(yfix, dtype=float)[:nfix]])
+
+    def _products(self, c, sparse):
+        # exp(N . log(c)) evaluated as a product of integer powers, which
+        # is also well defined for the zero or slightly negative
+        # concentrations the integrator may produce.
+        rows, cols, orders, first, second = sparse
+        prod = np.ones(self.nrates)
+        np.multiply.at(prod, rows, c[cols]**orders)
+        return prod
+
+    def _derivatives(self, c, sparse):
+        """Derivatives of the products w.r.t. the concentrations"""
+        rows, cols, orders, first, second = sparse
+        # Product of all other factors of the same reaction, which avoids
+        # dividing by concentrations that may be zero
+        others = np.ones(len(rows))
+        np.multiply.at(others, first, c[cols[second]]**orders[second])
+        dprod = np.zeros((self.nrates, self.nconc))
+        dprod[rows, cols] = orders * c[cols]**(orders - 1) * others
+        return dprod
+
+    def _rate_constants(self, c, kfor, krev, yfix):
+        """Rate constants including the lateral interactions at c"""
+        if self.interactions is None:
+            return kfor, krev
+        gfor, grev = self.interactions.exponents(c, yfix)
+        return kfor * np.exp(-gfor), krev * np.exp(-grev)
+
+    def rates(self, y, vac, kfor, krev, yfix):
+        """Rates of all reactions"""
+        c = self._concentrations(y, vac, yfix)
+        kfor, krev = self._rate_constants(c, kfor, krev, yfix)
+        rfor = kfor * self._products(c, self._forward)
+        rrev = krev * self._products(c, self._reverse)
+        return self.active * rfor - self._krev_mask * rrev
+
+    def fluxes(self, y, vac, kfor, krev, yfix):
+        """Forward and reverse rates of all reactions, active or not. The
+        rate constants of inactive reactions must be given as numbers."""
+        c = self._concentrations(y, vac, yfix)
+        kfor, krev = self._rate_constants(c, kfor, krev, yfix)
+        rfor = kfor * self._products(c, self._all[0])
+        rrev = krev * self._products(c, self._all[1])
+        return rfor, self.reversible * rrev
+
+    def jacobian(self, y, vac, kfor, krev, yfix):
+        """Derivatives of all rates w.r.t. the variables and vacancies"""
+        c = self._concentrations(y, vac, yfix)
+        kfor, krev = self._rate_constants(c, kfor, krev, yfix)
+        drdc = kfor[:, np.newaxis] * self._derivatives(c, self._forward)
+        drdc -= krev[:, np.newaxis] * self._derivatives(c, self._reverse)
+        if self.interactions is not None:
+            # The rate constants depend on c as well
+            rfor = self.active * kfor * self._products(c, self._forward)
+            rrev = self._krev_mask * krev * self._products(c, self._reverse)
+            dgfor, dgrev = self.interactions.derivatives(c, yfix)
+            drdc -= rfor[:, np.newaxis] * dgfor - rrev[:, np.newaxis] * dgrev
+        nvar = self.nvariables
+        return drdc[:, :nvar], drdc[:, nvar:nvar + self.nvac]
+
+    def is_zero(self, j, i):
+        """Whether the derivative of rate j w.r.t. c[i] vanishes"""
+        if self.interactions is not None and self.active[j] \
+                and not self.interactions.is_zero(j, i):
+            return False
+        return self.Nf[j, i] == 0 and self.Nr[j, i] == 0
+
+    @staticmethod
+    def _fortran_term(k, orders, names, i=None):
+        """Fortran code for k * prod(c**orders), or for its derivative
+        w.r.t. c[i]."""
+        factors = [k]
+        if i is not None:
+            if orders[i] == 0:
+                return None
+            if orders[i] > 1:
+                factors.insert(0, str(orders[i]))
+        for l in np.nonzero(orders)[0]:
+            n = orders[l] - 1 if l == i else orders[l]
+            if n == 1:
+                factors.append(names[l])
+            elif n > 1:
+                factors.append('{}**{}'.format(names[l], n))
+        return ' * '.join(factors)
+
+    def fortran_fluxes(self, j, names, kfor='kfor', krev='krev'):
+        """Fortran code for the forward and reverse rates of reaction j,
+        the latter None if it is irreversible. names are the Fortran names
+        of the concentrations, e.g. y(1) or vac(1), and kfor and krev
+        those of the arrays of rate constants."""
+        rfor = self._fortran_term('{}({})'.format(kfor, j + 1), self.Nf[j],
+                                  names)
+        rrev = None
+        if self.reversible[j]:
+            rrev = self._fortran_term('{}({})'.format(krev, j + 1),
+                                      self.Nr[j], names)
+        return rfor, rrev
+
+    def fortran_rate(self, j, names, kfor='kfor', krev='krev'):
+        """Fortran code for the rate of reaction j"""
+        rfor, rrev = self.fortran_fluxes(j, names, kfor, krev)
+        if rrev is None:
+            return rfor
+        return rfor + ' - ' + rrev
+
+    def fortran_derivative(self, j, i, names, kfor='kfor', krev='krev'):
+        """Fortran code for the derivative of the rate of reaction j w.r.t.
+        c[i], or None if it is zero. Lateral interactions add to it."""
+        dfor = self._fortran_term('{}({})'.format(kfor, j + 1), self.Nf[j],
+                                  names, i)
+        drev = self._fortran_term('{}({})'.format(krev, j + 1), self.Nr[j],
+                                  names, i)
+        terms = []
+        if dfor is not None:
+            terms.append(dfor)
+        if drev is not None:
+            terms.append('-' + drev)
+        if self.interactions is not None:
+            rfor, rrev = self.fortran_fluxes(j, names, kfor, krev)
+            dk = self.interactions.fortran_derivative(j, i, rfor, rrev)
+            if dk is not None:
+                terms.append(dk)
+        if not terms:
+            return None
+        return ' + '.join(terms).replace('+ -', '- ')
@@ -3,11 +3,11 @@
 from __future__ import print_function
 
 import os
-import tempfile
-import shutil
+import weakref
 import warnings
+import threading
 
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 import numpy as np
 import sympy as sym
@@ -16,9 +16,98 @@ from copy import copy
 from ase.units import kB, _hplanck, kg, _k, _Nav, mol
 
 from micki.reactants import _Thermo, _Fluid, _Reactants, Gas, Liquid, Adsorbate
-from micki.reactants import Electron
+from micki.reactants import Electron, _ScaleDict
 
 from micki.lattice import Lattice
+from micki.massaction import MassAction
+from micki.interactions import LateralInteractions
+from micki.thermoarrays import ThermoArrays, _calc_alpha
+from micki.ramp import ramp_temperatures, fit_arrhenius
+from micki.cache import get_module
+
+try:
+    from sympy.printing.fortran import FCodePrinter
+except ImportError:
+    from sympy.printing.fcode import FCodePrinter
+
+# Models with more variables than this use a sparse Jacobian by default
+SPARSE_THRESHOLD = 200
+
+# SUNDIALS' FCMIX interface keeps a single IDA instance per process, shared
+# by all solver modules. Everything that touches it holds this lock, while
+# the Newton steady-state search runs without it (and without the GIL).
+_ida_lock = threading.RLock()
+
+# The model whose parameters and initial values were last loaded into the
+# IDA instance, and the solver module it was set up by (weak references)
+_ida_owner = (None, None)
+
+# Everything set_initial_conditions derives from the network when it
+# generates a solver module. Copies of a model share these with it.
+_KERNEL_ATTRIBUTES = ['symbols_all', 'symbols_dict', 'symbols', 'vac_sym',
+                      'M', 'rates', 'dypdr', 'massaction', 'drdy', 'drdvac',
+                      'cse_report', '_solve_ida', '_signature']
+
+# Outcome of a steady-state search: whether it converged, the number of
+# Newton steps and/or output times it took, the final residual norm
+# max|dU/dt|, the simulated time and the method that finished the search.
+ConvergenceReport = namedtuple('ConvergenceReport', ['converged', 'iterations',
+                                                     'residual', 'time',
+                                                     'method'])
+
+
+def _is_symbolic(expr):
+    """Returns True if expr depends on any symbols (e.g. coverages)"""
+    return isinstance(expr, sym.Basic) and len(expr.free_symbols) > 0
+
+
+def _cse_fcode(lhs, exprs, printer):
+    """Generates Fortran assignments lhs[i] = exprs[i], with common
+    subexpressions shared between all expressions pulled out into
+    temporaries.
+
+    Returns the code, the declarations of the temporaries, and the number
+    of operations before and after elimination."""
+    exprs = [sym.sympify(expr) for expr in exprs]
+    before = sum(sym.count_ops(expr) for expr in exprs)
+    temps, reduced = sym.cse(exprs, symbols=sym.numbered_symbols('cse'))
+    after = sum(sym.count_ops(expr) for temp, expr in temps)
+    after += sum(sym.count_ops(expr) for expr in reduced)
+
+    code = []
+    for temp, expr in temps:
+        code.append('   {} = '.format(temp) + printer(expr))
+    for name, expr in zip(lhs, reduced):
+        code.append('   {} = '.format(name) + printer(expr))
+
+    names = [str(temp) for temp, expr in temps]
+    decl = []
+    for i in range(0, len(names), 8):
+        decl.append('   real*8 :: ' + ', '.join(names[i:i + 8]))
+
+    return code, decl, before, after
+
+
+class _ModelPrinter(FCodePrinter):
+    """Fortran printer that writes model symbols directly as elements of
+    the solver arrays, e.g. y(3) or vac(1)."""
+
+    def __init__(self, trans, settings=None):
+        if settings is None:
+            settings = {}
+        settings.setdefault('source_format', 'free')
+        FCodePrinter.__init__(self, settings)
+        self._trans = trans
+
+    def _print_Symbol(self, expr):
+        name = self._trans.get(expr)
+        if name is not None:
+            return name
+        return FCodePrinter._print_Symbol(self, expr)
+
+    def wrap(self, lines):
+        """Splits generated lines that are too long for Fortran"""
+        return self._wrap_fortran(lines)
 
 
 class Reaction(object):
@@ -131,11 +220,16 @@ class Reaction(object):
         self.alpha = None
         self.reversible = reversible
 
+        # Incremented whenever a scaling factor is changed. Together with
+        # the revisions of all species it tells whether the rate constants
+        # are out of date.
+        self._version = 0
+        self._inputs = None
+
         # Scaling for sensitivity analysis, defaults to 1 (no scaling)
-        self.scale = OrderedDict() 
+        self.scale = _ScaleDict(self._touch)
         for param in self.scale_params:
             self.scale[param] = 1.0
-        self.scale_old = self.scale.copy()
 
         # If the user supplied a TS, this should be None.
         self.dG_act = dG_act
@@ -188,12 +282,26 @@ class Reaction(object):
         except KeyError:
             print("{} is not a valid scaling parameter name!".format(param))
 
+    def _touch(self):
+        self._version += 1
+
+    def _get_inputs(self):
+        inputs = [self._version]
+        inputs += [species.revision for species in self.species]
+        if self.ts is not None:
+            inputs += [species.revision for species in self.ts]
+        return inputs
+
     def update(self, T=None, Asite=None, L=None, force=False):
+        """Recalculates the rate constants if anything they depend on has
+        changed, or if force is True. Species are only recalculated if
+        they are out of date themselves, so that a species shared between
+        many reactions is evaluated once per change."""
         if not force and not self.is_update_needed(T, Asite, L):
             return
 
         for species in self.species:
-            species.update(T=T, force=True)
+            species.update(T=T)
 
         self.T = T
         self.Asite = Asite
@@ -205,7 +313,7 @@ class Reaction(object):
         self.dG = self.dH - self.T * self.dS
         if self.ts is not None:
             for species in self.ts:
-                species.update(T=T, force=True)
+                species.update(T=T)
 
             Gts = self.ts.get_G(T)
             Gr = self.reactants.get_G(T)
@@ -222,22 +330,32 @@ class Reaction(object):
             if dGr < 0:
                 raise RuntimeError('Reaction {} has negative reverse activation barrier!'.format(self))
 
-            all_symbols = set()
-            all_symbols.update(sym.sympify(dEr).atoms(sym.Symbol))
-            all_symbols.update(sym.sympify(dEp).atoms(sym.Symbol))
-
-            if sym.sympify(dEp - dEr).subs({symbol: 0 for symbol in all_symbols}) == 0:
-                self.alpha = dGf / (dGf + dGr)
+            if not any(isinstance(x, sym.Basic)
+                       for x in (dGf, dGr, dEr, dEp)):
+                # Without coverage dependence, evaluate the closed-form
+                # root numerically instead of through SymPy
+                self.alpha = float(_calc_alpha(dGf, dGr, dEr, dEp))
+                if np.isnan(self.alpha):
+                    raise RuntimeError("Couldn't find alpha parameter for {}!".format(self))
             else:
-                a1 = (2*dEp - 2*dEr - dGf - dGr - sym.sqrt(8*(dEp-dEr)*dGf + (-2*dEp + 2*dEr + dGf + dGr)**2))/(4*(dEp-dEr))
-                a1 = sym.sympify(a1).subs({symbol: 0 for symbol in all_symbols})
-                if isinstance(a1, sym.Float) and 0. <= a1 <= 1:
-                    self.alpha = a1
+                all_symbols = set()
+                all_symbols.update(sym.sympify(dEr).atoms(sym.Symbol))
+                all_symbols.update(sym.sympify(dEp).atoms(sym.Symbol))
+
+                if sym.sympify(dEp - dEr).subs({symbol: 0 for symbol in all_symbols}) == 0:
+                    self.alpha = dGf / (dGf + dGr)
                 else:
-                    a2 = (2*dEp - 2*dEr - dGf - dGr + sym.sqrt(8*(dEp-dEr)*dGf + (-2*dEp + 2*dEr + dGf + dGr)**2))/(4*(dEp-dEr))
-                    self.alpha = sym.sympify(a2).subs({symbol: 0 for symbol in all_symbols})
-                    if not isinstance(self.alpha, sym.Float) or not (0. <= self.alpha <= 1.):
-                        raise RuntimeError("Couldn't find alpha parameter for {}!".format(self))
+                    a1 = (2*dEp - 2*dEr - dGf - dGr - sym.sqrt(8*(dEp-dEr)*dGf + (-2*dEp + 2*dEr + dGf + dGr)**2))/(4*(dEp-dEr))
+                    a1 = sym.sympify(a1).subs({symbol: 0 for symbol in all_symbols})
+                    # A root on the edge of [0, 1] may come out as an
+                    # exact SymPy zero or one rather than a Float
+                    if a1.is_real and 0. <= a1 <= 1:
+                        self.alpha = a1
+                    else:
+                        a2 = (2*dEp - 2*dEr - dGf - dGr + sym.sqrt(8*(dEp-dEr)*dGf + (-2*dEp + 2*dEr + dGf + dGr)**2))/(4*(dEp-dEr))
+                        self.alpha = sym.sympify(a2).subs({symbol: 0 for symbol in all_symbols})
+                        if not self.alpha.is_real or not (0. <= self.alpha <= 1.):
+                            raise RuntimeError("Couldn't find alpha parameter for {}!".format(self))
 
             self.dH_act = self.ts.get_H(T) + (1 - self.alpha) * dEr + self.alpha * dEp - self.reactants.get_H(T)
             self.dH_act *= self.scale['dH_act']
@@ -276,12 +394,16 @@ class Reaction(object):
         self._calc_keq()
         self._calc_kfor()
         self._calc_krev()
-        self.scale_old = self.scale.copy()
+        self._inputs = self._get_inputs()
 
     def is_update_needed(self, T, Asite, L):
         for species in self.species:
             if species.is_update_needed(T):
                 return True
+        if self.ts is not None:
+            for species in self.ts:
+                if species.is_update_needed(T):
+                    return True
         if self.keq is None:
             return True
         if T is not None and T != self.T:
@@ -290,10 +412,7 @@ class Reaction(object):
             return True
         if L is not None and L != self.L:
             return True
-        for param in self.scale_params:
-            if self.scale[param] != self.scale_old[param]:
-                return True
-        return False
+        return self._inputs != self._get_inputs()
 
     def get_keq(self, T=None, Asite=None, L=None):
         self.update(T, Asite, L)
@@ -346,11 +465,11 @@ class Reaction(object):
                     found_fluid = True
                     fluid = species
             Sfluid = fluid.get_S(self.T)
-            fluid._calc_qtrans2D(self.T, self.Asite)
+            q2D, E2D, S2D = fluid._calc_qtrans2D(self.T, self.Asite)
             Strans = Sfluid - fluid.S['elec'] - fluid.S['rot'] - fluid.S['vib']
             Slost = Strans / fluid.S['trans']
-            dS = (fluid.S['trans2D'] - fluid.S['trans']) * Slost
-            dG = fluid.E['trans2D'] - fluid.E['trans'] - self.T * dS
+            dS = (S2D - fluid.S['trans']) * Slost
+            dG = E2D - fluid.E['trans'] - self.T * dS
             self.kfor = barr * _k * self.T / _hplanck * np.exp(-dG / (kB * self.T))
             self.kfor *= self.scale['kfor']
         elif self.method == 'ER':
@@ -426,9 +545,12 @@ class Reaction(object):
 
 
 class Model(object):
-    def __init__(self, T, Asite, z=0, lattice=None, reactor='CSTR', rhocat=1):
+    def __init__(self, T, Asite, z=0, lattice=None, reactor='CSTR', rhocat=1,
+                 backend='fortran', scipy_method='BDF', linear_solver='auto'):
         self.reactions = OrderedDict()
         self._reactions = []
+        # Array-backed thermochemistry of all reactions, built on first use
+        self._thermo = None
         self._species = []
         self.species = OrderedDict()
         self.vacancy = []
@@ -438,6 +560,12 @@ class Model(object):
         self.initialized = False
         self.U0 = None
         self.rhocat = rhocat
+        # Lateral interaction matrix, see set_interactions
+        self._interactions = None
+        # Describes the network the compiled module was generated for
+        self._signature = None
+        # Outcome of the last steady-state search
+        self.convergence = None
 
         self.T = T  # System temperature
         self.Asite = Asite  # Area of adsorption site
@@ -445,6 +573,19 @@ class Model(object):
         self.lattice = lattice
         self.reactor = reactor
 
+        # Either 'fortran' (compiled module using SUNDIALS IDA) or 'scipy'
+        # (NumPy rate expressions integrated with scipy's BDF or Radau)
+        if backend not in ['fortran', 'scipy']:
+            raise ValueError("Unknown backend {}!".format(backend))
+        self.backend = backend
+        self.scipy_method = scipy_method
+
+        # Either 'dense' (LAPACK), 'sparse' (KLU) or 'auto', which uses the
+        # sparse solver for models with more than SPARSE_THRESHOLD variables
+        if linear_solver not in ['auto', 'dense', 'sparse']:
+            raise ValueError("Unknown linear solver {}!".format(linear_solver))
+        self.linear_solver = linear_solver
+
     def add_reactions(self, reactions):
         # Set up list of reactions and species
         for name, reaction in reactions.items():
@@ -453,6 +594,7 @@ class Model(object):
                 return
             self._reactions.append(reaction)
             self.reactions[name] = reaction
+            self._thermo = None
             for species in reaction.species:
                 self._add_species(species)
             if reaction.ts is not None:
@@ -499,10 +641,22 @@ class Model(object):
                 else:
                     self.vacspecies[site].append(species)
 
+    def _update_reactions(self, force=False):
+        """Recalculates the rate constants of all reactions at the current
+        conditions, in a few array operations for the whole model where
+        possible (see micki.thermoarrays)"""
+        if not self._reactions:
+            return
+        if self._thermo is None:
+            self._thermo = ThermoArrays(self._reactions)
+        if self._thermo.update(self.T, self.Asite, self.z, force):
+            return
+        for reaction in self._reactions:
+            reaction.update(T=self.T, Asite=self.Asite, L=self.z, force=force)
+
     def set_T(self, T):
         self._T = T
-        for reaction in self._reactions:
-            reaction.update(T=T, Asite=self.Asite)
+        self._update_reactions()
         if self.U0 is not None:
             self.set_initial_conditions(self.U0)
 
@@ -513,8 +667,7 @@ class Model(object):
 
     def set_Asite(self, Asite):
         self._Asite = Asite
-        for reaction in self._reactions:
-            reaction.update(T=self.T, Asite=Asite)
+        self._update_reactions()
         if self.U0 is not None:
             self.set_initial_conditions(self.U0)
 
@@ -526,8 +679,7 @@ class Model(object):
     def set_z(self, z):
         self._z = z
         self.check_diffusion()
-        for reaction in self._reactions:
-            reaction.update(L=z)
+        self._update_reactions()
         if self.U0 is not None:
             self.set_initial_conditions(self.U0)
 
@@ -553,93 +705,46 @@ class Model(object):
 
     lattice = property(get_lattice, set_lattice, doc='Model lattice')
 
+    def set_thermo_table(self, Tmin, Tmax, dT=10., tol=1e-6):
+        """Tabulates the thermodynamic properties of all species, including
+        transition states, between Tmin and Tmax (see
+        _Thermo.set_thermo_table). Rate constants at new temperatures are
+        then calculated from interpolated properties, which speeds up
+        temperature sweeps and ramps. The tables grow as needed."""
+        for species in self._get_all_thermo():
+            species.set_thermo_table(Tmin, Tmax, dT, tol)
+
+    def clear_thermo_table(self):
+        for species in self._get_all_thermo():
+            species.clear_thermo_table()
+
+    def _get_all_thermo(self):
+        thermo = []
+        for reaction in self._reactions:
+            for reactants in [reaction.reactants, reaction.products,
+                              reaction.ts]:
+                if reactants is None:
+                    continue
+                for species in reactants.species:
+                    if species not in thermo:
+                        thermo.append(species)
+        return thermo
+
     def set_initial_conditions(self, U0):
         if self.initialized:
             self.finalize()
 
-        # Reorder species such that Liquid -> Gas -> Adsorbate -> Vacancy
-        # Steady-state species go to the end.
-        newspecies = []
-        for species in self._species:
-            if isinstance(species, Liquid):
-                newspecies.append(species)
-        for species in self._species:
-            if isinstance(species, (Gas, Electron)):
-                newspecies.append(species)
-        for species in self._species:
-            if isinstance(species, Adsorbate):
-                newspecies.append(species)
-        self._species = newspecies
-
-        # Also obtain a list of species that will be variables in the
-        # differential equations. This excludes fixed species and empty
-        # sites.
-        self._variable_species = []
-        for species in self._species:
-            if species.label not in self.fixed + [self.solvent]:
-                self._variable_species.append(species)
-        self.nvariables = len(self._variable_species)
-
-        # Start with the incomplete user-provided initial conditions
-        self.U0 = U0.copy()
-
-        # Initialize counter for vacancies
-        occsites = {species: 0 for species in self.vacancy}
+        self._set_U0(U0)
 
-        for name in self.U0:
-            try:
-                species = self.species[name]
-            except KeyError:
-                for species in self.vacancy:
-                    if species.label == name:
-                        break
-                else:
-                    raise ValueError('Species {} is unknown!'.format(name))
-
-            # Ignore all initial conditions for the number of empty sites
-            if species in self.vacancy:
-                warnings.warn('Initial condition for vacancy concentration '
-                              'ignored.', RuntimeWarning, stacklevel=2)
-                continue
-
-            # Throw an error if the user provides the concentration for a
-            # species we don't know about
-            if species not in self._species:
-                raise ValueError("Unknown species {}!".format(species))
-
-            # If the species occupies a site, add its concentration to the
-            # occupied sites counter
-            if species.sites is not None:
-                for site in species.sites:
-                    occsites[site] += self.U0[name]
-
-        self.dvacdy = np.zeros((len(self.vacancy), self.nvariables), dtype=int)
-        self.vactot = {}
-        # Determine what the initial vacancy concentration should be
-        for i, vac in enumerate(self.vacancy):
-            name = vac.label
-            # If a vacancy species is part of the lattice, get its maximum
-            # concentration from its relative abundance. Otherwise, assume
-            # it is 1.
-            if self.lattice is not None and vac in self.lattice.sites:
-                self.vactot[vac] = self.lattice.ratio[vac]
-            else:
-                self.vactot[vac] = 1.
-            # Make sure there isn't too much stuff occupying each kind of
-            # site on the surface.
-            assert occsites[vac] <= self.vactot[vac], \
-                    "Too many adsorbates on {}!".format(vac)
-            # Normalize the concentration of empty sites to match the
-            # appropriate site ratio from the lattice.
-            self.U0[name] = self.vactot[vac] - occsites[vac]
-            for j, species in enumerate(self._variable_species):
-                self.dvacdy[i, j] = -species.sites.count(vac)
-
-        # Populate dictionary of initial conditions for all species
-        for name, species in self.species.items():
-            # Assume concentration of unnamed species is 0
-            if name not in self.U0:
-                self.U0[name] = 0.
+        # If nothing that the generated code depends on has changed, the
+        # already-loaded module can be re-used. Only the rate constants,
+        # fixed concentrations and initial values need to be updated.
+        signature = self._get_signature()
+        if signature == self._signature:
+            self.kfor, self.krev = self._get_rate_constants()
+            self.yfix = self._get_fixed_concentrations()
+            self._initialize_solver(reinit=True)
+            return
 
         # The number of variables that will be in our differential equations
         size = len(self._species)
@@ -688,10 +793,6 @@ class Model(object):
                 if isinstance(species, Adsorbate):
                     self.M[i, i] = 0
 
-        # algvar tells the solver which variables are differential
-        # and which are algebraic. It is the diagonal of the mass matrix.
-        algvar = np.array(self.M.diagonal(), dtype=float)
-
         # Initialize all rate expressions based on the above symbols
         nrxns = len(self._reactions)
         # Array of symbolic rate expressions
@@ -699,6 +800,25 @@ class Model(object):
         # Array of rate coefficients.
         self.dypdr = np.zeros((self.nvariables, nrxns), dtype=float)
 
+        # Numerical rate constants are not hard-coded into the rate
+        # expressions. Instead, they are passed to the compiled module at
+        # runtime through the kfor and krev arrays, so changing the
+        # temperature or scaling a reaction does not change the generated
+        # code. Coverage-dependent rate constants are still hard-coded.
+        kfor_vec = sym.IndexedBase('kfor', shape=(nrxns,))
+        krev_vec = sym.IndexedBase('krev', shape=(nrxns,))
+        self.kfor, self.krev = self._get_rate_constants()
+
+        # Reactions whose rate constants do not depend on the coverages
+        # follow the law of mass action. They are fully described by the
+        # orders of each concentration (variables, then vacancies, then
+        # fixed species) and are never turned into SymPy expressions.
+        conc_species = (self._variable_species + self.vacancy
+                        + self._fixed_species)
+        Nf = np.zeros((nrxns, len(conc_species)), dtype=int)
+        Nr = np.zeros((nrxns, len(conc_species)), dtype=int)
+        massaction = np.zeros(nrxns, dtype=bool)
+
         for j, rxn in enumerate(self._reactions):
             rate_for = rxn.get_kfor(self.T, self.Asite, self.z)
             rate_rev = rxn.get_krev(self.T, self.Asite, self.z)
@@ -710,6 +830,22 @@ class Model(object):
                 if isinstance(species, _Fluid) and rxn.involves_catalyst:
                     self.dypdr[i, j] *= self.rhocat
 
+            for i, species in enumerate(conc_species):
+                if not isinstance(species, Electron):
+                    Nf[j, i] = rxn.reactants.species.count(species)
+                    Nr[j, i] = rxn.products.species.count(species)
+
+            if not (_is_symbolic(rate_for)
+                    or (rxn.reversible and _is_symbolic(rate_rev))):
+                massaction[j] = True
+                self.rates[j] = sym.S.Zero
+                continue
+
+            if not _is_symbolic(rate_for):
+                rate_for = kfor_vec[j + 1]
+            if not _is_symbolic(rate_rev):
+                rate_rev = krev_vec[j + 1]
+
             for species in self._species + self.vacancy:
                 rcount = rxn.reactants.species.count(species)
                 pcount = rxn.products.species.count(species)
@@ -730,24 +866,43 @@ class Model(object):
             unknown_symbols.update(rate.atoms(sym.Symbol))
         unknown_symbols -= known_symbols
         unknown_symbols -= set(self.symbols_all)
+        unknown_symbols -= {kfor_vec.label, krev_vec.label}
         subs.update({symbol: 0 for symbol in unknown_symbols})
 
         # Fixed species must have their symbols replaced by their fixed
-        # initial values.
-        for species in self._species:
-            if species.label in self.fixed or species.label == self.solvent:
-                label = species.label
-                subs[species.symbol] = self.U0[label]
+        # initial values. Like the rate constants, these are passed to the
+        # compiled module at runtime through the yfix array.
+        yfix_vec = sym.IndexedBase('yfix', shape=(len(self._fixed_species),))
+        for k, species in enumerate(self._fixed_species):
+            subs[species.symbol] = yfix_vec[k + 1]
 
         # Additionally, fixed species concentrations into rate
         # expressions
         for i, r in enumerate(self.rates):
             self.rates[i] = sym.sympify(r).subs(subs)
 
-        # derivative of rate expressions w.r.t. concentrations and vacancies
+        interactions = self._get_lateral_interactions(conc_species)
+        if interactions is not None:
+            for j in interactions.reactions:
+                if not massaction[j]:
+                    raise ValueError("Reaction {} has coverage-dependent "
+                                     "rate constants and cannot have "
+                                     "lateral interactions as well!"
+                                     "".format(self._reactions[j]))
+        self.massaction = MassAction(Nf, Nr, massaction,
+                                     [rxn.reversible for rxn in self._reactions],
+                                     self.nvariables, len(self.vacancy),
+                                     interactions)
+        self.yfix = self._get_fixed_concentrations()
+
+        # derivative of rate expressions w.r.t. concentrations and vacancies.
+        # The derivatives of mass-action rates are calculated from the
+        # reaction orders instead.
         self.drdy = np.zeros((nrxns, self.nvariables), dtype=object)
         self.drdvac = np.zeros((nrxns, len(self.vacancy)), dtype=object)
         for i, rate in enumerate(self.rates):
+            if massaction[i]:
+                continue
             for j, symbol in enumerate(self.symbols):
                 self.drdy[i, j] = sym.diff(rate, symbol)
             for j, vac in enumerate(self.vacancy):
@@ -755,73 +910,380 @@ class Model(object):
 
         # Sets up and compiles the Fortran differential equation solving module
         self.setup_execs()
+        self._signature = signature
+
+        self._initialize_solver()
+
+    def _set_U0(self, U0):
+        """Orders the species and completes the initial conditions U0 with
+        the vacancy concentrations and zeros for all unnamed species."""
+        # Reorder species such that Liquid -> Gas -> Adsorbate -> Vacancy
+        # Steady-state species go to the end.
+        newspecies = []
+        for species in self._species:
+            if isinstance(species, Liquid):
+                newspecies.append(species)
+        for species in self._species:
+            if isinstance(species, (Gas, Electron)):
+                newspecies.append(species)
+        for species in self._species:
+            if isinstance(species, Adsorbate):
+                newspecies.append(species)
+        self._species = newspecies
+
+        # Also obtain a list of species that will be variables in the
+        # differential equations. This excludes fixed species and empty
+        # sites.
+        self._variable_species = []
+        self._fixed_species = []
+        for species in self._species:
+            if species.label not in self.fixed + [self.solvent]:
+                self._variable_species.append(species)
+            else:
+                self._fixed_species.append(species)
+        self.nvariables = len(self._variable_species)
 
-        # Convert the dictionary U0 of initial conditions into a list that can
-        # be used with the Fortran module.
-        U0 = []
+        # Start with the incomplete user-provided initial conditions
+        self.U0 = U0.copy()
+
+        # Initialize counter for vacancies
+        occsites = {species: 0 for species in self.vacancy}
+
+        for name in self.U0:
+            try:
+                species = self.species[name]
+            except KeyError:
+                for species in self.vacancy:
+                    if species.label == name:
+                        break
+                else:
+                    raise ValueError('Species {} is unknown!'.format(name))
+
+            # Ignore all initial conditions for the number of empty sites
+            if species in self.vacancy:
+                warnings.warn('Initial condition for vacancy concentration '
+                              'ignored.', RuntimeWarning, stacklevel=3)
+                continue
+
+            # Throw an error if the user provides the concentration for a
+            # species we don't know about
+            if species not in self._species:
+                raise ValueError("Unknown species {}!".format(species))
+
+            # If the species occupies a site, add its concentration to the
+            # occupied sites counter
+            if species.sites is not None:
+                for site in species.sites:
+                    occsites[site] += self.U0[name]
+
+        self.dvacdy = np.zeros((len(self.vacancy), self.nvariables), dtype=int)
+        self.vactot = {}
+        # Determine what the initial vacancy concentration should be
+        for i, vac in enumerate(self.vacancy):
+            name = vac.label
+            # If a vacancy species is part of the lattice, get its maximum
+            # concentration from its relative abundance. Otherwise, assume
+            # it is 1.
+            if self.lattice is not None and vac in self.lattice.sites:
+                self.vactot[vac] = self.lattice.ratio[vac]
+            else:
+                self.vactot[vac] = 1.
+            # Make sure there isn't too much stuff occupying each kind of
+            # site on the surface.
+            assert occsites[vac] <= self.vactot[vac], \
+                    "Too many adsorbates on {}!".format(vac)
+            # Normalize the concentration of empty sites to match the
+            # appropriate site ratio from the lattice.
+            self.U0[name] = self.vactot[vac] - occsites[vac]
+            for j, species in enumerate(self._variable_species):
+                self.dvacdy[i, j] = -species.sites.count(vac)
+
+        # Populate dictionary of initial conditions for all species
+        for name, species in self.species.items():
+            # Assume concentration of unnamed species is 0
+            if name not in self.U0:
+                self.U0[name] = 0.
+
+    def _initialize_solver(self, reinit=False):
+        """Passes rate constants, fixed concentrations, and initial values to
+        the fortran module. If reinit is True, the existing IDA instance is
+        re-initialized instead of being allocated from scratch. IDA is
+        always allocated from scratch if it was last set up by another
+        module, whose number of equations may differ."""
+        global _ida_owner
+        U0 = self._get_initial_values()
+        algvar, atol = self._get_tolerances()
+
+        with _ida_lock:
+            self.fset_params(self.kfor, self.krev, self.yfix)
+            module = _ida_owner[1]
+            if reinit and module is not None and module() is self._solve_ida:
+                self.freinitialize(U0, 1e-10, atol, algvar)
+            else:
+                self.finitialize(U0, 1e-10, atol, [], [], algvar)
+
+            # The IDA instance holds the parameters and initial values of
+            # one model at a time, so remember whose they are
+            _ida_owner = (weakref.ref(self), weakref.ref(self._solve_ida))
+        self.initialized = True
+
+    def _activate_solver(self):
+        """Loads the parameters and initial values of this model into its
+        solver module and the IDA instance if another model (e.g. a copy of
+        this one, or a model of a different network) has used them since."""
+        with _ida_lock:
+            owner, module = _ida_owner
+            if (owner is None or owner() is not self
+                    or module() is not self._solve_ida):
+                self._initialize_solver(reinit=True)
+
+    def _get_initial_values(self, U0=None):
+        """Converts the dictionary U0 of initial conditions (self.U0 by
+        default) into a list that can be used with the Fortran module."""
+        if U0 is None:
+            U0 = self.U0
+        y0 = []
         for symbol in self.symbols:
             for species, isymbol in self.symbols_dict.items():
                 if symbol == isymbol:
-                    U0.append(self.U0[species.label])
+                    y0.append(U0[species.label])
                     break
+        return y0
 
-        # Pass initial values to the fortran module
+    def _get_tolerances(self):
+        """Returns algvar, which tells the solver which variables are
+        differential and which are algebraic (it is the diagonal of the
+        mass matrix), and the absolute tolerances of all variables."""
+        algvar = np.array(self.M.diagonal(), dtype=float)
         atol = np.array([1e-32] * self.nvariables)
         atol += 1e-16 * algvar
-        self.finitialize(U0, 1e-10, atol, [], [], algvar)
+        return algvar, atol
+
+    def _get_signature(self):
+        """Returns a description of everything the generated code depends
+        on: the species, reactions, fixed species, reactor type, site
+        totals, and any coverage-dependent rate constants."""
+        symbolic = []
+        for rxn in self._reactions:
+            for k in [rxn.get_kfor(self.T, self.Asite, self.z),
+                      rxn.get_krev(self.T, self.Asite, self.z)]:
+                symbolic.append(k if _is_symbolic(k) else None)
+        return (tuple(self._species),
+                tuple(self.vacancy),
+                tuple(self._reactions),
+                tuple(rxn.reversible for rxn in self._reactions),
+                tuple(self.fixed),
+                self.solvent,
+                self.reactor,
+                self._get_interaction_signature(),
+                self.backend,
+                self._use_sparse(),
+                self.rhocat,
+                tuple(self.vactot[vac] for vac in self.vacancy),
+                tuple(symbolic))
+
+    def _get_interaction_signature(self):
+        # The interaction energies and thresholds are passed at runtime,
+        # only the sparsity pattern of the matrix is hard-coded
+        if self._interactions is None:
+            return None
+        species, matrix, thresholds = self._interactions
+        return (tuple(species), tuple(map(tuple, matrix != 0)),
+                thresholds is not None)
+
+    def _get_rate_constants(self):
+        """Returns arrays of the numerical forward and reverse rate
+        constants of all reactions. Coverage-dependent rate constants are
+        hard-coded into the rate expressions, so their entries are 1."""
+        nrxns = len(self._reactions)
+        kfor = np.ones(nrxns, dtype=float)
+        krev = np.ones(nrxns, dtype=float)
+        for j, rxn in enumerate(self._reactions):
+            kforj = rxn.get_kfor(self.T, self.Asite, self.z)
+            krevj = rxn.get_krev(self.T, self.Asite, self.z)
+            if not _is_symbolic(kforj):
+                kfor[j] = kforj
+            if not _is_symbolic(krevj):
+                krev[j] = krevj
+        return kfor, krev
+
+    def _get_fixed_concentrations(self, U=None):
+        """Returns an array of the concentrations of all fixed species in
+        U (by default U0), followed by the temperature-dependent parameters
+        of the lateral interactions, if there are any."""
+        if U is None:
+            U = self.U0
+        yfix = [U[species.label] for species in self._fixed_species]
+        interactions = self.massaction.interactions
+        if interactions is not None:
+            matrix, thresholds = self._get_interaction_values()[2:]
+            yfix = np.concatenate([yfix,
+                                   interactions.parameters(self._reactions,
+                                                           matrix,
+                                                           thresholds)])
+        # The Fortran module needs arrays of at least size 1
+        if len(yfix) == 0:
+            yfix = [0.]
+        return np.array(yfix, dtype=float)
+
+    def set_interactions(self, matrix, species, thresholds=None):
+        """Sets pairwise lateral interactions between adsorbates.
+
+        matrix[i][k] is the change of the energy (in eV) of species[i] per
+        unit coverage of species[k]. If thresholds are given, species[k]
+        only interacts above a coverage of thresholds[k], i.e. the energy
+        of species[i] changes by matrix[i][k] * max(0, theta_k - thresholds[k]).
+        Species can be given as labels or species objects, and may include
+        transition states, which shift the barriers of their reactions,
+        but have no coverage themselves.
+
+        Unlike coverage dependence written into the lateral energies of the
+        species, the interactions are not expanded symbolically. They are
+        evaluated as a matrix-vector product in the generated rate and
+        Jacobian code, while the mass-action form of the rates is kept.
+        Pass matrix=None to remove all interactions."""
+        if matrix is None:
+            self._interactions = None
+        else:
+            matrix = np.array(matrix, dtype=float)
+            species = [self._get_interacting_species(sp) for sp in species]
+            if matrix.shape != (len(species), len(species)):
+                raise ValueError("The interaction matrix must be of shape "
+                                 "{0} x {0}!".format(len(species)))
+            if thresholds is not None:
+                thresholds = np.array(thresholds, dtype=float)
+                if thresholds.shape != (len(species),):
+                    raise ValueError("There must be one threshold per "
+                                     "species!")
+            self._interactions = (species, matrix, thresholds)
+        if self.U0 is not None:
+            self.set_initial_conditions(self.U0)
 
-        self.initialized = True
+    def _get_interacting_species(self, species):
+        ts = [ts for rxn in self._reactions if rxn.ts is not None
+              for ts in rxn.ts]
+        if isinstance(species, str):
+            for other in self._species + ts:
+                if other.label == species:
+                    return other
+        elif species in self._species or species in ts:
+            return species
+        if species in self.vacancy or species in [vac.label for vac
+                                                  in self.vacancy]:
+            raise ValueError("Vacancies cannot have lateral interactions!")
+        raise ValueError("Unknown species {}!".format(species))
+
+    def _get_interaction_values(self):
+        """Returns the interacting species, those of them that have a
+        coverage, and the interaction matrix and thresholds (or None)
+        restricted to the latter."""
+        species, matrix, thresholds = self._interactions
+        # Transition states have no coverage, so they do not interact
+        # with anything
+        conc_species = (self._variable_species + self.vacancy
+                        + self._fixed_species)
+        cov = [k for k, sp in enumerate(species) if sp in conc_species]
+        if thresholds is not None:
+            thresholds = thresholds[cov]
+        return species, [species[k] for k in cov], matrix[:, cov], thresholds
+
+    def _get_lateral_interactions(self, conc_species):
+        """Returns the LateralInteractions of the reactions of the model,
+        with the concentrations ordered as in conc_species, or None."""
+        if self._interactions is None:
+            return None
+        species, covered, matrix, thresholds = self._get_interaction_values()
+        cols = [conc_species.index(sp) for sp in covered]
+
+        nrxns = len(self._reactions)
+        Nts = np.zeros((nrxns, len(species)), dtype=int)
+        dN = np.zeros((nrxns, len(species)), dtype=int)
+        for j, rxn in enumerate(self._reactions):
+            for i, sp in enumerate(species):
+                if rxn.ts is not None:
+                    Nts[j, i] = rxn.ts.species.count(sp)
+                dN[j, i] = (rxn.products.species.count(sp)
+                            - rxn.reactants.species.count(sp))
+        return LateralInteractions(matrix != 0, cols, thresholds is not None,
+                                   Nts, dN, len(conc_species),
+                                   len(self._fixed_species))
 
     def setup_execs(self):
+        if self.backend == 'scipy':
+            # Evaluate the rate expressions with NumPy and integrate with
+            # SciPy. This needs no compilation at all.
+            from micki.solver import ScipySolver
+            solve_ida = ScipySolver(self, method=self.scipy_method)
+        else:
+            solve_ida = self._compile_fortran()
+        self._solve_ida = solve_ida
+        self._map_execs(solve_ida)
+
+    def _map_execs(self, solve_ida):
+        # The solver module's initialize, solve, and finalize routines
+        # are mapped onto finitialize, fsolve, and ffinalize inside the Model
+        # object. We don't want users touching these manually
+        self.fset_params = solve_ida.set_params
+        self.fset_ramp = solve_ida.set_ramp
+        self.finitialize = solve_ida.initialize
+        self.freinitialize = solve_ida.reinitialize
+        self.ffind_steady_state = solve_ida.find_steady_state
+        self.flinearize = solve_ida.linearize
+        self.fsolve = solve_ida.solve
+        self.ffinalize = solve_ida.finalize
+
+    def _use_sparse(self):
+        """Whether the generated module uses a sparse Jacobian and the KLU
+        sparse direct solver rather than a dense LAPACK factorisation."""
+        if self.linear_solver == 'auto':
+            return self.nvariables > SPARSE_THRESHOLD
+        return self.linear_solver == 'sparse'
+
+    def _compile_fortran(self):
         from micki.fortran import f90_template, pyf_template
-        from numpy import f2py
-
-        # y_vec is an array symbol that will represent the species
-        # concentrations provided by the differential equation solver inside
-        # the Fortran code (that is, y_vec is an INPUT to the functions that
-        # calculate the residual, Jacobian, and rate)
-        y_vec = sym.IndexedBase('y', shape=(self.nvariables,))
-        vac_vec = sym.IndexedBase('vac', shape=(len(self.vacancy),))
-        # Map y_vec elements (1-indexed, of course) onto 'modelparam' symbols
-        trans = {self.symbols[i]: y_vec[i + 1] for i in range(self.nvariables)}
-        trans.update({vac.symbol: y_vec[i + 1] for i, vac in enumerate(self.vacancy)})
-        # Map string represntation of 'modelparam' symbols onto string
-        # representation of y-vec elements
-        str_trans = {}
+        from micki.fortran import dense_linsol_template
+        from micki.fortran import sparse_linsol_template, spjac_template
+
+        # Species and vacancy symbols are printed as elements of the y and
+        # vac arrays (1-indexed, of course) that are provided by the
+        # differential equation solver inside the Fortran code (that is,
+        # they are INPUTS to the functions that calculate the residual,
+        # Jacobian, and rate)
+        trans = {}
         for i, symbol in enumerate(self.symbols):
-            str_trans[sym.fcode(symbol, source_format='free')] = \
-                    sym.fcode(y_vec[i + 1], source_format='free')
+            trans[symbol] = 'y({})'.format(i + 1)
         for i, vac in enumerate(self.vacancy):
-            str_trans[sym.fcode(vac.symbol, source_format='free')] = \
-                    sym.fcode(vac_vec[i + 1], source_format='free')
-        
-        str_list = [key for key in str_trans]
-        str_list.sort(key=len, reverse=True)
+            trans[vac.symbol] = 'vac({})'.format(i + 1)
+
+        fprinter = _ModelPrinter(trans)
+        printer = fprinter.doprint
+
+        # Fortran names of the concentrations used by the mass-action rates
+        names = [trans[symbol] for symbol in self.symbols]
+        names += [trans[vac.symbol] for vac in self.vacancy]
+        names += ['yfix({})'.format(k + 1)
+                  for k in range(len(self._fixed_species))]
+        massaction = self.massaction
+
+        # Mass-action rates use the rate constants kf and kr, which include
+        # the lateral interactions evaluated in latcalc
+        latcode = []
+        latdecl = []
+        if massaction.interactions is not None:
+            latcode = fprinter.wrap(
+                massaction.interactions.fortran_rate_constants(names))
+            latdecl = massaction.interactions.fortran_declarations()
 
         # these will contain lists of strings, with each element being one
         # Fortran assignment for the master equation, Jacobian, and
         # rate expressions
         dypdrcode = []
-        drdycode = []
-        ratecode = []
         vaccode = []
-        drdvaccode = []
         dvacdycode = []
 
         for i, expr in enumerate(self.vac_sym):
-            fcode = sym.fcode(expr, source_format='free')
-            for key in str_list:
-                fcode = fcode.replace(key, str_trans[key])
-            vaccode.append('   vac({}) = '.format(i + 1) + fcode)
+            vaccode.append('   vac({}) = '.format(i + 1) + printer(expr))
 
-        for i, row in enumerate(self.drdvac):
-            for j, elem in enumerate(row):
-                if elem != 0:
-                    fcode = sym.fcode(elem, source_format='free')
-                    for key in str_list:
-                        fcode = fcode.replace(key, str_trans[key])
-                    drdvaccode.append('   drdvac({}, {}) = '.format(i + 1, j + 1) + fcode)
-        
         for i, row in enumerate(self.dvacdy):
             for j, elem in enumerate(row):
                 if elem != 0:
@@ -832,94 +1294,228 @@ class Model(object):
                 if elem != 0:
                     dypdrcode.append('   dypdr({}, {}) = '.format(i+1, j+1) + sym.fcode(elem, source_format='free'))
 
-        # Effectively the same as above, except on the two-dimensional Jacobian
-        # matrix.
-        for i, row in enumerate(self.drdy):
-            for j, elem in enumerate(row):
-                if elem != 0:
-                    fcode = sym.fcode(elem, source_format='free')
-                    for key in str_list:
-                        fcode = fcode.replace(key, str_trans[key])
-                    drdycode.append('   drdy({}, {}) = '.format(i + 1, j + 1) + fcode)
+        # The rate expressions and their derivatives share many terms (e.g.
+        # products of coverages and exponentials of coverage-dependent
+        # energies), so common subexpressions are eliminated across all
+        # expressions that are evaluated together.
+        # cse_report maps each generated routine onto the number of
+        # operations it contains before and after elimination.
+        self.cse_report = OrderedDict()
+
+        symbolic = np.nonzero(~massaction.active)[0]
+        lhs = ['rates({})'.format(j + 1) for j in symbolic]
+        ratecode, ratedecl, before, after = _cse_fcode(lhs,
+                                                       self.rates[symbolic],
+                                                       printer)
+        self.cse_report['ratecalc'] = (before, after)
+        for j in np.nonzero(massaction.active)[0]:
+            ratecode += fprinter.wrap(['   rates({}) = '.format(j + 1)
+                                       + massaction.fortran_rate(j, names,
+                                                                 'kf', 'kr')])
+
+        # drdy and drdvac are calculated together in the Jacobian
+        lhs = []
+        exprs = []
+        for name, mat in [('drdy', self.drdy), ('drdvac', self.drdvac)]:
+            for i, row in enumerate(mat):
+                for j, elem in enumerate(row):
+                    if elem != 0:
+                        lhs.append('{}({}, {})'.format(name, i + 1, j + 1))
+                        exprs.append(elem)
+        drdycode, jacdecl, before, after = _cse_fcode(lhs, exprs, printer)
+        self.cse_report['fidadjac'] = (before, after)
+        for j in np.nonzero(massaction.active)[0]:
+            for i in range(self.nvariables + len(self.vacancy)):
+                code = massaction.fortran_derivative(j, i, names, 'kf', 'kr')
+                if code is None:
+                    continue
+                if i < self.nvariables:
+                    lhs = 'drdy({}, {})'.format(j + 1, i + 1)
+                else:
+                    lhs = 'drdvac({}, {})'.format(j + 1,
+                                                  i - self.nvariables + 1)
+                drdycode += fprinter.wrap(['   {} = '.format(lhs) + code])
 
-        # See residual above
-        for i, rate in enumerate(self.rates):
-            fcode = sym.fcode(rate, source_format='free')
-            for key in str_list:
-                fcode = fcode.replace(key, str_trans[key])
-            ratecode.append('   rates({}) = '.format(i + 1) + fcode)
+        lapack = "-lmkl_rt"
+        if "MICKI_LAPACK" in os.environ:
+            lapack = os.environ["MICKI_LAPACK"]
+
+        if self._use_sparse():
+            (drcode, drdecl, ndr,
+             jaccode, nnz) = self._sparse_jacobian_code(fprinter,
+                                                             names)
+            linsolinit = sparse_linsol_template.format(nnz=nnz)
+            spjac = spjac_template.format(neq=self.nvariables,
+                                          neq1=self.nvariables + 1,
+                                          nvac=len(self.vacancy),
+                                          nrates=len(self.rates),
+                                          latdecl='\n'.join(latdecl),
+                                          latcalc='\n'.join(latcode),
+                                          nnz=nnz,
+                                          ndr=max(1, ndr),
+                                          drdecl='\n'.join(drdecl),
+                                          vaccalc='\n'.join(vaccode),
+                                          drcalc='\n'.join(drcode),
+                                          jaccalc='\n'.join(jaccode))
+            klu = "-lklu -lamd -lcolamd -lbtf -lsuitesparseconfig"
+            if "MICKI_KLU" in os.environ:
+                klu = os.environ["MICKI_KLU"]
+            libs = ('-lsundials_fsunmatrixsparse '
+                    '-lsundials_sunmatrixsparse '
+                    '-lsundials_fsunlinsolklu '
+                    '-lsundials_sunlinsolklu '
+                    '-lsundials_nvecserial ' + klu + ' ' + lapack)
+        else:
+            linsolinit = dense_linsol_template
+            spjac = ''
+            libs = ('-lsundials_fsunlinsollapackdense '
+                    '-lsundials_sunlinsollapackdense '
+                    '-lsundials_nvecserial ' + lapack)
 
         # We insert all of the parameters of this differential equation into
         # the prewritten Fortran template, including the residual, Jacobian,
         # and rate expressions we just calculated.
+        nfix = len(self.yfix)
         program = f90_template.format(neq=self.nvariables, nx=1,
                                       nrates=len(self.rates),
                                       nvac=len(self.vacancy),
+                                      nfix=nfix,
                                       dypdrcalc='\n'.join(dypdrcode),
                                       drdycalc='\n'.join(drdycode),
                                       ratecalc='\n'.join(ratecode),
                                       vaccalc='\n'.join(vaccode),
-                                      drdvaccalc='\n'.join(drdvaccode),
+                                      jacdecl='\n'.join(jacdecl),
+                                      ratedecl='\n'.join(ratedecl),
                                       dvacdycalc='\n'.join(dvacdycode),
+                                      latdecl='\n'.join(latdecl),
+                                      latcalc='\n'.join(latcode),
+                                      linsolinit=linsolinit,
+                                      spjac=spjac,
                                       )
 
-        # Generate a randomly-named temp directory for compiling the module.
-        # We will name the actual module file after the directory.
-        dname = tempfile.mkdtemp()
-        modname = os.path.split(dname)[1]
-        fname = modname + '.f90'
-        pyfname = modname + '.pyf'
-
         # For debugging purposes, write out the generated module
         with open('solve_ida.f90', 'w') as f:
             f.write(program)
 
-        # Write the pertinent data into the temp directory
-        with open(os.path.join(dname, pyfname), 'w') as f:
-            f.write(pyf_template.format(modname=modname, neq=self.nvariables,
-                    nrates=len(self.rates), nvac=len(self.vacancy)))
-
-        # Compile the module with f2py
-        lapack = "-lmkl_rt"
-        if "MICKI_LAPACK" in os.environ:
-            lapack = os.environ["MICKI_LAPACK"]
+        # Compile the module with f2py. The compiled module is cached on disk
+        # under a hash of the generated code and the link flags, so identical
+        # networks only have to be compiled once. Local arrays are kept on
+        # the stack (-frecursive) so that the routines that do not use the
+        # module variables are re-entrant.
         os.environ["CFLAGS"] = "-w"
-        f2py.compile(program, modulename=modname,
-                     extra_args='--quiet '
-                                '--f90flags="-Wno-unused-dummy-argument '
-                                '-Wno-unused-variable -Wno-unused-func -w" ' 
-                                '-lsundials_fida '
-                                '-lsundials_fnvecserial '
-                                '-lsundials_ida '
-                                '-lsundials_fsunlinsollapackdense '
-                                '-lsundials_sunlinsollapackdense '
-                                '-lsundials_nvecserial ' + lapack + ' ' +
-                                os.path.join(dname, pyfname),
-                     source_fn=os.path.join(dname, fname), verbose=0)
-
-        # Delete the temporary directory
-        shutil.rmtree(dname)
-
-        # Import the module on-the-fly with __import__. This is kind of a hack.
-        solve_ida = __import__(modname)
-        self._solve_ida = solve_ida
-
-        # The Fortran module's initialize, solve, and finalize routines
-        # are mapped onto finitialize, fsolve, and ffinalize inside the Model
-        # object. We don't want users touching these manually
-        self.finitialize = solve_ida.initialize
-        self.ffind_steady_state = solve_ida.find_steady_state
-        self.fsolve = solve_ida.solve
-        self.ffinalize = solve_ida.finalize
+        extra_args = ('--quiet '
+                      '--f90flags="-Wno-unused-dummy-argument '
+                      '-Wno-unused-variable -Wno-unused-func -w '
+                      '-frecursive" '
+                      '-lsundials_fida '
+                      '-lsundials_fnvecserial '
+                      '-lsundials_ida ' + libs)
+        solve_ida = get_module(program, pyf_template, extra_args,
+                               neq=self.nvariables, nrates=len(self.rates),
+                               nvac=len(self.vacancy), nfix=nfix)
+        return solve_ida
+
+    def _share_execs(self, other):
+        """Re-uses the solver module of other, a model of the same network,
+        so that it does not have to be generated again. set_initial_conditions
+        still checks that nothing the generated code depends on differs."""
+        for name in _KERNEL_ATTRIBUTES:
+            if hasattr(other, name):
+                setattr(self, name, getattr(other, name))
+        self._map_execs(self._solve_ida)
+
+    def _sparse_jacobian_code(self, printer, names):
+        """Generates the Fortran code that evaluates the nonzero derivatives
+        of the rates and assembles the Jacobian in compressed sparse column
+        format. Returns the code and declarations for the derivatives, the
+        number of derivatives, the assembly code, and the number of nonzero
+        elements of the Jacobian."""
+        nrates = len(self.rates)
+        neq = self.nvariables
+        massaction = self.massaction
+
+        # Total derivatives of each rate w.r.t. each variable, including the
+        # contribution through the vacancies. dr_index maps (rate, variable)
+        # onto the position in the dr array. Derivatives of mass-action
+        # rates are generated directly from the reaction orders, all others
+        # are differentiated symbolically.
+        lhs = []
+        exprs = []
+        macode = []
+        dr_index = {}
+        cols = [[] for j in range(neq)]
+        for i in range(nrates):
+            vacs = [k for k in range(len(self.vacancy))
+                    if not massaction.is_zero(i, neq + k)
+                    or self.drdvac[i, k] != 0]
+            for j in range(neq):
+                vacj = [k for k in vacs if self.dvacdy[k, j] != 0]
+                if massaction.active[i]:
+                    terms = [massaction.fortran_derivative(i, j, names,
+                                                           'kf', 'kr')]
+                    for k in vacj:
+                        terms.append('({}) * ({})'.format(
+                            int(self.dvacdy[k, j]),
+                            massaction.fortran_derivative(i, neq + k, names,
+                                                          'kf', 'kr')))
+                    terms = ['({})'.format(term) for term in terms
+                             if term is not None]
+                    if not terms:
+                        continue
+                    dr_index[(i, j)] = len(dr_index) + 1
+                    macode += printer.wrap(['   dr({}) = '.format(
+                        dr_index[(i, j)]) + ' + '.join(terms)])
+                else:
+                    expr = self.drdy[i, j]
+                    for k in vacj:
+                        expr += self.drdvac[i, k] * int(self.dvacdy[k, j])
+                    if expr == 0:
+                        continue
+                    dr_index[(i, j)] = len(dr_index) + 1
+                    lhs.append('dr({})'.format(dr_index[(i, j)]))
+                    exprs.append(expr)
+                cols[j].append(i)
+
+        drcode, drdecl, before, after = _cse_fcode(lhs, exprs,
+                                                   printer.doprint)
+        self.cse_report['fidaspjac'] = (before, after)
+        drcode += macode
+
+        # Variables affected by each reaction
+        rows = [np.nonzero(self.dypdr[:, i])[0] for i in range(nrates)]
+
+        # jac = dypdr * dr - cj * M, one column at a time. The diagonal is
+        # always stored.
+        jaccode = []
+        nnz = 0
+        for j in range(neq):
+            jaccode.append('   jcptrs({}) = {}'.format(j + 1, nnz))
+            terms = {j: []}
+            for i in cols[j]:
+                for row in rows[i]:
+                    terms.setdefault(row, []).append((self.dypdr[row, i],
+                                                      dr_index[(i, j)]))
+            for row in sorted(terms):
+                nnz += 1
+                jaccode.append('   jrvals({}) = {}'.format(nnz, row))
+                if row == j:
+                    jaccode.append('   jdata({}) = -cj * diff({})'
+                                   ''.format(nnz, row + 1))
+                else:
+                    jaccode.append('   jdata({}) = 0'.format(nnz))
+                for coef, k in terms[row]:
+                    coef = sym.fcode(sym.Float(coef), source_format='free')
+                    jaccode.append('   jdata({0}) = jdata({0}) + ({1}) * dr({2})'
+                                   ''.format(nnz, coef, k))
+        jaccode.append('   jcptrs({}) = {}'.format(neq + 1, nnz))
 
-        # Delete the module file. We've already imported it, so it's in memory.
-        os.remove(modname + '.so')
+        return drcode, drdecl, len(dr_index), jaccode, nnz
 
     def _out_array_to_dict(self, U, dU, r):
         Ui = {}
         dUi = {}
         ri = {}
-        fixed = self.fixed
+        fixed = list(self.fixed)
         if self.solvent is not None:
             fixed += [self.solvent]
         for name in fixed:
@@ -946,12 +1542,68 @@ class Model(object):
 
         return Ui, dUi, ri
 
-    def find_steady_state(self, dt=60, maxiter=2000, epsilon=1e-8):
-        t, U1, dU1, r1 = self.ffind_steady_state(self.nvariables,
-                                                 len(self.rates),
-                                                 dt,
-                                                 maxiter,
-                                                 epsilon)
+    def find_steady_state(self, dt=None, maxiter=2000, epsilon=1e-8,
+                          method='newton'):
+        """Finds the steady state starting from the initial conditions.
+
+        With method='newton', the steady-state equations are solved directly
+        by pseudo-transient continuation (damped Newton steps using the
+        analytic Jacobian, starting with a time step of dt) until the
+        residual drops below epsilon or the steps no longer change the
+        concentrations, falling back to transient integration if that
+        stalls. With method='transient', the equations are integrated until
+        the residual drops below epsilon, with output times that start at dt
+        and grow geometrically. Both also stop once the concentrations no
+        longer change and the residual is limited by round-off error. By
+        default, the transient integration starts at the fastest timescale
+        of the system, estimated from the Jacobian at the initial
+        conditions, and the Newton search at the larger of that and 60 s.
+        Compiled models using the sparse linear solver (see
+        linear_solver) always integrate, as the Newton search factorises
+        the dense Jacobian.
+
+        The outcome of the search is stored as a ConvergenceReport in
+        self.convergence.
+
+        The Newton search only depends on the rate constants and initial
+        values of this model and releases the GIL, so different models
+        (e.g. copies of one model) may search for their steady states in
+        several threads at once. Transient integration uses the single IDA
+        instance of the process, so only one thread at a time integrates,
+        and it reloads the parameters and initial values of this model into
+        the solver module within the same critical section.
+        """
+        dt = self._get_dt(dt)
+        nnewton = 0
+        converged = False
+        if self._get_newton(method):
+            (t, U1, dU1, r1, nnewton, resnorm,
+             converged) = self._solve_ida.find_steady_state_newton(
+                    self.kfor, self.krev, self.yfix,
+                    self._get_initial_values(), dt, maxiter, epsilon)
+            usednewton = converged
+        if not converged:
+            with _ida_lock:
+                # The transient search uses the parameters and initial
+                # values stored in the solver module and the IDA instance,
+                # which other threads may have changed since this model
+                # last used them. Load them in the same critical section.
+                self._initialize_solver(reinit=True)
+                (t, U1, dU1, r1, niter, resnorm, converged,
+                 usednewton) = self.ffind_steady_state(self.nvariables,
+                                                       len(self.rates),
+                                                       dt, maxiter,
+                                                       epsilon, 0)
+        else:
+            niter = 0
+        niter += nnewton
+        self.convergence = ConvergenceReport(
+                bool(converged), niter, resnorm, t,
+                'newton' if usednewton else 'transient')
+        if not converged:
+            warnings.warn("Steady state not found after {} iterations, the "
+                          "residual is {}!".format(niter, resnorm),
+                          RuntimeWarning, stacklevel=2)
         self.t = t
         self.U = []
         self.dU = []
@@ -963,12 +1615,185 @@ class Model(object):
         self.check_rates(U)
         return t, U, r
 
-    def solve(self, t, ncp):
-        self.t, U1, dU1, r1 = self.fsolve(self.nvariables,
-                                          len(self.rates), ncp, t)
-        self.U1 = U1.T
-        self.dU1 = dU1.T
-        self.r1 = r1.T
+    def _get_dt(self, dt):
+        # A non-positive time step is estimated by the solver
+        if dt is None:
+            return 0.
+        if dt <= 0:
+            raise ValueError("Time step must be positive!")
+        return dt
+
+    def _get_newton(self, method):
+        if method not in ['newton', 'transient']:
+            raise ValueError("Unknown steady state method {}!".format(method))
+        # The Newton search of the generated module factorises a dense
+        # Jacobian, which models using the sparse solver cannot afford
+        if self.backend == 'fortran' and self._use_sparse():
+            return 0
+        return int(method == 'newton')
+
+    def find_steady_state_batch(self, T, U0, dt=None, maxiter=2000,
+                                epsilon=1e-8, method='newton'):
+        """Finds the steady state at many conditions with a single compiled
+        module.
+
+        T is a sequence of temperatures (or None to keep the current
+        temperature) and U0 a sequence of initial conditions, one per
+        condition, and the remaining arguments are the same as for
+        find_steady_state. The conditions may only change numerical rate
+        constants and concentrations; anything that changes the generated
+        code, e.g. the coverage dependence of a rate constant, raises a
+        ValueError.
+
+        Returns the simulated times, dictionaries mapping species and
+        reaction names onto arrays of concentrations and rates with one
+        element per condition, and an array flagging which conditions
+        converged. A ConvergenceReport of arrays with one element per
+        condition is stored in self.convergence."""
+        ncond = len(U0)
+        if T is None:
+            T = [self.T] * ncond
+        if len(T) != ncond:
+            raise ValueError("T and U0 must have the same length!")
+
+        if self._signature is None:
+            self.set_initial_conditions(U0[0])
+        T_orig = self.T
+        U0_orig = self.U0
+
+        nrates = len(self.rates)
+        kfor = np.zeros((nrates, ncond))
+        krev = np.zeros((nrates, ncond))
+        yfix = np.zeros((len(self.yfix), ncond))
+        y0 = np.zeros((self.nvariables, ncond))
+        U0_all = []
+        try:
+            for k in range(ncond):
+                # Update the rate constants without re-initializing the
+                # solver, which is done natively for each condition
+                self._T = T[k]
+                self._update_reactions()
+                self._set_U0(U0[k])
+                if self._get_signature() != self._signature:
+                    raise ValueError("Condition {} requires a different "
+                                     "compiled module!".format(k))
+                kfor[:, k], krev[:, k] = self._get_rate_constants()
+                yfix[:, k] = self._get_fixed_concentrations()
+                y0[:, k] = self._get_initial_values()
+                U0_all.append(self.U0)
+
+            algvar, atol = self._get_tolerances()
+            with _ida_lock:
+                # The conditions re-use the IDA instance, which has to be
+                # set up by this model's module
+                self._activate_solver()
+                (t, U1, dU1, r1, niter, resnorm, converged,
+                 usednewton) = self._solve_ida.find_steady_state_batch(
+                        kfor, krev, yfix, y0, 1e-10, atol, algvar,
+                        self._get_dt(dt), maxiter, epsilon,
+                        self._get_newton(method))
+        finally:
+            # Leave the model at the conditions it was in before
+            self._T = T_orig
+            self._update_reactions()
+            self.set_initial_conditions(U0_orig)
+
+        U = OrderedDict()
+        r = OrderedDict()
+        for k in range(ncond):
+            self.U0 = U0_all[k]
+            Uk, dUk, rk = self._out_array_to_dict(U1[:, k], dU1[:, k],
+                                                  r1[:, k])
+            for name, val in Uk.items():
+                U.setdefault(name, np.zeros(ncond))[k] = val
+            for name, val in rk.items():
+                r.setdefault(name, np.zeros(ncond))[k] = val
+        self.U0 = U0_orig
+
+        converged = np.array(converged, dtype=bool)
+        self.convergence = ConvergenceReport(
+                converged, np.array(niter), np.array(resnorm), np.array(t),
+                np.where(usednewton, 'newton', 'transient'))
+        if not np.all(converged):
+            warnings.warn("{} of {} conditions did not converge to a steady "
+                          "state!".format(ncond - np.sum(converged), ncond),
+                          RuntimeWarning, stacklevel=2)
+        return t, U, r, converged
+
+    def linearize(self, U):
+        """Linearizes the model around the concentrations U, a dictionary
+        like the ones returned by find_steady_state.
+
+        Returns the rates of all reactions, their derivatives w.r.t. the
+        variables of the differential equations (including the
+        contribution from the vacancies), and the Jacobian of the
+        differential equations. Rows follow the order of self._reactions
+        and columns that of self.symbols."""
+        # The rate constants and fixed concentrations are passed
+        # explicitly, as another model may share the compiled module, which
+        # only has to be initialized once
+        with _ida_lock:
+            self._activate_solver()
+        return self.flinearize(self.kfor, self.krev, self.yfix,
+                               self._get_initial_values(U))
+
+    def solve(self, t, ncp, params=None, beta=None):
+        """Integrates the model from its initial conditions to time t,
+        storing ncp equally spaced points of the trajectory.
+
+        If beta is given, the temperature is ramped linearly from self.T
+        at beta K/s during the integration, as in temperature-programmed
+        desorption or reaction experiments. The rate constants are then
+        evaluated inside the solver module at T(t) = T + beta t from
+        modified Arrhenius fits to the thermochemistry over the whole
+        ramp (see micki.ramp), so the trajectory, including the rates of
+        all desorption steps, comes from a single integration. The
+        temperature at each point is stored in self.T1. This needs
+        numerical rate constants and cannot be combined with params or
+        with lateral interactions.
+
+        If params is a list of reaction names (for the logarithms of
+        factors scaling both of their rate constants) and species names
+        (for their energies in eV), the forward sensitivities of the
+        trajectory w.r.t. these parameters are integrated alongside it, see
+        micki.sensitivity. They are stored in self.dU1dp and self.dr1dp,
+        which map each parameter onto arrays shaped like self.U1 and
+        self.r1. This needs SciPy, and the trajectory itself also comes
+        from SciPy's BDF integrator."""
+        if beta is not None:
+            if params is not None:
+                raise ValueError("Sensitivities cannot be integrated along "
+                                 "a temperature ramp!")
+            ramp = self._get_ramp(t, beta)
+            with _ida_lock:
+                # The ramp starts at t = 0, so the solver always has to
+                # start over from the initial conditions
+                self.fset_ramp(*ramp)
+                try:
+                    self._initialize_solver(reinit=True)
+                    self.t, U1, dU1, r1 = self.fsolve(self.nvariables,
+                                                      len(self.rates), ncp, t)
+                finally:
+                    self.fset_ramp(self.T, 0., self.T, np.zeros_like(ramp[3]),
+                                   np.zeros_like(ramp[4]))
+            self.U1 = U1.T
+            self.dU1 = dU1.T
+            self.r1 = r1.T
+        elif params is None:
+            with _ida_lock:
+                self._activate_solver()
+                self.t, U1, dU1, r1 = self.fsolve(self.nvariables,
+                                                  len(self.rates), ncp, t)
+            self.U1 = U1.T
+            self.dU1 = dU1.T
+            self.r1 = r1.T
+        else:
+            from micki.sensitivity import solve
+            (self.t, self.U1, self.r1, self.dU1dp,
+             self.dr1dp) = solve(self, t, ncp, params)
+            # The rates along the trajectory already come with it
+            self.dU1 = np.dot(self.r1, self.dypdr.T) * self.M.diagonal()
+        self.T1 = self.T + (beta or 0.) * np.asarray(self.t)
         self.U = []
         self.dU = []
         self.r = []
@@ -981,6 +1806,63 @@ class Model(object):
         self.check_rates(self.U[-1])
         return self.U, self.r
 
+    def _get_ramp(self, t, beta, tol=1e-2):
+        """Fits the rate constants of all reactions between self.T and
+        self.T + beta * t (see micki.ramp.fit_arrhenius). Returns the
+        arguments of the solver module's set_ramp."""
+        if self._signature is None:
+            raise ValueError("Initial conditions must be set before "
+                             "solving!")
+        if not np.all(self.massaction.active):
+            raise ValueError("Temperature ramps need numerical rate "
+                             "constants, but some depend on the coverages!")
+        if self.massaction.interactions is not None:
+            raise ValueError("Temperature ramps cannot be combined with "
+                             "lateral interactions!")
+        T0 = self.T
+        T1 = T0 + beta * t
+        if T1 <= 0:
+            raise ValueError("The temperature ramp ends at {} K!".format(T1))
+
+        temps = ramp_temperatures(min(T0, T1), max(T0, T1))
+        nrates = len(self.rates)
+        kfor = np.zeros((nrates, len(temps)))
+        krev = np.zeros((nrates, len(temps)))
+        try:
+            for k, T in enumerate(temps):
+                self._T = T
+                self._update_reactions()
+                kfor[:, k], krev[:, k] = self._get_rate_constants()
+        finally:
+            self._T = T0
+            self._update_reactions()
+
+        Tref = 0.5 * (T0 + T1)
+        # The reverse rates of irreversible reactions are never evaluated
+        krev[~self.massaction.reversible] = 0.
+        rampfor, errfor = fit_arrhenius(temps, kfor, Tref)
+        ramprev, errrev = fit_arrhenius(temps, krev, Tref)
+        error = max(errfor, errrev)
+        if error > tol:
+            warnings.warn("Modified Arrhenius fits of the rate constants "
+                          "deviate by up to {:.2%} along the temperature "
+                          "ramp!".format(error), RuntimeWarning, stacklevel=3)
+        return T0, beta, Tref, rampfor, ramprev
+
+    def solve_adjoint(self, t, output, params=None):
+        """Integrates the model from its initial conditions to time t and
+        returns the integral over time of output, the name of a reaction
+        or a dictionary mapping reaction names onto weights (e.g. the
+        integrated yield of a product), together with an OrderedDict
+        mapping each parameter (see solve) onto the derivative of that
+        integral. params defaults to all reactions and species.
+
+        The gradient is computed by the adjoint method, so its cost hardly
+        depends on the number of parameters, see micki.sensitivity. This
+        needs SciPy."""
+        from micki.sensitivity import gradient
+        return gradient(self, t, output, params)
+
     def finalize(self):
         self.initialized = False
 #        self.ffinalize()
@@ -1008,10 +1890,23 @@ class Model(object):
                                   RuntimeWarning, stacklevel=2)
 
     def copy(self, initialize=True):
-        newmodel = Model(self.T, self.Asite, self.z, self.lattice, self.rhocat)
+        """Returns a new model of the same reaction network and conditions.
+
+        The copy shares the solver module of this model, so it is not
+        generated or compiled again, but has its own rate constants,
+        concentrations and solver state. Changing anything the generated
+        code depends on in either model gives it a module of its own."""
+        newmodel = Model(self.T, self.Asite, self.z, self.lattice,
+                         reactor=self.reactor, rhocat=self.rhocat,
+                         backend=self.backend,
+                         scipy_method=self.scipy_method,
+                         linear_solver=self.linear_solver)
         newmodel.add_reactions(self.reactions)
         newmodel.set_fixed(self.fixed)
         newmodel.set_solvent(self.solvent)
+        newmodel._interactions = self._interactions
+        if self._signature is not None:
+            newmodel._share_execs(self)
         if initialize:
             newmodel.set_initial_conditions(self.U0)
         return newmodel
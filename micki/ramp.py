@@ -0,0 +1,54 @@
+"""Rate constants along linear temperature ramps, for simulations of
+temperature-programmed desorption and reaction"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+def ramp_temperatures(T0, T1, npoints=16):
+    """Chebyshev nodes between T0 and T1, at which the rate constants are
+    sampled for the fits"""
+    x = np.cos(np.pi * (np.arange(npoints) + 0.5) / npoints)
+    return 0.5 * (T0 + T1) + 0.5 * (T1 - T0) * x[::-1]
+
+
+def fit_arrhenius(T, k, Tref):
+    """Fits modified Arrhenius expressions
+
+        ln k = a + n ln(T / Tref) - theta (1 / T - 1 / Tref)
+
+    to rate constants k[j, l] sampled at the temperatures T[l]. theta is
+    the apparent barrier divided by kB, and a is ln k at Tref. Returns the
+    parameters as an array shaped (3, nrates), holding a, n and theta of
+    each rate constant, and the largest relative error of the fits at the
+    sampled temperatures. Rate constants that are zero at all
+    temperatures get a = -inf."""
+    T = np.asarray(T, dtype=float)
+    k = np.atleast_2d(np.asarray(k, dtype=float))
+    params = np.zeros((3, len(k)))
+
+    positive = np.all(k > 0, axis=1)
+    zero = np.all(k == 0, axis=1)
+    if not np.all(positive | zero):
+        raise ValueError("Rate constants that change sign or vanish at "
+                         "some temperatures cannot be fitted!")
+    params[0, zero] = -np.inf
+
+    # Measuring temperatures from Tref keeps the columns well conditioned
+    # for narrow ramps
+    X = np.array([np.ones_like(T), np.log(T / Tref), -(1. / T - 1. / Tref)]).T
+    lnk = np.log(k[positive]).T
+    if lnk.size > 0:
+        params[:, positive] = np.linalg.lstsq(X, lnk, rcond=None)[0]
+        error = np.max(np.abs(np.expm1(np.dot(X, params[:, positive]) - lnk)))
+    else:
+        error = 0.
+    return params, error
+
+
+def arrhenius(params, T, Tref):
+    """Rate constants at the temperature T from the parameters returned by
+    fit_arrhenius"""
+    a, n, theta = params
+    return np.exp(a + n * np.log(T / Tref) - theta * (1. / T - 1. / Tref))
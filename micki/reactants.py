@@ -1,10 +1,12 @@
 """This module contains object definitions of species
 and collections of species"""
 
-import copy
+import math
 import warnings
 import numpy as np
 
+from collections import OrderedDict
+
 from sympy import Symbol
 
 from ase import Atoms
@@ -18,15 +20,199 @@ from micki.io import parse_vasp_out
 from micki.utils import calculate_avg_vdw_radius
 
 
+class _ScaleDict(OrderedDict):
+    """Dictionary of scaling factors which calls callback whenever one of
+    them is set, including those in nested dictionaries"""
+
+    def __init__(self, callback=None, items=()):
+        self._callback = callback
+        OrderedDict.__init__(self)
+        for key, value in OrderedDict(items).items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if isinstance(value, dict) and not isinstance(value, _ScaleDict):
+            value = _ScaleDict(self._callback, value)
+        OrderedDict.__setitem__(self, key, value)
+        if self._callback is not None:
+            self._callback()
+
+
+class _ThermoTable(object):
+    """Thermodynamic properties of a species tabulated on an evenly spaced
+    temperature grid and interpolated with cubic Hermite polynomials.
+
+    The slopes at the grid points are taken by central differences. The
+    grid spacing starts at dT and is halved until the interpolation error
+    at the midpoints of all intervals is below tol (in eV, for energies,
+    T S and kB T ln q). Temperatures outside of the table extend it.
+
+    Only the temperature-dependent part is tabulated. Changes of the
+    electronic energy and entropy (e.g. of dE) are added at lookup, while
+    changes of anything in _get_table_key rebuild the table."""
+
+    def __init__(self, thermo, Tmin, Tmax, dT=10., tol=1e-6):
+        if not 0 < Tmin < Tmax:
+            raise ValueError("Invalid temperature range {} - {}!"
+                             "".format(Tmin, Tmax))
+        self.thermo = thermo
+        self.dT = dT
+        self.tol = tol
+        self.build(Tmin, Tmax)
+
+    def _flatten(self, thermo, T):
+        """Stacks all quantities at T along the last axis, with partition
+        functions replaced by their logarithms."""
+        q, E, S, H = thermo
+        values = [np.log(q[mode]) for mode in self.entries['q']]
+        values += [E[mode] for mode in self.entries['E']]
+        values += [S[mode] for mode in self.entries['S']]
+        values.append(H)
+        return np.stack([np.broadcast_to(np.asarray(v, dtype=float),
+                                         np.shape(T)) for v in values],
+                        axis=-1)
+
+    def _weights(self, T):
+        """Factors converting the errors of all quantities into energies"""
+        T = np.asarray(T)[..., np.newaxis]
+        weights = [kB * T] * len(self.entries['q'])
+        weights += [np.ones_like(T)] * len(self.entries['E'])
+        weights += [T] * len(self.entries['S'])
+        weights.append(np.ones_like(T))
+        return np.concatenate(weights, axis=-1)
+
+    def _tabulate(self, grid):
+        """Returns the coefficients of the cubic polynomials in the reduced
+        coordinate t = (T - T_i) / dT on each interval of grid."""
+        thermo = self.thermo
+        h = 1e-5 * grid
+        values = self._flatten(thermo._calc_q(grid), grid)
+        slopes = (self._flatten(thermo._calc_q(grid + h), grid)
+                  - self._flatten(thermo._calc_q(grid - h), grid)) \
+            * self.dT / (2 * h[:, np.newaxis])
+        v0, v1 = values[:-1], values[1:]
+        s0, s1 = slopes[:-1], slopes[1:]
+        return np.stack([v0, s0, 3 * (v1 - v0) - 2 * s0 - s1,
+                         2 * (v0 - v1) + s0 + s1], axis=1)
+
+    def build(self, Tmin, Tmax):
+        thermo = self.thermo
+        q, E, S, H = thermo._calc_q(Tmin)
+        self.entries = {}
+        for name, quantity in [('q', q), ('E', E), ('S', S)]:
+            self.entries[name] = [mode for mode in thermo.mode
+                                  if quantity[mode] is not None]
+        self.elec = thermo._calc_qelec(Tmin)
+        self.key = thermo._get_table_key()
+
+        for i in range(20):
+            n = max(1, int(np.ceil((Tmax - Tmin) / self.dT - 1e-8)))
+            self.Tmin = Tmin
+            self.Tmax = Tmin + n * self.dT
+            grid = Tmin + self.dT * np.arange(n + 1)
+            self.coeffs = self._tabulate(grid)
+
+            mid = grid[:-1] + self.dT / 2.
+            exact = self._flatten(thermo._calc_q(mid), mid)
+            error = np.abs(self._interpolate(mid) - exact) * self._weights(mid)
+            self.error = np.max(error)
+            if self.error <= self.tol:
+                break
+            self.dT /= 2.
+        else:
+            warnings.warn("Thermo table of {} does not reach the requested "
+                          "accuracy, the error is {} eV!".format(thermo,
+                                                                 self.error),
+                          RuntimeWarning, stacklevel=3)
+
+    def _interpolate(self, T, scalar=False):
+        n = len(self.coeffs)
+        if scalar:
+            x = (T - self.Tmin) / self.dT
+            i = min(max(int(x), 0), n - 1)
+            t = x - i
+            a, b, c, d = self.coeffs[i]
+        else:
+            x = (np.asarray(T, dtype=float) - self.Tmin) / self.dT
+            i = np.clip(np.floor(x).astype(int), 0, n - 1)
+            t = (x - i)[..., np.newaxis]
+            a, b, c, d = np.moveaxis(self.coeffs[i], -2, 0)
+        return a + t * (b + t * (c + t * d))
+
+    def __call__(self, T):
+        scalar = np.ndim(T) == 0
+        if scalar:
+            Tlo = Thi = T
+        else:
+            Tlo = np.min(T)
+            Thi = np.max(T)
+        if Tlo < self.Tmin or Thi > self.Tmax:
+            # Extend by at least the current width of the table, so that
+            # slowly drifting temperatures only rarely rebuild it
+            width = self.Tmax - self.Tmin
+            Tmin = self.Tmin
+            Tmax = self.Tmax
+            if Tlo < Tmin:
+                Tmin = max(min(Tlo, Tmin - width), Tlo / 2.)
+            if Thi > Tmax:
+                Tmax = max(Thi, Tmax + width)
+            self.build(Tmin, Tmax)
+
+        values = self._interpolate(T, scalar)
+        nq = len(self.entries['q'])
+        if scalar:
+            values = values.tolist()
+            values[:nq] = [math.exp(v) for v in values[:nq]]
+        else:
+            values = list(np.moveaxis(values, -1, 0))
+            values[:nq] = [np.exp(v) for v in values[:nq]]
+        values = iter(values)
+        q, E, S = self.thermo._new_modes()
+        for name, out in [('q', q), ('E', E), ('S', S)]:
+            for mode in self.entries[name]:
+                out[mode] = next(values)
+        H = next(values)
+
+        # The electronic energy and entropy do not depend on T
+        qelec, Eelec, Selec = self.thermo._calc_qelec(T)
+        dE = Eelec - self.elec[1]
+        dS = Selec - self.elec[2]
+        if dE != 0:
+            E['elec'] = E['elec'] + dE
+            E['tot'] = E['tot'] + dE
+            H = H + dE
+        if dS != 0:
+            S['elec'] = S['elec'] + dS
+            S['tot'] = S['tot'] + dS
+        return q, E, S, H
+
+
 class _Thermo(object):
     """Generic thermodynamics object
 
     This is the base object that all reactant objects inherit from.
     It initializes many parameters and provides methods for calculating
-    the partition function from translation, rotation, and vibration."""
+    the partition function from translation, rotation, and vibration.
+    All of them accept arrays of temperatures as well as scalars."""
 
     def __init__(self):
+        # Incremented whenever anything the thermodynamic properties depend
+        # on is changed. _table_version is not incremented by changes that
+        # only shift the electronic energy and entropy (see _ThermoTable).
+        self._version = 0
+        self._table_version = 0
+        # _version at the last update, and the number of updates so far,
+        # which tells dependent reactions whether to recalculate
+        self._updated = None
+        self.revision = 0
+
         self.T = None
+        # Quantities that only depend on the geometry and frequencies,
+        # computed once and re-used at every temperature
+        self._thetarot = None
+        self._thetavib = {}
+        # Optional interpolation table of the thermodynamic properties
+        self._table = None
 
         self.mode = ['tot', 'trans', 'trans2D', 'rot', 'vib', 'elec']
 
@@ -38,7 +224,6 @@ class _Thermo(object):
         self.scale = {'E': dict.fromkeys(self.mode, 1.0),
                       'S': dict.fromkeys(self.mode, 1.0),
                       'H': 1.0}
-        self.scale_old = copy.deepcopy(self.scale)
 
         self.atoms = None
         self.metal = None
@@ -60,6 +245,7 @@ class _Thermo(object):
     def set_atoms(self, atoms):
         if atoms is None:
             self._atoms = atoms
+            self._touch()
             return
         elif isinstance(atoms, AtomsRow):
             self._atoms = atoms.toatoms()
@@ -75,6 +261,8 @@ class _Thermo(object):
             raise ValueError("Unrecognized atoms object!")
         self.mass = [masses[atom.symbol] for atom in self.atoms]
         self.atoms.set_masses(self.mass)
+        self._thetarot = None
+        self._touch()
         self.update_potential_energy()
 
     def get_atoms(self):
@@ -93,12 +281,40 @@ class _Thermo(object):
 
     def update_potential_energy(self):
         if self.atoms is None or len(self.atoms) == 0:
-            self.potential_energy = 0.
+            potential_energy = 0.
         else:
-            self.potential_energy = self.atoms.get_potential_energy()
+            potential_energy = self.atoms.get_potential_energy()
         if self.eref is not None:
             for element in self.atoms.get_chemical_symbols():
-                self.potential_energy -= self.eref[element]
+                potential_energy -= self.eref[element]
+        self.potential_energy = potential_energy
+
+    def set_potential_energy(self, potential_energy):
+        self._potential_energy = potential_energy
+        self._touch(elec=True)
+
+    def get_potential_energy(self):
+        return self._potential_energy
+
+    potential_energy = property(get_potential_energy, set_potential_energy)
+
+    def set_spin(self, spin):
+        self._spin = spin
+        self._touch(elec=True)
+
+    def get_spin(self):
+        return self._spin
+
+    spin = property(get_spin, set_spin)
+
+    def set_symm(self, symm):
+        self._symm = symm
+        self._touch()
+
+    def get_symm(self):
+        return self._symm
+
+    symm = property(get_symm, set_symm)
     
     def set_sites(self, sites):
         if isinstance(sites, list):
@@ -107,6 +323,7 @@ class _Thermo(object):
             self._sites = [sites]
         else:
             raise ValueError("Invalid format for adsorption sites")
+        self._touch()
 
     def get_sites(self):
         return self._sites
@@ -116,12 +333,48 @@ class _Thermo(object):
     def set_freqs(self, freqs):
         if freqs is not None:
             self._freqs = np.array(freqs)
+            self._thetavib = {}
+            self._touch()
 
     def get_freqs(self):
         return self._freqs
 
     freqs = property(get_freqs, set_freqs)
 
+    def set_dE(self, dE):
+        self._dE = dE
+        self._touch(elec=True)
+
+    def get_dE(self):
+        return self._dE
+
+    dE = property(get_dE, set_dE)
+
+    def set_lattice(self, lattice):
+        self._lattice = lattice
+        self._touch()
+
+    def get_lattice(self):
+        return self._lattice
+
+    lattice = property(get_lattice, set_lattice)
+
+    def set_scale(self, scale):
+        self._scale = _ScaleDict(self._touch, scale)
+        self._touch()
+
+    def get_scale(self):
+        return self._scale
+
+    scale = property(get_scale, set_scale)
+
+    def _touch(self, elec=False):
+        """Marks the thermodynamic properties as out of date. Changes
+        with elec=True only shift the electronic energy and entropy."""
+        self._version += 1
+        if not elec:
+            self._table_version += 1
+
     def set_label(self, label):
         self._label = label
         if label is None:
@@ -148,41 +401,79 @@ class _Thermo(object):
             T = self.T
 
         self.T = T
-        self._calc_q(T)
-        self.scale_old = copy.deepcopy(self.scale)
+        self.q, self.E, self.S, self.H = self._calc_thermo(T)
+        self._updated = self._version
+        self.revision += 1
 
     def is_update_needed(self, T):
         if self.q['tot'] is None:
             return True
         if T is not None and T != self.T:
             return True
-        if self.scale != self.scale_old:
-            return True
-        return False
+        return self._updated != self._version
+
+    def _get_thermo(self, T):
+        """Returns the partition functions, energies, entropies and the
+        enthalpy at T. An array of temperatures is evaluated all at once,
+        without changing the stored state of the object."""
+        if np.ndim(T) > 0:
+            return self._calc_thermo(np.asarray(T, dtype=float))
+        self.update(T)
+        return self.q, self.E, self.S, self.H
 
     def get_H(self, T=None):
-        self.update(T)
-        return (self.H + self.lateral) * self.scale['H']
+        H = self._get_thermo(T)[3]
+        return (H + self.lateral) * self.scale['H']
 
     def get_S(self, T=None):
-        self.update(T)
-        return self.S['tot'] * self.scale['S']['tot']
+        S = self._get_thermo(T)[2]
+        return S['tot'] * self.scale['S']['tot']
 
     def get_G(self, T=None):
-        self.update(T)
-        return self.get_H(T) - T * self.get_S(T)
+        H = self.get_H(T)
+        if T is None:
+            T = self.T
+        return H - T * self.get_S(T)
 
     def get_E(self, T=None):
-        self.update(T)
-        return (self.E['tot'] + self.lateral) * self.scale['E']['tot']
+        E = self._get_thermo(T)[1]
+        return (E['tot'] + self.lateral) * self.scale['E']['tot']
 
     def get_q(self, T=None):
-        self.update(T)
-        return self.q['tot']
+        return self._get_thermo(T)[0]['tot']
 
     def get_reference_state(self):
         raise NotImplementedError
 
+    def set_thermo_table(self, Tmin, Tmax, dT=10., tol=1e-6):
+        """Tabulates the thermodynamic properties between Tmin and Tmax,
+        so that they are interpolated rather than calculated from the
+        partition functions at every temperature. The grid spacing starts
+        at dT and is refined until the interpolation error is below tol
+        (in eV). The table grows if a temperature outside of it is
+        needed."""
+        self._table = _ThermoTable(self, Tmin, Tmax, dT, tol)
+
+    def clear_thermo_table(self):
+        self._table = None
+
+    def _get_table_key(self):
+        """Everything other than the temperature and the electronic energy
+        and entropy that the tabulated properties depend on"""
+        S_conf = None
+        if self.lattice is not None:
+            S_conf = self.lattice.get_S_conf(self.sites)
+        return self._table_version, self.symm, self.rho0, S_conf
+
+    def _calc_thermo(self, T):
+        """_calc_q, interpolated from the thermo table if there is one"""
+        table = self._table
+        if table is None:
+            return self._calc_q(T)
+        if table.key != self._get_table_key():
+            table.build(table.Tmin, table.Tmax)
+        return table(T)
+
     def save_to_db(self, db):
         if isinstance(db, str):
             db = connect(db)
@@ -226,58 +517,77 @@ class _Thermo(object):
         db.write(self.atoms, name=self.label, data=data)
 
     def _calc_q(self, T):
+        """Returns dictionaries of the partition functions, energies and
+        entropies of all modes, and the enthalpy at T."""
         raise NotImplementedError
 
+    def _new_modes(self):
+        return (dict.fromkeys(self.mode), dict.fromkeys(self.mode),
+                dict.fromkeys(self.mode))
+
+    # Each of the following returns the partition function, energy and
+    # entropy of one mode.
     def _calc_qtrans2D(self, T, A):
         mtot = sum(self.mass) / kg
-        self.q['trans2D'] = 2 * np.pi * mtot * _k * T / _hplanck**2 * A
-        self.E['trans2D'] = kB * T * self.scale['E']['trans2D']
-        self.S['trans2D'] = kB * (2. + np.log(self.q['trans2D'])) * \
-            self.scale['S']['trans2D']
+        q = 2 * np.pi * mtot * _k * T / _hplanck**2 * A
+        E = kB * T * self.scale['E']['trans2D']
+        S = kB * (2. + np.log(q)) * self.scale['S']['trans2D']
+        return q, E, S
 
     def _calc_qtrans(self, T):
         mtot = sum(self.mass) / kg
-        self.q['trans'] = 0.001*(2*np.pi*mtot*_k*T/_hplanck**2)**(3./2.) \
-            / (mol * self.rho0)
-        self.E['trans'] = 3. * kB * T / 2. * self.scale['E']['trans']
-        self.S['trans'] = kB * (5./2. + np.log(self.q['trans'])) * \
-            self.scale['S']['trans']
+        q = 0.001*(2*np.pi*mtot*_k*T/_hplanck**2)**(3./2.) / (mol * self.rho0)
+        E = 3. * kB * T / 2. * self.scale['E']['trans']
+        S = kB * (5./2. + np.log(q)) * self.scale['S']['trans']
+        return q, E, S
+
+    def _get_thetarot(self):
+        """Moment of inertia of a linear molecule, or the product of the
+        rotational temperatures of a nonlinear one"""
+        if self._thetarot is None:
+            if self.linear:
+                com = self.atoms.get_center_of_mass()
+                I = 0
+                for atom in self.atoms:
+                    I += atom.mass * np.linalg.norm(atom.position - com)**2
+                self._thetarot = I / (kg * m**2)
+            else:
+                I = self.atoms.get_moments_of_inertia() / (kg * m**2)
+                self._thetarot = np.prod(_hplanck**2 / (8 * np.pi**2 * I * _k))
+        return self._thetarot
 
     def _calc_qrot(self, T):
-        com = self.atoms.get_center_of_mass()
         if self.linear:
-            I = 0
-            for atom in self.atoms:
-                I += atom.mass * np.linalg.norm(atom.position - com)**2
-            I /= (kg * m**2)
-            self.q['rot'] = 8*np.pi**2*I*_k*T/(_hplanck**2*self.symm)
-            self.E['rot'] = kB * T * self.scale['E']['rot']
-            self.S['rot'] = kB * (1. + np.log(self.q['rot'])) * \
-                self.scale['S']['rot']
+            I = self._get_thetarot()
+            q = 8*np.pi**2*I*_k*T/(_hplanck**2*self.symm)
+            E = kB * T * self.scale['E']['rot']
+            S = kB * (1. + np.log(q)) * self.scale['S']['rot']
         else:
-            I = self.atoms.get_moments_of_inertia() / (kg * m**2)
-            thetarot = _hplanck**2 / (8 * np.pi**2 * I * _k)
-            self.q['rot'] = np.sqrt(np.pi*T**3/np.prod(thetarot))/self.symm
-            self.E['rot'] = 3. * kB * T / 2. * self.scale['E']['rot']
-            self.S['rot'] = kB * (3./2. + np.log(self.q['rot'])) * \
-                self.scale['S']['rot']
+            q = np.sqrt(np.pi*T**3/self._get_thetarot())/self.symm
+            E = 3. * kB * T / 2. * self.scale['E']['rot']
+            S = kB * (3./2. + np.log(q)) * self.scale['S']['rot']
+        return q, E, S
+
+    def _get_thetavib(self, ncut):
+        if ncut not in self._thetavib:
+            self._thetavib[ncut] = self.freqs[ncut:] / kB
+        return self._thetavib[ncut]
 
     def _calc_qvib(self, T, ncut=0):
-        thetavib = self.freqs[ncut:] / kB
-        self.q['vib'] = np.prod(np.exp(-thetavib/(2. * T)) /
-                                (1. - np.exp(-thetavib/T)))
-        self.E['vib'] = kB * sum(thetavib *
-                                 (1./2. + 1./(np.exp(thetavib/T) - 1.))) * \
+        # Frequencies go along the last axis, temperatures along the others
+        x = self._get_thetavib(ncut) / np.asarray(T)[..., np.newaxis]
+        q = np.prod(np.exp(-x / 2.) / (1. - np.exp(-x)), axis=-1)
+        E = kB * np.sum(self._get_thetavib(ncut) *
+                        (1./2. + 1./(np.exp(x) - 1.)), axis=-1) * \
             self.scale['E']['vib']
-        self.S['vib'] = kB * sum((thetavib/T)/(np.exp(thetavib/T) - 1.) -
-                                 np.log(1. - np.exp(-thetavib/T))) * \
-            self.scale['S']['vib']
+        S = kB * np.sum(x / (np.exp(x) - 1.) - np.log(1. - np.exp(-x)),
+                        axis=-1) * self.scale['S']['vib']
+        return q, E, S
 
     def _calc_qelec(self, T):
-        self.E['elec'] = self.potential_energy + self.dE
-        self.E['elec'] *= self.scale['E']['elec']
-        self.S['elec'] = kB * np.log(2. * self.spin + 1.) * \
-            self.scale['S']['elec']
+        E = (self.potential_energy + self.dE) * self.scale['E']['elec']
+        S = kB * np.log(2. * self.spin + 1.) * self.scale['S']['elec']
+        return None, E, S
 
     def _is_linear(self):
         pos = self.atoms.get_positions()
@@ -341,16 +651,16 @@ class _Fluid(_Thermo):
                               self.rhoref, self.dE)
 
     def _calc_q(self, T):
-        self._calc_qelec(T)
-        self._calc_qtrans(T)
-        self._calc_qrot(T)
-        self._calc_qvib(T, ncut=self.ncut)
-        self.q['tot'] = self.q['trans'] * self.q['rot'] * self.q['vib']
-        self.E['tot'] = self.E['elec'] + self.E['trans'] + self.E['rot'] + \
-            self.E['vib']
-        self.H = self.E['tot'] #+ kB * T
-        self.S['tot'] = self.S['elec'] + self.S['trans'] + self.S['rot'] + \
-            self.S['vib']
+        q, E, S = self._new_modes()
+        q['elec'], E['elec'], S['elec'] = self._calc_qelec(T)
+        q['trans'], E['trans'], S['trans'] = self._calc_qtrans(T)
+        q['rot'], E['rot'], S['rot'] = self._calc_qrot(T)
+        q['vib'], E['vib'], S['vib'] = self._calc_qvib(T, ncut=self.ncut)
+        q['tot'] = q['trans'] * q['rot'] * q['vib']
+        E['tot'] = E['elec'] + E['trans'] + E['rot'] + E['vib']
+        H = E['tot'] #+ kB * T
+        S['tot'] = S['elec'] + S['trans'] + S['rot'] + S['vib']
+        return q, E, S, H
 
     def get_R(self):
         if self._R is None:
@@ -378,13 +688,15 @@ class Electron(_Thermo):
         return self.__class(self.potential_energy, self.lateral, label)
 
     def _calc_q(self, T):
-        self._calc_qelec(T)
-        if self.q['elec'] is None:
-            self.q['elec'] = 1.
-        self.q['tot'] = self.q['elec']
-        self.E['tot'] = self.E['elec']
-        self.H = self.E['tot']
-        self.S['tot'] = self.S['elec']
+        q, E, S = self._new_modes()
+        q['elec'], E['elec'], S['elec'] = self._calc_qelec(T)
+        if q['elec'] is None:
+            q['elec'] = 1.
+        q['tot'] = q['elec']
+        E['tot'] = E['elec']
+        H = E['tot']
+        S['tot'] = S['elec']
+        return q, E, S, H
 
 
 class Gas(_Fluid):
@@ -400,7 +712,7 @@ class Liquid(_Fluid):
         self.D = D
 
     def _calc_q(self, T):
-        _Fluid._calc_q(self, T)
+        return _Fluid._calc_q(self, T)
 #        if self.Sliq is None:
 #            # Use Trouton's Rule
 #            self.S['tot'] -= (4.5 + np.log(T)) * kB
@@ -438,15 +750,18 @@ class Adsorbate(_Thermo):
         return 1.
 
     def _calc_q(self, T):
-        self._calc_qvib(T, ncut=1 if self.ts else 0)
-        self._calc_qelec(T)
-        self.q['tot'] = self.q['vib']
-        self.E['tot'] = self.E['elec'] + self.E['vib']
-        self.H = self.E['tot']
-        self.S['tot'] = self.S['elec'] + self.S['vib']
-        self.S['tot'] += kB * np.log(self.symm)
+        q, E, S = self._new_modes()
+        q['vib'], E['vib'], S['vib'] = self._calc_qvib(T,
+                                                       ncut=1 if self.ts else 0)
+        q['elec'], E['elec'], S['elec'] = self._calc_qelec(T)
+        q['tot'] = q['vib']
+        E['tot'] = E['elec'] + E['vib']
+        H = E['tot']
+        S['tot'] = S['elec'] + S['vib']
+        S['tot'] += kB * np.log(self.symm)
         if self.lattice is not None:
-            self.S['tot'] += self.lattice.get_S_conf(self.sites)
+            S['tot'] += self.lattice.get_S_conf(self.sites)
+        return q, E, S, H
 
 
     def copy(self, newlabel=None):
@@ -0,0 +1,400 @@
+"""Forward and adjoint sensitivities of transient solutions"""
+
+from __future__ import print_function
+
+from collections import OrderedDict
+
+import numpy as np
+
+from scipy.integrate import BDF, solve_ivp
+from scipy.sparse import block_diag, bmat, csc_matrix
+
+from ase.units import kB
+
+
+def _rate_constant_derivatives(model, species, dg):
+    """Derivatives of the logarithms of the forward and reverse rate
+    constants of all reactions w.r.t. the energy of species. ln(k) is
+    (nearly) linear in the energies, so central differences are accurate
+    for any small step dg."""
+    nrates = len(model._reactions)
+    dlnkfor = np.zeros(nrates)
+    dlnkrev = np.zeros(nrates)
+    for j, reaction in enumerate(model._reactions):
+        if species not in reaction.species and (reaction.ts is None or
+                                                species not in reaction.ts):
+            continue
+        lnk = []
+        for x in [dg, -dg]:
+            species.dE += x
+            try:
+                reaction.update(T=model.T, Asite=model.Asite, L=model.z,
+                                force=True)
+                lnk.append(np.log([float(reaction.kfor),
+                                   float(reaction.krev)]))
+            except TypeError:
+                raise ValueError("Sensitivities w.r.t. the energy of {} are "
+                                 "not supported, as it affects "
+                                 "coverage-dependent rate constants!"
+                                 "".format(species.label))
+            finally:
+                species.dE -= x
+        reaction.update(T=model.T, Asite=model.Asite, L=model.z, force=True)
+        dlnkfor[j], dlnkrev[j] = (lnk[0] - lnk[1]) / (2 * dg)
+    return dlnkfor, dlnkrev
+
+
+class SensitivitySolver(object):
+    """Integrates the differential equations of a model together with their
+    forward sensitivities
+
+        M ds/dt = J s + dypdr dr/dp
+
+    w.r.t. a set of parameters p. A parameter is either the name of a
+    reaction, in which case p is the logarithm of a factor scaling both of
+    its rate constants, or the name of a species, in which case p is its
+    energy in eV.
+
+    The rates and their Jacobian come from the model's solver module, so
+    nothing needs to be recompiled. The augmented system is integrated
+    with SciPy's BDF method. Algebraic variables are eliminated as in
+    ScipySolver."""
+
+    def __init__(self, model, params, rtol=1e-8, atol=1e-16):
+        self.model = model
+        self.neq = model.nvariables
+        self.nrates = len(model.rates)
+        self.params = list(params)
+        self.nparams = len(self.params)
+        self.rtol = rtol
+        self.atol = atol
+
+        # The model's solver module may be shared with other models, so the
+        # rates are always evaluated with these rate constants and fixed
+        # concentrations, taken when the solver is set up
+        self.kfor = np.array(model.kfor, dtype=float)
+        self.krev = np.array(model.krev, dtype=float)
+        self.yfix = np.array(model.yfix, dtype=float)
+
+        self.dypdr = np.array(model.dypdr, dtype=float)
+        self.dvacdy = np.array(model.dvacdy, dtype=float)
+        self.vactot = np.array([model.vactot[vac] for vac in model.vacancy],
+                               dtype=float)
+        diag = np.array(model.M.diagonal(), dtype=float)
+        self.diff = np.nonzero(diag)[0]
+        self.alg = np.nonzero(diag == 0)[0]
+
+        # Parameters scaling the rate constants of one reaction, and the
+        # derivatives of the logarithms of the rate constants of all
+        # reactions w.r.t. species energies
+        self._scaled = []
+        self._dlnkfor = np.zeros((self.nrates, self.nparams))
+        self._dlnkrev = np.zeros((self.nrates, self.nparams))
+        self._energies = []
+        for k, name in enumerate(self.params):
+            if name in model.reactions:
+                j = model._reactions.index(model.reactions[name])
+                self._scaled.append((k, j))
+            elif name in model.species:
+                self._dlnkfor[:, k], self._dlnkrev[:, k] = \
+                        _rate_constant_derivatives(model, model.species[name],
+                                                   0.001 * kB * model.T)
+                self._energies.append(k)
+            else:
+                raise ValueError("Unknown parameter {}!".format(name))
+
+    def linearize(self, y):
+        return self.model.flinearize(self.kfor, self.krev, self.yfix, y)
+
+    def fluxes(self, y):
+        """Forward and reverse rates of all reactions"""
+        vac = self.vactot + np.dot(self.dvacdy, y)
+        return self.model.massaction.fluxes(y, vac, self.kfor, self.krev,
+                                            self.yfix)
+
+    def drdp(self, y, r):
+        """Derivatives of all rates w.r.t. the parameters at fixed
+        concentrations"""
+        drdp = np.zeros((self.nrates, self.nparams))
+        for k, j in self._scaled:
+            drdp[j, k] = r[j]
+        if self._energies:
+            rfor, rrev = self.fluxes(y)
+            drdp[:, self._energies] = \
+                rfor[:, np.newaxis] * self._dlnkfor[:, self._energies] \
+                - rrev[:, np.newaxis] * self._dlnkrev[:, self._energies]
+        return drdp
+
+    def _solve_algebraic(self, yd, ya):
+        """Finds the algebraic variables consistent with the differential
+        variables yd, starting from the guess ya."""
+        y = np.zeros(self.neq)
+        y[self.diff] = yd
+        y[self.alg] = ya
+        ix = np.ix_(self.alg, self.alg)
+        for i in range(100):
+            r, drdy, jac = self.linearize(y)
+            res = np.dot(self.dypdr, r)[self.alg]
+            dya = np.linalg.solve(jac[ix], -res)
+            y[self.alg] += dya
+            if np.all(np.abs(dya) <= self.rtol * np.abs(y[self.alg])
+                      + self.atol):
+                break
+        return y
+
+    def _state(self, z, ya):
+        """Full variables, sensitivities and their time derivatives from
+        z, which holds the differential variables followed by their
+        sensitivities w.r.t. each parameter in turn."""
+        diff, alg = self.diff, self.alg
+        nd = len(diff)
+        y = self._solve_algebraic(z[:nd], ya)
+        r, drdy, jac = self.linearize(y)
+        rhs = np.dot(self.dypdr, np.column_stack([r, self.drdp(y, r)]))
+
+        # The algebraic equations 0 = J_a s + dypdr_a dr/dp determine the
+        # sensitivities of the algebraic variables
+        s = np.zeros((self.neq, self.nparams))
+        s[diff] = z[nd:].reshape(self.nparams, nd).T
+        jred = jac[np.ix_(diff, diff)]
+        if len(alg) > 0:
+            jaa = jac[np.ix_(alg, alg)]
+            jad = jac[np.ix_(alg, diff)]
+            jda = jac[np.ix_(diff, alg)]
+            s[alg] = -np.linalg.solve(jaa, np.dot(jad, s[diff])
+                                      + rhs[alg, 1:])
+            jred = jred - np.dot(jda, np.linalg.solve(jaa, jad))
+        dsdt = np.dot(jac, s) + rhs[:, 1:]
+        dzdt = np.concatenate([rhs[diff, 0], dsdt[diff].T.ravel()])
+        return y, r, s, dzdt, jred
+
+    def solve(self, nt, tfinal):
+        """Integrates from the initial conditions of the model to tfinal.
+        Returns nt equally spaced times and the variables, rates and their
+        sensitivities at those times, with the parameters along the last
+        axis of the sensitivities."""
+        model = self.model
+        model._activate_solver()
+        y0 = np.array(model._get_initial_values(), dtype=float)
+        diff = self.diff
+        nd = len(diff)
+        state = {'ya': y0[self.alg]}
+
+        def evaluate(z):
+            y, r, s, dzdt, jred = self._state(z, state['ya'])
+            state['ya'] = y[self.alg]
+            return y, r, s, dzdt, jred
+
+        def fun(t, z):
+            return evaluate(z)[3]
+
+        def jac(t, z):
+            # The sensitivity equations are linear in the sensitivities, with
+            # the same Jacobian as the variables. Their dependence on the
+            # variables (through the second derivatives of the rates) is
+            # evaluated by finite differences.
+            dzdt, jred = evaluate(z)[3:]
+            if self.nparams == 0:
+                return jred
+            coupling = np.zeros((nd * self.nparams, nd))
+            for i in range(nd):
+                dz = 1e-7 * max(abs(z[i]), 1e-10)
+                zi = z.copy()
+                zi[i] += dz
+                coupling[:, i] = (evaluate(zi)[3][nd:] - dzdt[nd:]) / dz
+            evaluate(z)
+            return bmat([[jred, None], [coupling,
+                         block_diag([jred] * self.nparams)]], format='csc')
+
+        z0 = np.concatenate([y0[diff], np.zeros(nd * self.nparams)])
+        solver = BDF(fun, 0., z0, np.inf, rtol=self.rtol, atol=self.atol,
+                     jac=jac)
+
+        t1 = np.linspace(0., tfinal, nt)
+        u1 = np.zeros((nt, self.neq))
+        r1 = np.zeros((nt, self.nrates))
+        su1 = np.zeros((nt, self.neq, self.nparams))
+        sr1 = np.zeros((nt, self.nrates, self.nparams))
+        z = z0
+        for i, tout in enumerate(t1):
+            while solver.t < tout:
+                message = solver.step()
+                if solver.status == 'failed':
+                    raise RuntimeError("Integration failed: "
+                                       "{}".format(message))
+            if solver.t > tout:
+                z = solver.dense_output()(tout)
+            else:
+                z = solver.y
+            y, r, s = evaluate(z)[:3]
+            u1[i] = y
+            r1[i] = r
+            su1[i] = s
+            r, drdy, jacobian = self.linearize(y)
+            sr1[i] = np.dot(drdy, s) + self.drdp(y, r)
+        return t1, u1, r1, su1, sr1
+
+
+class AdjointSolver(SensitivitySolver):
+    """Gradient of the integral
+
+        G = int_0^t w . r dt
+
+    of a weighted sum of rates w.r.t. a set of parameters p (see
+    SensitivitySolver) by the adjoint method, at the cost of one forward
+    and one backward integration however many parameters there are.
+
+    The trajectory of the forward integration is kept as the dense output
+    of every step, from which the backward integration of the adjoint
+    variables
+
+        M^T dlambda/dt = -(J^T lambda + dr/dy^T w)
+
+    interpolates the variables. Along the way, the products of
+    mu = w + dypdr^T lambda with the rates and with their forward and
+    reverse parts are integrated, from which dG/dp = int_0^t mu . dr/dp dt
+    follows for every parameter."""
+
+    def _forward(self, tfinal):
+        """Integrates the differential variables and returns their dense
+        output together with a function mapping them onto all variables."""
+        model = self.model
+        model._activate_solver()
+        y0 = np.array(model._get_initial_values(), dtype=float)
+        diff, alg = self.diff, self.alg
+        state = {'ya': y0[alg]}
+
+        def full(yd):
+            y = self._solve_algebraic(yd, state['ya'])
+            state['ya'] = y[alg]
+            return y
+
+        def fun(t, yd):
+            r = self.linearize(full(yd))[0]
+            return np.dot(self.dypdr, r)[diff]
+
+        def jac(t, yd):
+            jac = self.linearize(full(yd))[2]
+            return self._reduce(jac)
+
+        result = solve_ivp(fun, (0., tfinal), y0[diff], method='BDF',
+                           rtol=self.rtol, atol=self.atol, jac=jac,
+                           dense_output=True)
+        if not result.success:
+            raise RuntimeError("Integration failed: "
+                               "{}".format(result.message))
+        return result.sol, full
+
+    def _reduce(self, jac):
+        """Jacobian of the differential variables with the algebraic ones
+        eliminated"""
+        diff, alg = self.diff, self.alg
+        jred = jac[np.ix_(diff, diff)]
+        if len(alg) == 0:
+            return jred
+        jad = np.linalg.solve(jac[np.ix_(alg, alg)], jac[np.ix_(alg, diff)])
+        return jred - np.dot(jac[np.ix_(diff, alg)], jad)
+
+    def gradient(self, tfinal, weights):
+        """Returns G and its derivatives w.r.t. all parameters."""
+        diff, alg = self.diff, self.alg
+        nd = len(diff)
+        nrates = self.nrates
+        weights = np.asarray(weights, dtype=float)
+        sol, full = self._forward(tfinal)
+
+        def adjoint(t, lamd):
+            y = full(sol(t))
+            r, drdy, jac = self.linearize(y)
+            # The adjoint variables of the algebraic variables follow from
+            # the algebraic rows of J^T lambda + dr/dy^T w = 0
+            gy = np.dot(weights, drdy)
+            lam = np.zeros(self.neq)
+            lam[diff] = lamd
+            if len(alg) > 0:
+                jaa = jac[np.ix_(alg, alg)]
+                jda = jac[np.ix_(diff, alg)]
+                lam[alg] = -np.linalg.solve(jaa.T, np.dot(jda.T, lamd)
+                                            + gy[alg])
+            mu = weights + np.dot(self.dypdr.T, lam)
+            return y, r, jac, mu, -(np.dot(jac.T, lam) + gy)[diff]
+
+        def fun(t, z):
+            y, r, jac, mu, dlam = adjoint(t, z[:nd])
+            rfor, rrev = self.fluxes(y)
+            return np.concatenate([dlam, -mu * r, -mu * rfor, -mu * rrev,
+                                   [-np.dot(weights, r)]])
+
+        def jac(t, z):
+            y, r, jac, mu, dlam = adjoint(t, z[:nd])
+            jred = self._reduce(jac)
+            rfor, rrev = self.fluxes(y)
+            # The adjoint variables of the algebraic variables depend on
+            # those of the differential ones through -J_aa^-T J_da^T
+            dmu = self.dypdr[diff].T
+            if len(alg) > 0:
+                dmu = dmu - np.dot(self.dypdr[alg].T, np.linalg.solve(
+                        jac[np.ix_(alg, alg)].T, jac[np.ix_(diff, alg)].T))
+            dq = np.concatenate([-r[:, np.newaxis] * dmu,
+                                 -rfor[:, np.newaxis] * dmu,
+                                 -rrev[:, np.newaxis] * dmu,
+                                 np.zeros((1, nd))])
+            nq = len(dq)
+            return bmat([[-jred.T, csc_matrix((nd, nq))],
+                         [dq, csc_matrix((nq, nq))]], format='csc')
+
+        # The variables come from the piecewise polynomial dense output of
+        # the forward integration, whose kinks at the ends of its steps the
+        # error estimate of the multistep BDF method cannot step over, so
+        # that it stalls. The one-step Radau method is just as stable.
+        z0 = np.zeros(nd + 3 * nrates + 1)
+        result = solve_ivp(fun, (tfinal, 0.), z0, method='Radau',
+                           rtol=self.rtol, atol=self.atol, jac=jac)
+        if not result.success:
+            raise RuntimeError("Backward integration failed: "
+                               "{}".format(result.message))
+        q = result.y[nd:, -1]
+        qr, qfor, qrev = q[:nrates], q[nrates:2 * nrates], q[2 * nrates:-1]
+
+        grad = np.dot(qfor, self._dlnkfor) - np.dot(qrev, self._dlnkrev)
+        for k, j in self._scaled:
+            grad[k] = qr[j]
+        return q[-1], grad
+
+
+def gradient(model, t, output, params=None, rtol=1e-8, atol=1e-16):
+    """Integrates model from its initial conditions to time t and returns
+    the integral over time of output, which is either the name of a
+    reaction or a dictionary mapping reaction names onto weights, e.g. the
+    integrated product yield. Also returns a dictionary mapping each
+    parameter (see SensitivitySolver) onto the derivative of the integral.
+    params defaults to all reactions and species of the model."""
+    if params is None:
+        params = list(model.reactions) + [species.label
+                                          for species in model._species]
+    if not isinstance(output, dict):
+        output = {output: 1.}
+    weights = np.zeros(len(model._reactions))
+    for name, weight in output.items():
+        weights[model._reactions.index(model.reactions[name])] = weight
+
+    solver = AdjointSolver(model, params, rtol=rtol, atol=atol)
+    G, grad = solver.gradient(t, weights)
+    return G, OrderedDict(zip(solver.params, grad))
+
+
+def solve(model, t, ncp, params, rtol=1e-8, atol=1e-16):
+    """Integrates model and its forward sensitivities w.r.t. params (see
+    SensitivitySolver) from its initial conditions to time t. Returns ncp
+    equally spaced times, the variables and rates at those times, shaped
+    like Model.U1 and Model.r1, and dictionaries mapping each parameter
+    onto arrays of the same shapes with the sensitivities of the variables
+    and rates."""
+    solver = SensitivitySolver(model, params, rtol=rtol, atol=atol)
+    t1, u1, r1, su1, sr1 = solver.solve(ncp, t)
+    dU1dp = OrderedDict()
+    dr1dp = OrderedDict()
+    for k, name in enumerate(solver.params):
+        dU1dp[name] = su1[:, :, k]
+        dr1dp[name] = sr1[:, :, k]
+    return t1, u1, r1, dU1dp, dr1dp
@@ -0,0 +1,452 @@
+"""Pure Python solver backend built on NumPy and SciPy"""
+
+from __future__ import print_function
+
+from copy import copy
+
+import numpy as np
+import sympy as sym
+
+from scipy.integrate import BDF, Radau
+
+from micki.ramp import arrhenius
+
+
+def _lambdify(args, exprs):
+    """NumPy callable evaluating exprs, with common subexpressions
+    eliminated where the installed version of SymPy supports it."""
+    try:
+        return sym.lambdify(args, exprs, 'numpy', cse=True)
+    except TypeError:
+        return sym.lambdify(args, exprs, 'numpy')
+
+
+class ScipySolver(object):
+    """Drop-in replacement for the compiled Fortran module.
+
+    The symbolic rate expressions and their derivatives are turned into
+    vectorised NumPy callables and integrated with one of SciPy's stiff
+    integrators, so no Fortran compiler or SUNDIALS installation is needed.
+    Algebraic variables (zeros on the diagonal of the mass matrix, as in
+    the PFR model) are eliminated by solving for them with Newton's method
+    every time the differential variables change."""
+
+    methods = {'BDF': BDF, 'RADAU': Radau}
+    # Iterations without halving the residual before Newton gives up
+    nstallmax = 50
+
+    def __init__(self, model, method='BDF'):
+        try:
+            self.integrator = self.methods[method.upper()]
+        except KeyError:
+            raise ValueError("Unknown SciPy integrator {}!".format(method))
+
+        self.neq = model.nvariables
+        self.nrates = len(model.rates)
+        self.nvac = len(model.vacancy)
+        self.dypdr = np.array(model.dypdr, dtype=float)
+        self.dvacdy = np.array(model.dvacdy, dtype=float)
+        self.vactot = np.array([model.vactot[vac] for vac in model.vacancy],
+                               dtype=float)
+
+        diag = np.array(model.M.diagonal(), dtype=float)
+        self.diff = np.nonzero(diag)[0]
+        self.alg = np.nonzero(diag == 0)[0]
+
+        # Mass-action rates are evaluated from their reaction orders, so
+        # only the remaining (coverage-dependent) rates need to be turned
+        # into NumPy callables.
+        self.massaction = model.massaction
+        self.symbolic = np.nonzero(~model.massaction.active)[0]
+
+        # The rate expressions refer to the runtime parameters as 1-indexed
+        # array elements, e.g. kfor[1]. Replace them by plain symbols so
+        # they can be passed as arguments to the NumPy callables.
+        params = {'kfor': [sym.Dummy() for i in range(self.nrates)],
+                  'krev': [sym.Dummy() for i in range(self.nrates)],
+                  'yfix': [sym.Dummy() for i in range(len(model.yfix))]}
+        subs = {}
+        for expr in model.rates[self.symbolic]:
+            for idx in sym.sympify(expr).atoms(sym.Indexed):
+                i = int(idx.indices[0]) - 1
+                subs[idx] = params[idx.base.label.name][i]
+
+        args = [list(model.symbols),
+                [vac.symbol for vac in model.vacancy],
+                params['kfor'], params['krev'], params['yfix']]
+
+        self._rates = None
+        self._drdy = None
+        self._drdvac = None
+        if len(self.symbolic) > 0:
+            rates = [sym.sympify(model.rates[i]).subs(subs)
+                     for i in self.symbolic]
+            self._rates = _lambdify(args, rates)
+
+            drdy = sym.Matrix(len(self.symbolic), self.neq,
+                              lambda i, j: sym.sympify(
+                                  model.drdy[self.symbolic[i], j]))
+            self._drdy = _lambdify(args, drdy.subs(subs))
+
+            if self.nvac > 0:
+                drdvac = sym.Matrix(len(self.symbolic), self.nvac,
+                                    lambda i, j: sym.sympify(
+                                        model.drdvac[self.symbolic[i], j]))
+                self._drdvac = _lambdify(args, drdvac.subs(subs))
+
+        self.kfor = np.ones(self.nrates)
+        self.krev = np.ones(self.nrates)
+        self.yfix = np.zeros(len(model.yfix))
+        # Temperature ramp (see set_ramp) and the time the rate constants
+        # are evaluated at
+        self.ramp = None
+        self.t = 0.
+        self.y0 = np.zeros(self.neq)
+        self.yp0 = np.zeros(self.neq)
+        self.rtol = 1e-10
+        self.atol = 1e-32
+
+    def set_params(self, kfor, krev, yfix):
+        self.kfor = np.array(kfor, dtype=float)
+        self.krev = np.array(krev, dtype=float)
+        self.yfix = np.array(yfix, dtype=float)
+
+    def set_ramp(self, temp0, beta, tref, rampfor, ramprev):
+        """Evaluates the rate constants at T(t) = temp0 + beta t from
+        modified Arrhenius fits while beta is nonzero, see micki.ramp"""
+        self.ramp = None
+        if beta != 0:
+            self.ramp = (temp0, beta, tref, np.array(rampfor, dtype=float),
+                         np.array(ramprev, dtype=float))
+
+    def _rate_constants(self):
+        if self.ramp is None:
+            return self.kfor, self.krev
+        temp0, beta, tref, rampfor, ramprev = self.ramp
+        T = temp0 + beta * self.t
+        return arrhenius(rampfor, T, tref), arrhenius(ramprev, T, tref)
+
+    def initialize(self, y0, rtol, atol, ipar, rpar, id_vec):
+        self.reinitialize(y0, rtol, atol, id_vec)
+
+    def reinitialize(self, y0, rtol, atol, id_vec):
+        self.y0 = np.array(y0, dtype=float)
+        self.rtol = rtol
+        self.atol = np.array(atol, dtype=float)
+        self.t = 0.
+        self.yp0 = self.residual(self.y0)
+
+    def finalize(self):
+        pass
+
+    def _args(self, y):
+        vac = self.vactot + np.dot(self.dvacdy, y)
+        vac[vac < -1e-10] = 0.
+        kfor, krev = self._rate_constants()
+        return (y, vac, kfor, krev, self.yfix)
+
+    def ratecalc(self, y):
+        """Rates of all reactions"""
+        args = self._args(y)
+        rates = self.massaction.rates(*args)
+        if self._rates is not None:
+            rates[self.symbolic] = np.array(self._rates(*args), dtype=float)
+        return rates
+
+    def drdycalc(self, y):
+        """Derivatives of all rates w.r.t. the variables, including the
+        contribution from the vacancies."""
+        args = self._args(y)
+        drdy, drdvac = self.massaction.jacobian(*args)
+        if self._drdy is not None:
+            drdy[self.symbolic] = np.array(self._drdy(*args), dtype=float)
+        if self._drdvac is not None:
+            drdvac[self.symbolic] = np.array(self._drdvac(*args), dtype=float)
+        return drdy + np.dot(drdvac, self.dvacdy)
+
+    def residual(self, y):
+        """Right-hand side of M dy/dt = f(y)"""
+        return np.dot(self.dypdr, self.ratecalc(y))
+
+    def jacobian(self, y):
+        return np.dot(self.dypdr, self.drdycalc(y))
+
+    def _solve_algebraic(self, yd, ya):
+        """Finds the algebraic variables consistent with the differential
+        variables yd, starting from the guess ya."""
+        y = np.zeros(self.neq)
+        y[self.diff] = yd
+        y[self.alg] = ya
+        ix = np.ix_(self.alg, self.alg)
+        for i in range(100):
+            res = self.residual(y)[self.alg]
+            dya = np.linalg.solve(self.jacobian(y)[ix], -res)
+            y[self.alg] += dya
+            if np.all(np.abs(dya) <= self.rtol * np.abs(y[self.alg])
+                      + self.atol[self.alg]):
+                break
+        return y
+
+    def _integrate(self, t0, y0):
+        """Returns a SciPy integrator for the differential variables and
+        a function mapping them onto the full variable vector."""
+        if len(self.alg) == 0:
+            def fun(t, y):
+                self.t = t
+                return self.residual(y)
+
+            def jac(t, y):
+                self.t = t
+                return self.jacobian(y)
+
+            def full(y):
+                return y
+
+            return self.integrator(fun, t0, y0, np.inf, rtol=self.rtol,
+                                   atol=self.atol, jac=jac), full
+
+        diff, alg = self.diff, self.alg
+        state = {'ya': y0[alg]}
+
+        def full(yd):
+            y = self._solve_algebraic(yd, state['ya'])
+            state['ya'] = y[alg]
+            return y
+
+        def fun(t, yd):
+            self.t = t
+            return self.residual(full(yd))[diff]
+
+        def jac(t, yd):
+            # Jacobian of the reduced system, J_dd - J_da J_aa^-1 J_ad
+            self.t = t
+            J = self.jacobian(full(yd))
+            Jda = J[np.ix_(diff, alg)]
+            Jaa = J[np.ix_(alg, alg)]
+            Jad = J[np.ix_(alg, diff)]
+            return J[np.ix_(diff, diff)] - np.dot(Jda,
+                                                  np.linalg.solve(Jaa, Jad))
+
+        return self.integrator(fun, t0, y0[diff], np.inf, rtol=self.rtol,
+                               atol=self.atol[diff], jac=jac), full
+
+    def _advance(self, solver, full, tout):
+        while solver.t < tout:
+            message = solver.step()
+            if solver.status == 'failed':
+                raise RuntimeError("Integration failed: {}".format(message))
+        if solver.t > tout:
+            yd = solver.dense_output()(tout)
+        else:
+            yd = solver.y
+        self.t = tout
+        return full(yd)
+
+    def _dydt(self, y):
+        dy = self.residual(y)
+        dy[self.alg] = 0.
+        return dy
+
+    def linearize(self, kfor, krev, yfix, y):
+        """Rates, their derivatives and the Jacobian of the steady-state
+        equations at the concentrations y for the rate constants kfor and
+        krev and the fixed concentrations yfix"""
+        # See find_steady_state_newton
+        solver = copy(self)
+        solver.set_params(kfor, krev, yfix)
+        solver.ramp = None
+        y = np.array(y, dtype=float)
+        drdy = solver.drdycalc(y)
+        return solver.ratecalc(y), drdy, np.dot(self.dypdr, drdy)
+
+    def find_steady_state(self, neq, nrates, dt, maxiter, epsilon, newton):
+        return self._steady_state(dt, maxiter, epsilon, newton)
+
+    def find_steady_state_newton(self, kfor, krev, yfix, y0, dt, maxiter,
+                                 epsilon):
+        # Works on a shallow copy holding its own parameters and initial
+        # values, so that several threads may share this solver
+        solver = copy(self)
+        solver.set_params(kfor, krev, yfix)
+        solver.y0 = np.array(y0, dtype=float)
+        dt, tau, rho = solver._initial_time_step(dt)
+        return solver._newton_steady_state(tau, rho, maxiter, epsilon)
+
+    def find_steady_state_batch(self, kfor, krev, yfix, y0, rtol, atol,
+                                id_vec, dt, maxiter, epsilon, newton):
+        ncond = y0.shape[1]
+        t1 = np.zeros(ncond)
+        u1 = np.zeros((self.neq, ncond))
+        du1 = np.zeros((self.neq, ncond))
+        r1 = np.zeros((self.nrates, ncond))
+        niter = np.zeros(ncond, dtype=int)
+        resnorm = np.zeros(ncond)
+        converged = np.zeros(ncond, dtype=int)
+        usednewton = np.zeros(ncond, dtype=int)
+        for k in range(ncond):
+            self.set_params(kfor[:, k], krev[:, k], yfix[:, k])
+            self.reinitialize(y0[:, k], rtol, atol, id_vec)
+            (t1[k], u1[:, k], du1[:, k], r1[:, k], niter[k], resnorm[k],
+             converged[k], usednewton[k]) = self._steady_state(
+                     dt, maxiter, epsilon, newton)
+        return t1, u1, du1, r1, niter, resnorm, converged, usednewton
+
+    def _spectral_radius(self, y):
+        """Upper bound on the spectral radius of the Jacobian of the
+        differential equations (its infinity norm)"""
+        jac = self.jacobian(y)[self.diff]
+        if jac.size == 0:
+            return 0.
+        return np.max(np.sum(np.abs(jac), axis=1))
+
+    def _initial_time_step(self, dt):
+        # Initial time steps of the transient integration and of the Newton
+        # search. Unless given, the former is the fastest timescale of the
+        # system at the initial conditions and the latter at least 60 s, as
+        # the pseudo-transient continuation stagnates if it starts from a
+        # tiny time step.
+        rho = self._spectral_radius(self.y0)
+        tau = dt
+        if dt <= 0:
+            dt = 1. / rho if rho > 0 else 1.
+            tau = max(60., dt)
+        return dt, tau, rho
+
+    def _steady_state(self, dt, maxiter, epsilon, newton):
+        dt, tau, rho = self._initial_time_step(dt)
+        # Solve the steady-state equations directly, and only integrate in
+        # time if that fails
+        nnewton = 0
+        if newton:
+            result = self._newton_steady_state(tau, rho, maxiter, epsilon)
+            if result[-1]:
+                return result + (1,)
+            nnewton = result[4]
+        result = self._transient_steady_state(dt, rho, maxiter, epsilon)
+        return result[:4] + (result[4] + nnewton,) + result[5:] + (0,)
+
+    def _newton_steady_state(self, dt, rho, maxiter, epsilon):
+        """Pseudo-transient continuation: damped Newton steps on the
+        steady-state equations, regularized by an implicit Euler time step
+        tau that grows as the residual decreases. Gives up if the residual
+        has not halved in nstallmax iterations."""
+        mas = np.zeros(self.neq)
+        mas[self.diff] = 1.
+        y = self.y0.copy()
+        res = self.residual(y)
+        fnorm = np.max(np.abs(res))
+        tau = dt
+        t1 = 0.
+        niter = 0
+        converged = False
+        fbest = fnorm
+        nstall = 0
+        while niter < maxiter:
+            if converged or fnorm < epsilon:
+                break
+            niter += 1
+            jac = self.jacobian(y) - np.diag(mas / tau)
+            try:
+                dy = np.linalg.solve(jac, -res)
+            except np.linalg.LinAlgError:
+                dy = None
+            if dy is not None:
+                # Damp the step so that neither the concentrations nor the
+                # empty sites become negative. Concentrations that are
+                # already zero are kept at zero.
+                dy[(y <= 0) & (dy < 0)] = 0.
+                vac = self.vactot + np.dot(self.dvacdy, y)
+                dvac = np.dot(self.dvacdy, dy)
+                alpha = 1.
+                for x, dx in [(y, dy), (vac, dvac)]:
+                    mask = (x > 0) & (x + dx < 0)
+                    if np.any(mask):
+                        alpha = min(alpha,
+                                    np.min(0.99 * x[mask] / -dx[mask]))
+                ytrial = y + alpha * dy
+                restrial = self.residual(ytrial)
+                fnormtrial = np.max(np.abs(restrial))
+            if dy is not None and fnormtrial < 10 * fnorm:
+                with np.errstate(divide='ignore'):
+                    growth = min(10., max(0.1, fnorm / fnormtrial))
+                # Keep growing the time step while the residual does not
+                # increase, even if damped steps only reduce it a little
+                if fnormtrial <= fnorm:
+                    growth = max(growth, 2.)
+                # Once full Newton steps no longer change the
+                # concentrations, the residual is limited by round-off
+                # error. Shorter steps may only have stalled on a slow
+                # timescale, so grow the time step instead.
+                if np.all(np.abs(ytrial - y) <= 1e-10 * np.abs(y)):
+                    converged = tau * rho > 1e10
+                    growth = 10.
+                y = ytrial
+                res = restrial
+                t1 += alpha * tau
+                tau = min(tau * growth, 1e20)
+                fnorm = fnormtrial
+            else:
+                tau /= 4.
+                # Newton has stalled
+                if tau < dt * 1e-10:
+                    break
+            if fnorm < 0.5 * fbest:
+                fbest = fnorm
+                nstall = 0
+            else:
+                nstall += 1
+                if nstall >= self.nstallmax and not converged:
+                    break
+        converged = converged or fnorm < epsilon
+        return (t1, y, mas * res, self.ratecalc(y), niter, fnorm,
+                int(converged))
+
+    def _transient_steady_state(self, dt, rho, maxiter, epsilon):
+        """Integrates until the residual drops below epsilon, with output
+        times that start at dt and grow geometrically. As in the Newton
+        search, the steady state is also reached once the concentrations
+        stop changing over output intervals that are long compared with the
+        fastest timescale 1 / rho, with the residual limited by round-off
+        error."""
+        y = self._solve_algebraic(self.y0[self.diff], self.y0[self.alg])
+        solver, full = self._integrate(0., y)
+        tout = 0.
+        dtout = dt
+        t1 = 0.
+        niter = 0
+        resnorm = np.max(np.abs(self.residual(y)))
+        converged = resnorm < epsilon
+        while niter < maxiter and not converged:
+            if tout - t1 < dtout * 0.01:
+                tout = tout + dtout
+                dtout = min(2 * dtout, 1e20)
+            yprev = y
+            tprev = t1
+            y = self._advance(solver, full, tout)
+            t1 = tout
+            niter += 1
+            resnorm = np.max(np.abs(self.residual(y)))
+            converged = (resnorm < epsilon
+                         or ((t1 - tprev) * rho > 1e10
+                             and np.all(np.abs(y - yprev)
+                                        <= 1e-10 * np.abs(y))))
+        return (t1, y, self._dydt(y), self.ratecalc(y), niter, resnorm,
+                int(converged))
+
+    def solve(self, neq, nrates, nt, tfinal):
+        t1 = np.linspace(0., tfinal, nt)
+        u1 = np.zeros((neq, nt))
+        du1 = np.zeros((neq, nt))
+        r1 = np.zeros((nrates, nt))
+        u1[:, 0] = self.y0
+        du1[:, 0] = self.yp0
+        self.t = 0.
+        r1[:, 0] = self.ratecalc(self.y0)
+        y = self._solve_algebraic(self.y0[self.diff], self.y0[self.alg])
+        solver, full = self._integrate(0., y)
+        for i in range(1, nt):
+            y = self._advance(solver, full, t1[i])
+            u1[:, i] = y
+            du1[:, i] = self._dydt(y)
+            r1[:, i] = self.ratecalc(y)
+        return t1, u1, du1, r1
@@ -0,0 +1,168 @@
+"""Parallel parameter sweeps over many steady-state conditions"""
+
+from __future__ import print_function
+
+import os
+import warnings
+import multiprocessing
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Model used by the current worker process. It is built and compiled once
+# per worker by _init_worker.
+_model = None
+
+
+def _get_context():
+    # Forking lets the workers inherit the model (and its compiled module)
+    # without pickling it.
+    try:
+        return multiprocessing.get_context('fork')
+    except (AttributeError, ValueError):
+        return multiprocessing
+
+
+def _init_worker(model):
+    global _model
+    _model = model.copy(initialize=False)
+    _model.set_initial_conditions(model.U0)
+
+
+def _point_conditions(base, point):
+    U0 = base.copy()
+    T = None
+    for name, value in point.items():
+        if name == 'T':
+            T = value
+        else:
+            U0[name] = value
+    if T is None:
+        T = _model.T
+    return T, U0
+
+
+def _solve_chunk(args):
+    """Solves one chunk of the grid. Returns the index of its first point,
+    the results as arrays with one row per point, and error messages for
+    the points that could not be solved at all."""
+    start, points, kwargs = args
+    base = _model.U0
+    conditions = [_point_conditions(base, point) for point in points]
+
+    npoints = len(points)
+    t = np.full(npoints, np.nan)
+    converged = np.zeros(npoints, dtype=bool)
+    errors = OrderedDict()
+
+    try:
+        results = [(0, npoints, _model.find_steady_state_batch(
+            [T for T, U0 in conditions], [U0 for T, U0 in conditions],
+            **kwargs))]
+    except Exception:
+        # Solve the points one by one, so that a single failing point does
+        # not take the rest of the chunk down with it. This also handles
+        # points that need a different compiled module.
+        results = []
+        T0 = _model.T
+        for k, (T, U0) in enumerate(conditions):
+            try:
+                _model.T = T
+                _model.set_initial_conditions(U0)
+                results.append((k, 1, _model.find_steady_state_batch(
+                    [T], [U0], **kwargs)))
+            except Exception as e:
+                errors[start + k] = '{}: {}'.format(type(e).__name__, e)
+            finally:
+                _model.set_initial_conditions(base)
+                _model.T = T0
+
+    if not results:
+        return start, npoints, t, None, None, converged, None, None, errors
+
+    Unames = list(results[0][2][1])
+    rnames = list(results[0][2][2])
+    U = np.full((npoints, len(Unames)), np.nan)
+    r = np.full((npoints, len(rnames)), np.nan)
+    for k, n, (tk, Uk, rk, convk) in results:
+        t[k:k + n] = tk
+        U[k:k + n] = np.array([Uk[name] for name in Unames]).T
+        r[k:k + n] = np.array([rk[name] for name in rnames]).T
+        converged[k:k + n] = convk
+    return start, npoints, t, U, r, converged, Unames, rnames, errors
+
+
+def run(model, grid, workers=None, chunksize=None, dt=None, maxiter=2000,
+        epsilon=1e-8, method='newton'):
+    """Finds the steady state of model at every point of grid in parallel.
+
+    Each point of grid is a dictionary that may contain a temperature 'T'
+    and initial concentrations overriding those of model.U0, which must
+    have been set with set_initial_conditions. Every worker process builds
+    and compiles its own copy of the model once, and then solves chunks of
+    chunksize consecutive points with find_steady_state_batch.
+
+    Returns the simulated times, dictionaries mapping species and reaction
+    names onto arrays of concentrations and rates with one element per grid
+    point (in the order of grid), an array flagging the points that
+    converged, and a dictionary mapping the indices of points that could
+    not be solved onto error messages. Their results are NaN."""
+    global _model
+    if model.U0 is None:
+        raise ValueError("Initial conditions of the model must be set "
+                         "before running a sweep!")
+    grid = list(grid)
+    npoints = len(grid)
+    if workers is None:
+        workers = os.cpu_count() if hasattr(os, 'cpu_count') \
+                else multiprocessing.cpu_count()
+    workers = max(1, min(workers, npoints))
+    if chunksize is None:
+        # A few chunks per worker balances the load between workers
+        # without paying too much overhead per chunk.
+        chunksize = max(1, int(np.ceil(npoints / (4. * workers))))
+
+    kwargs = dict(dt=dt, maxiter=maxiter, epsilon=epsilon, method=method)
+    chunks = [(start, grid[start:start + chunksize], kwargs)
+              for start in range(0, npoints, chunksize)]
+
+    if workers == 1:
+        _init_worker(model)
+        try:
+            results = [_solve_chunk(chunk) for chunk in chunks]
+        finally:
+            # Don't keep the copy of the model (and its module) alive
+            _model = None
+    else:
+        pool = _get_context().Pool(workers, _init_worker, (model,))
+        try:
+            results = list(pool.imap_unordered(_solve_chunk, chunks))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    # Reassemble the chunks in the order of the grid
+    t = np.full(npoints, np.nan)
+    U = OrderedDict()
+    r = OrderedDict()
+    converged = np.zeros(npoints, dtype=bool)
+    errors = OrderedDict()
+    for (start, n, tc, Uc, rc, convc, Unames,
+         rnames, errc) in sorted(results, key=lambda result: result[0]):
+        errors.update(errc)
+        t[start:start + n] = tc
+        converged[start:start + n] = convc
+        if Uc is None:
+            continue
+        for names, arr, out in [(Unames, Uc, U), (rnames, rc, r)]:
+            for i, name in enumerate(names):
+                out.setdefault(name, np.full(npoints, np.nan))
+                out[name][start:start + n] = arr[:, i]
+
+    if errors:
+        warnings.warn("{} of {} points failed!".format(len(errors), npoints),
+                      RuntimeWarning, stacklevel=2)
+    return t, U, r, converged, errors
@@ -0,0 +1,225 @@
+"""Array-backed thermochemistry and rate constants of all reactions in a
+model"""
+
+from __future__ import print_function
+
+import warnings
+
+import numpy as np
+import sympy as sym
+
+from ase.units import kB, _hplanck, _k
+
+
+def _calc_alpha(dGf, dGr, dEr, dEp):
+    """Returns the fraction alpha of the difference in the electronic
+    energies of products and reactants, dEp - dEr, that shifts the
+    transition state. dGf and dGr are the forward and reverse barriers
+    at zero coverage. All arguments are arrays of the same shape;
+    entries for which no alpha in [0, 1] exists are nan."""
+    dGf, dGr, dEr, dEp = np.broadcast_arrays(*[np.asarray(x, dtype=float)
+                                               for x in (dGf, dGr, dEr, dEp)])
+    dE = dEp - dEr
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = dGf / (dGf + dGr)
+        b = -2 * dE + dGf + dGr
+        root = np.sqrt(8 * dE * dGf + b**2)
+        a1 = (-b - root) / (4 * dE)
+        a2 = (-b + root) / (4 * dE)
+    a1_ok = (a1 >= 0.) & (a1 <= 1.)
+    a2_ok = (a2 >= 0.) & (a2 <= 1.)
+    shifted = np.where(a1_ok, a1, np.where(a2_ok, a2, np.nan))
+    return np.where(dE == 0, alpha, shifted)
+
+
+class _Stoichiometry(object):
+    """Sparse matrix of the number of times each species appears in each
+    reaction, stored as (row, column, count) triplets"""
+
+    def __init__(self, nrows, ncols, entries):
+        counts = {}
+        for row, col in entries:
+            counts[row, col] = counts.get((row, col), 0) + 1
+        keys = sorted(counts)
+        self.shape = (nrows, ncols)
+        self.rows = np.array([key[0] for key in keys], dtype=int)
+        self.cols = np.array([key[1] for key in keys], dtype=int)
+        self.counts = np.array([counts[key] for key in keys], dtype=float)
+
+    def dot(self, x):
+        return np.bincount(self.rows, weights=self.counts * x[self.cols],
+                           minlength=self.shape[0])
+
+
+class ThermoArrays(object):
+    """Struct-of-arrays storage of the enthalpies, entropies, free
+    energies, lateral interactions and energy corrections of all species
+    in a set of reactions, together with the stoichiometry of their
+    reactants, products and transition states.
+
+    update() computes dH, dS, dG, dG_act, keq, kfor and krev of all
+    reactions at once and stores them on the Reaction objects, exactly as
+    Reaction.update would. Rate constants of the TST, EQUIL and DIEQUIL
+    methods are vectorised too; other methods need species-specific data
+    and are still calculated by their reactions. Models with
+    coverage-dependent (symbolic) energies cannot be vectorised, in which
+    case update() returns False and does nothing."""
+
+    _vectorised = ['TST', 'EQUIL', 'DIEQUIL']
+
+    def __init__(self, reactions):
+        self.reactions = list(reactions)
+        self.species = []
+        index = {}
+        entries = {'reactants': [], 'products': [], 'ts': []}
+        for j, reaction in enumerate(self.reactions):
+            for name in entries:
+                group = getattr(reaction, name)
+                if group is None:
+                    continue
+                for species in group:
+                    if species not in index:
+                        index[species] = len(self.species)
+                        self.species.append(species)
+                    entries[name].append((j, index[species]))
+
+        nrxns = len(self.reactions)
+        nspecies = len(self.species)
+        self.reactants = _Stoichiometry(nrxns, nspecies, entries['reactants'])
+        self.products = _Stoichiometry(nrxns, nspecies, entries['products'])
+        self.ts = _Stoichiometry(nrxns, nspecies, entries['ts'])
+
+        self.has_ts = np.array([reaction.ts is not None
+                                for reaction in self.reactions], dtype=bool)
+        self.dground = np.array([bool(reaction.dground)
+                                 for reaction in self.reactions], dtype=bool)
+        self.rhoreact = np.array([reaction.reactants.get_reference_state()
+                                  for reaction in self.reactions],
+                                 dtype=float)
+        self.rhoprod = np.array([reaction.products.get_reference_state()
+                                 for reaction in self.reactions], dtype=float)
+        self.method = np.array([reaction.method
+                                for reaction in self.reactions])
+
+        self.H = np.zeros(nspecies)
+        self.S = np.zeros(nspecies)
+        self.G = np.zeros(nspecies)
+        self.lateral = np.zeros(nspecies)
+        self.dE = np.zeros(nspecies)
+
+    def _load_species(self, T):
+        """Fills the per-species arrays at T. Returns False if any of the
+        energies depends on the coverages."""
+        for i, species in enumerate(self.species):
+            H = species.get_H(T)
+            if isinstance(H, sym.Basic) or isinstance(species.lateral,
+                                                      sym.Basic):
+                return False
+            self.H[i] = H
+            self.S[i] = species.get_S(T)
+            self.lateral[i] = species.lateral
+            self.dE[i] = species.dE
+        self.G[:] = self.H - T * self.S
+        return True
+
+    def _get_scale(self, param):
+        return np.array([reaction.scale[param]
+                         for reaction in self.reactions], dtype=float)
+
+    def update(self, T, Asite=None, L=None, force=False):
+        """Recalculates the rate constants of all reactions, if any of them
+        is out of date or force is True. Returns False if the reactions
+        have to be updated one at a time instead."""
+        reactions = self.reactions
+        if not force and not any(reaction.is_update_needed(T, Asite, L)
+                                 for reaction in reactions):
+            return True
+
+        dG_given = np.full(len(reactions), np.nan)
+        for j, reaction in enumerate(reactions):
+            if reaction.ts is None and reaction.dG_act is not None:
+                if isinstance(reaction.dG_act, sym.Basic):
+                    return False
+                dG_given[j] = reaction.dG_act
+
+        if not self._load_species(T):
+            return False
+
+        kT = kB * T
+        Hr = self.reactants.dot(self.H)
+        Sr = self.reactants.dot(self.S)
+        dH = self.products.dot(self.H) - Hr
+        dS = self.products.dot(self.S) - Sr
+        dG = dH - T * dS
+
+        skfor = self._get_scale('kfor')
+        skrev = self._get_scale('krev')
+        keq = np.exp(-dG / kT) * self.rhoprod / self.rhoreact * skfor / skrev
+
+        # Barriers of reactions with a transition state. The electronic
+        # energy corrections and lateral interactions of both sides shift
+        # the transition state by a fraction alpha.
+        has_ts = self.has_ts
+        Gts = self.ts.dot(self.G)
+        Eshift = self.lateral + self.dE
+        dEr = self.reactants.dot(Eshift)
+        dEp = self.products.dot(Eshift)
+        dGf = Gts - self.reactants.dot(self.G) + dEr
+        dGr = Gts - self.products.dot(self.G) + dEp
+        for j in np.nonzero(has_ts & ((dGf < 0) | (dGr < 0)))[0]:
+            direction = 'forwards' if dGf[j] < 0 else 'reverse'
+            raise RuntimeError('Reaction {} has negative {} activation '
+                               'barrier!'.format(reactions[j], direction))
+
+        alpha = np.where(has_ts, _calc_alpha(dGf, dGr, dEr, dEp), np.nan)
+        for j in np.nonzero(has_ts & np.isnan(alpha))[0]:
+            raise RuntimeError("Couldn't find alpha parameter for "
+                               "{}!".format(reactions[j]))
+
+        dH_act = (self.ts.dot(self.H) + (1 - alpha) * dEr + alpha * dEp
+                  - Hr) * self._get_scale('dH_act')
+        dS_act = (self.ts.dot(self.S) - Sr) * self._get_scale('dS_act')
+        dG_act = np.where(has_ts, dH_act - T * dS_act, dG_given)
+
+        for j in np.nonzero(has_ts & self.dground)[0]:
+            if dG_act[j] < 0.:
+                warnings.warn('Negative activation energy found for {}. '
+                              'Rounding to 0.'.format(reactions[j]),
+                              RuntimeWarning, stacklevel=3)
+                dG_act[j] = 0.
+            if dG_act[j] - dG[j] < 0.:
+                warnings.warn('Negative activation energy found for {}. '
+                              'Rounding to {}'.format(reactions[j], dG[j]),
+                              RuntimeWarning, stacklevel=3)
+                dG_act[j] = dG[j]
+
+        barr = np.where(np.isnan(dG_act), 1.,
+                        np.exp(-dG_act / kT) / self.rhoreact)
+        kfor = _k * T * barr / _hplanck * skfor
+        kfor2 = kfor * keq * skrev / skfor
+        kfor = np.where(self.method == 'DIEQUIL', kfor * kfor2 / (kfor + kfor2),
+                        np.where((self.method == 'EQUIL') & (keq < 1),
+                                 kfor2, kfor))
+        krev = kfor / keq
+
+        for j, reaction in enumerate(reactions):
+            reaction.T = T
+            reaction.Asite = Asite
+            reaction.L = L
+            reaction.dH = dH[j]
+            reaction.dS = dS[j]
+            reaction.dG = dG[j]
+            reaction.keq = keq[j]
+            if has_ts[j]:
+                reaction.alpha = alpha[j]
+                reaction.dH_act = dH_act[j]
+                reaction.dS_act = dS_act[j]
+                reaction.dG_act = dG_act[j]
+            if reaction.method in self._vectorised:
+                reaction.kfor = kfor[j]
+                reaction.krev = krev[j]
+            else:
+                reaction._calc_kfor()
+                reaction._calc_krev()
+            reaction._inputs = reaction._get_inputs()
+        return True
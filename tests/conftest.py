@@ -0,0 +1,73 @@
+"""Shared fixtures: a small CO oxidation network on Pt with two sticking
+adsorption steps and one transition-state surface reaction"""
+
+from __future__ import print_function
+
+import ctypes.util
+
+import pytest
+
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from micki import Gas, Adsorbate, Reaction, Model
+
+
+# The Fortran backend links against SUNDIALS, so tests that compile a model
+# are skipped where it is not installed
+requires_sundials = pytest.mark.skipif(
+        ctypes.util.find_library('sundials_ida') is None,
+        reason="SUNDIALS is not installed")
+
+U0 = {'CO': 0.1, 'O2': 0.05, 'CO2': 0.}
+
+
+def _atoms(symbols, positions, energy):
+    atoms = Atoms(symbols, positions=positions)
+    atoms.calc = SinglePointCalculator(atoms, energy=energy)
+    return atoms
+
+
+def make_species():
+    star = Adsorbate(_atoms('', [], 0.), 'Pt', freqs=[])
+    co = Gas(_atoms('CO', [[0, 0, 0], [0, 0, 1.13]], -15.), 'CO',
+             freqs=[0.01] * 5 + [0.26], symm=1)
+    o2 = Gas(_atoms('O2', [[0, 0, 0], [0, 0, 1.21]], -9.8), 'O2',
+             freqs=[0.01] * 5 + [0.19], symm=2)
+    co2 = Gas(_atoms('CO2', [[0, 0, 0], [0, 0, 1.16], [0, 0, -1.16]], -23.),
+              'CO2', freqs=[0.01] * 5 + [0.08, 0.08, 0.16, 0.29], symm=2)
+    cos = Adsorbate(_atoms('CO', [[0, 0, 0], [0, 0, 1.13]], -16.5), 'COs',
+                    freqs=[0.02, 0.03, 0.04, 0.05, 0.06, 0.25], sites=[star])
+    os_ = Adsorbate(_atoms('O', [[0, 0, 0]], -5.6), 'Os',
+                    freqs=[0.03, 0.04, 0.05], sites=[star])
+    ts = Adsorbate(_atoms('CO2', [[0, 0, 0], [0, 0, 1.2], [0, 1.5, 0]], -21.4),
+                   'TS', freqs=[-0.05, 0.02, 0.03, 0.04, 0.05, 0.06, 0.07, 0.2],
+                   sites=[star, star], ts=True)
+    return dict(star=star, co=co, o2=o2, co2=co2, cos=cos, os=os_, ts=ts)
+
+
+def make_reactions(species):
+    sp = species
+    return dict(r1=Reaction(sp['co'], sp['cos'], method='STICK'),
+                r2=Reaction(sp['o2'], 2 * sp['os'], method='STICK'),
+                r3=Reaction(sp['cos'] + sp['os'], sp['co2'], ts=sp['ts']))
+
+
+def make_model(T=500., backend='scipy', **kwargs):
+    """Returns the model of the network and its species"""
+    species = make_species()
+    model = Model(T, 1e-19, backend=backend, **kwargs)
+    model.add_reactions(make_reactions(species))
+    model.set_fixed(['CO', 'O2', 'CO2'])
+    return model, species
+
+
+@pytest.fixture
+def species():
+    return make_species()
+
+
+@pytest.fixture
+def model():
+    return make_model()[0]
+
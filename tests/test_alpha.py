@@ -0,0 +1,82 @@
+"""The numeric transfer coefficient alpha agrees with the SymPy path of
+Reaction.update"""
+
+from __future__ import print_function
+
+import warnings
+
+import numpy as np
+import pytest
+import sympy as sym
+
+from micki import Reaction
+from micki.thermoarrays import _calc_alpha
+
+
+def _sympy_alpha(dGf, dGr, dEr, dEp):
+    """alpha the way Reaction.update finds it for coverage-dependent
+    energies, or nan where that raises"""
+    dGf, dGr, dEr, dEp = [sym.Float(x) for x in (dGf, dGr, dEr, dEp)]
+    if dEp - dEr == 0:
+        return float(dGf / (dGf + dGr))
+    root = sym.sqrt(8*(dEp-dEr)*dGf + (-2*dEp + 2*dEr + dGf + dGr)**2)
+    for sign in (-1, 1):
+        alpha = sym.sympify((2*dEp - 2*dEr - dGf - dGr + sign*root)
+                            / (4*(dEp-dEr)))
+        if alpha.is_real and 0. <= alpha <= 1.:
+            return float(alpha)
+    return np.nan
+
+
+@pytest.mark.parametrize('dGf, dGr, dEr, dEp, expected', [
+    # No shift: alpha is the ratio of the barriers
+    (0.5, 0.7, 0.2, 0.2, 0.5 / 1.2),
+    # Roots on the edges of [0, 1]
+    (0., 1., 0., -0.5, 0.),
+    (1., 0., 0., 0.5, 1.),
+    # Both roots in [0, 1]: the first one wins
+    (0.3, -0.4, 0., -1.1, 0.7796394249011379),
+    # Real roots, both outside of [0, 1]
+    (-0.3, 0.9, 0., -2., np.nan),
+    # Complex roots
+    (1., -2.9, 0., -1., np.nan),
+])
+def test_alpha_edge_cases(dGf, dGr, dEr, dEp, expected):
+    reference = _sympy_alpha(dGf, dGr, dEr, dEp)
+    alpha = _calc_alpha(dGf, dGr, dEr, dEp)
+    np.testing.assert_allclose(alpha, reference, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(alpha, expected, rtol=1e-12, atol=1e-15)
+
+
+def test_alpha_random():
+    rng = np.random.RandomState(0)
+    dGf, dGr = rng.uniform(0., 2., (2, 200))
+    dEr, dEp = rng.uniform(-3., 3., (2, 200))
+    dEr[:10] = dEp[:10]
+    alpha = _calc_alpha(dGf, dGr, dEr, dEp)
+    reference = [_sympy_alpha(*args) for args in zip(dGf, dGr, dEr, dEp)]
+    np.testing.assert_allclose(alpha, reference, rtol=1e-10)
+    assert np.all((alpha >= 0.) & (alpha <= 1.))
+
+
+@pytest.mark.parametrize('dE', [0., 0.3, -0.3, 2., -2.])
+@pytest.mark.parametrize('dground', [False, True])
+def test_reaction_alpha(species, dE, dground):
+    """Reaction.update takes the SymPy path when the energy shifts are
+    SymPy numbers, and the numeric one when they are floats"""
+    sp = species
+    reaction = Reaction(sp['cos'] + sp['os'], sp['co2'] + 2 * sp['star'],
+                        ts=sp['ts'], dground=dground)
+    results = []
+    for convert in (float, sym.Float):
+        sp['cos'].dE = convert(dE)
+        sp['co2'].dE = convert(-dE / 2.)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            reaction.update(T=500., force=True)
+        results.append([float(x) for x in (reaction.alpha, reaction.dG_act,
+                                           reaction.kfor, reaction.krev)])
+    assert not isinstance(sp['cos'].dE, float)
+    np.testing.assert_allclose(results[0], results[1], rtol=1e-10)
+    assert 0. <= results[0][0] <= 1.
+
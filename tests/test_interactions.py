@@ -0,0 +1,170 @@
+"""Lateral interaction matrices against symbolic coverage dependence and
+a plain Python evaluation of the energy shifts"""
+
+from __future__ import print_function
+
+import warnings
+
+import numpy as np
+import pytest
+
+from ase.units import kB
+
+from micki import Model
+
+from conftest import U0, make_model, make_reactions, requires_sundials
+
+T = 520.
+names = ['COs', 'Os', 'TS']
+E = [[0.3, 0.1, 0.],
+     [0.1, 0.2, 0.],
+     [0.15, 0.1, 0.]]
+points = [{'COs': 0.35, 'Os': 0.6, 'Pt': 0.05},
+          {'COs': 0.1, 'Os': 0.3, 'Pt': 0.6},
+          {'COs': 0.9, 'Os': 0.05, 'Pt': 0.05}]
+
+
+def _model(backend='scipy', thresholds=None, interactions=True, E=E):
+    model = make_model(T, backend=backend)[0]
+    if interactions:
+        model.set_interactions(E, names, thresholds=thresholds)
+    model.set_initial_conditions(U0)
+    return model
+
+
+def _concentrations(model, point):
+    U = dict(model.U0)
+    U.update(point)
+    return U
+
+
+def _reference_rates(model, U, thresholds=None, E=E):
+    """Rates with the energy of each species shifted by
+    sum_k E[i][k] * max(theta_k - thresholds[k], 0), evaluated one
+    reaction at a time. The shifts change the barriers through the
+    transition state and alpha at zero coverage."""
+    species = dict((sp.label, sp) for rxn in model._reactions
+                   for group in (rxn.reactants, rxn.products, rxn.ts)
+                   if group is not None for sp in group)
+    L = {}
+    for i, name in enumerate(names):
+        L[name] = 0.
+        for k, other in enumerate(names):
+            if other not in U:
+                continue
+            x = U[other]
+            if thresholds is not None:
+                x = max(x - thresholds[k], 0.)
+            L[name] += E[i][k] * x
+    assert set(L) <= set(species)
+
+    y = model._get_initial_values(U)
+    vac = [U[vacancy.label] for vacancy in model.vacancy]
+    rfor, rrev = model.massaction.fluxes(y, vac, np.asarray(model.kfor),
+                                         np.asarray(model.krev), model.yfix)
+    rates = np.zeros(len(model._reactions))
+    for j, rxn in enumerate(model._reactions):
+        ts = 0.
+        scale = 1.
+        alpha = 0.
+        if rxn.ts is not None:
+            ts = sum(L.get(sp.label, 0.) for sp in rxn.ts)
+            scale = rxn.scale['dH_act']
+            alpha = float(rxn.alpha)
+        dn = (sum(L.get(sp.label, 0.) for sp in rxn.products)
+              - sum(L.get(sp.label, 0.) for sp in rxn.reactants))
+        gfor = scale * (ts + alpha * dn) / (kB * T)
+        grev = gfor - dn / (kB * T)
+        rates[j] = rfor[j] * np.exp(-gfor) - rrev[j] * np.exp(-grev)
+    return rates
+
+
+@pytest.mark.parametrize('thresholds', [None, [0.2, 0.5, 0.]])
+@pytest.mark.parametrize('point', points)
+def test_rates_match_reference(thresholds, point):
+    # The fluxes without interactions come from a model without them
+    reference = _model(interactions=False)
+    model = _model(thresholds=thresholds)
+    U = _concentrations(model, point)
+    np.testing.assert_allclose(model.linearize(U)[0],
+                               _reference_rates(reference, U, thresholds),
+                               rtol=1e-12)
+
+
+@pytest.mark.parametrize('backend', [
+    'scipy', pytest.param('fortran', marks=requires_sundials)])
+def test_energies_change_at_runtime(backend):
+    """Only the sparsity pattern of the interactions is in the generated
+    code"""
+    reference = _model(interactions=False)
+    model = _model(backend, thresholds=[0.2, 0.5, 0.])
+    solver = model._solve_ida
+    E2 = 2 * np.array(E)
+    thresholds = [0.3, 0.1, 0.]
+    model.set_interactions(E2, names, thresholds=thresholds)
+    assert model._solve_ida is solver
+    U = _concentrations(model, points[0])
+    np.testing.assert_allclose(model.linearize(U)[0],
+                               _reference_rates(reference, U, thresholds, E2),
+                               rtol=1e-10)
+    E2[0, 1] = 0.
+    model.set_interactions(E2, names, thresholds=thresholds)
+    assert model._solve_ida is not solver
+
+
+@pytest.mark.parametrize('point', points)
+def test_matrix_matches_symbolic(species, point):
+    """The same interactions written into the lateral energies of the
+    species, which are expanded symbolically. The symbolic barriers
+    cannot depend on the coverages through the transition state."""
+    Ecov = [E[0], E[1], [0., 0., 0.]]
+    interacting = [species['cos'], species['os']]
+    for i, thermo in enumerate(interacting):
+        thermo.lateral = sum(Ecov[i][k] * interacting[k].symbol
+                             for k in range(2))
+    reference = Model(T, 1e-19, backend='scipy')
+    reference.add_reactions(make_reactions(species))
+    reference.set_fixed(['CO', 'O2', 'CO2'])
+    reference.set_initial_conditions(U0)
+    assert not np.any(reference.massaction.active[[0, 2]])
+
+    model = _model(E=Ecov)
+    U = _concentrations(model, point)
+    for actual, desired in zip(model.linearize(U), reference.linearize(U)):
+        np.testing.assert_allclose(actual, desired, rtol=1e-10)
+
+
+@pytest.mark.parametrize('thresholds', [None, [0.2, 0.5, 0.]])
+def test_jacobian(thresholds):
+    model = _model(thresholds=thresholds)
+    U = _concentrations(model, points[0])
+    r, drdy, jac = model.linearize(U)
+    h = 1e-7
+    fd = np.zeros_like(drdy)
+    for i, species in enumerate(model._variable_species):
+        rates = []
+        for sign in [1, -1]:
+            Ui = dict(U)
+            Ui[species.label] += sign * h
+            rates.append(model.linearize(Ui)[0])
+        fd[:, i] = (rates[0] - rates[1]) / (2 * h)
+    np.testing.assert_allclose(drdy, fd, rtol=1e-6,
+                               atol=1e-6 * np.max(np.abs(drdy)))
+
+
+@requires_sundials
+@pytest.mark.parametrize('thresholds', [None, [0.2, 0.5, 0.]])
+def test_kernel_matches_numpy(thresholds):
+    """The shifts evaluated in the generated Fortran code"""
+    models = [_model(backend, thresholds) for backend in ['scipy', 'fortran']]
+    for point in points:
+        U = _concentrations(models[0], point)
+        for actual, desired in zip(models[1].linearize(U),
+                                   models[0].linearize(U)):
+            np.testing.assert_allclose(actual, desired, rtol=1e-10,
+                                       atol=1e-12 * np.max(np.abs(desired)))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        results = [model.find_steady_state()[2] for model in models]
+    for name in results[0]:
+        assert results[1][name] == pytest.approx(results[0][name], rel=1e-6)
@@ -0,0 +1,117 @@
+"""Mass-action rates and derivatives from reaction orders against SymPy"""
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+import sympy as sym
+
+from micki.massaction import MassAction
+
+from conftest import U0, make_model
+
+
+def _reference(Nf, Nr, kfor, krev, c, reversible=None):
+    """Rates and their derivatives w.r.t. c from symbolic expressions"""
+    symbols = sym.symbols('c0:{}'.format(len(c)))
+    subs = dict(zip(symbols, c))
+    r = np.zeros(len(Nf))
+    drdc = np.zeros((len(Nf), len(c)))
+    for j in range(len(Nf)):
+        rate = kfor[j] * sym.Mul(*[x**n for x, n in zip(symbols, Nf[j])])
+        if reversible is None or reversible[j]:
+            rate -= krev[j] * sym.Mul(*[x**n for x, n in zip(symbols, Nr[j])])
+        r[j] = rate.subs(subs)
+        for i, x in enumerate(symbols):
+            drdc[j, i] = sym.diff(rate, x).subs(subs)
+    return r, drdc
+
+
+# Two variables, one vacancy and one fixed species
+Nf = [[1, 0, 1, 0],
+      [0, 2, 0, 0],
+      [1, 1, 0, 1],
+      [0, 0, 2, 0]]
+Nr = [[0, 1, 0, 0],
+      [0, 0, 2, 1],
+      [0, 0, 0, 0],
+      [1, 0, 0, 1]]
+kfor = np.array([2., 3., 5., 7.])
+krev = np.array([0.5, 0.25, 11., 0.125])
+
+
+@pytest.mark.parametrize('c', [
+    [0.3, 0.2, 0.5, 0.7],
+    # Zero and slightly negative concentrations, as the integrators may
+    # produce them
+    [0., 0.2, 0., 0.7],
+    [-1e-12, 0., 0.5, 0.7],
+])
+def test_rates_and_jacobian(c):
+    ma = MassAction(Nf, Nr, [True] * 4, [True, True, False, True], 2, 1)
+    c = np.array(c)
+    r, drdc = _reference(Nf, Nr, kfor, krev, c, ma.reversible)
+    np.testing.assert_allclose(ma.rates(c[:2], c[2:3], kfor, krev, c[3:]), r,
+                               rtol=1e-14, atol=1e-300)
+    drdy, drdvac = ma.jacobian(c[:2], c[2:3], kfor, krev, c[3:])
+    np.testing.assert_allclose(drdy, drdc[:, :2], rtol=1e-14, atol=1e-300)
+    np.testing.assert_allclose(drdvac, drdc[:, 2:3], rtol=1e-14, atol=1e-300)
+
+
+def test_inactive_reactions():
+    c = np.array([0.3, 0.2, 0.5, 0.7])
+    active = [True, False, True, False]
+    ma = MassAction(Nf, Nr, active, [True] * 4, 2, 1)
+    r, drdc = _reference(Nf, Nr, kfor, krev, c)
+    np.testing.assert_allclose(ma.rates(c[:2], c[2:3], kfor, krev, c[3:]),
+                               np.where(active, r, 0.), rtol=1e-14)
+    drdy, drdvac = ma.jacobian(c[:2], c[2:3], kfor, krev, c[3:])
+    np.testing.assert_array_equal(drdy[1], 0.)
+    np.testing.assert_array_equal(drdvac[3], 0.)
+    # The fluxes include the inactive reactions
+    rfor, rrev = ma.fluxes(c[:2], c[2:3], kfor, krev, c[3:])
+    np.testing.assert_allclose(rfor - rrev, r, rtol=1e-14)
+    assert not ma.is_zero(0, 0)
+    assert ma.is_zero(1, 1)
+
+
+def test_fortran_expressions():
+    ma = MassAction(Nf, Nr, [True] * 4, [True, True, False, True], 2, 1)
+    names = ['y(1)', 'y(2)', 'vac(1)', 'yfix(1)']
+    assert ma.fortran_rate(1, names) == \
+        'kfor(2) * y(2)**2 - krev(2) * vac(1)**2 * yfix(1)'
+    assert ma.fortran_rate(2, names) == 'kfor(3) * y(1) * y(2) * yfix(1)'
+    assert ma.fortran_derivative(1, 1, names) == '2 * kfor(2) * y(2)'
+    assert ma.fortran_derivative(3, 2, names) == '2 * kfor(4) * vac(1)'
+    assert ma.fortran_derivative(2, 2, names) is None
+
+
+def test_model_orders():
+    """The orders of the model's reactions reproduce their symbolic rate
+    expressions"""
+    model = make_model()[0]
+    model.set_initial_conditions(U0)
+    ma = model.massaction
+    assert np.all(ma.active)
+
+    species = (model._variable_species + model.vacancy
+               + model._fixed_species)
+    rng = np.random.RandomState(0)
+    y = rng.uniform(0., 1., model.nvariables)
+    vac = rng.uniform(0., 1., len(model.vacancy))
+    c = dict(zip([sp.symbol for sp in species],
+                 np.concatenate([y, vac, model.yfix])))
+
+    kfor, krev = np.asarray(model.kfor), np.asarray(model.krev)
+    rates = ma.rates(y, vac, kfor, krev, model.yfix)
+    drdy, drdvac = ma.jacobian(y, vac, kfor, krev, model.yfix)
+    for j, rxn in enumerate(model._reactions):
+        rate = kfor[j] * sym.Mul(*[sp.symbol for sp in rxn.reactants])
+        rate -= krev[j] * sym.Mul(*[sp.symbol for sp in rxn.products])
+        assert rates[j] == pytest.approx(float(rate.subs(c)), rel=1e-12)
+        for i, sp in enumerate(model._variable_species):
+            assert drdy[j, i] == pytest.approx(
+                    float(sym.diff(rate, sp.symbol).subs(c)), rel=1e-12)
+        for i, sp in enumerate(model.vacancy):
+            assert drdvac[j, i] == pytest.approx(
+                    float(sym.diff(rate, sp.symbol).subs(c)), rel=1e-12)
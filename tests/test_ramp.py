@@ -0,0 +1,119 @@
+"""Rate constants along temperature ramps against direct evaluation of the
+thermochemistry"""
+
+from __future__ import print_function
+
+import warnings
+
+import numpy as np
+import pytest
+
+from micki.ramp import ramp_temperatures, fit_arrhenius, arrhenius
+
+from conftest import make_model, requires_sundials
+
+T0 = 300.
+beta = 2.
+tend = 250.
+# Temperature-programmed desorption of a covered surface
+U0 = {'CO': 0., 'O2': 0., 'CO2': 0., 'COs': 0.4, 'Os': 0.4}
+
+
+def _rate_constants(model, temps):
+    """Rate constants of model evaluated directly at each temperature"""
+    T = model.T
+    kfor = []
+    krev = []
+    for Ti in temps:
+        model.T = Ti
+        k = model._get_rate_constants()
+        kfor.append(k[0])
+        krev.append(k[1])
+    model.T = T
+    return np.array(kfor).T, np.array(krev).T
+
+
+def test_ramp_temperatures():
+    temps = ramp_temperatures(300., 800., 12)
+    assert len(temps) == 12
+    assert np.all(np.diff(temps) > 0)
+    assert 300. < temps[0] and temps[-1] < 800.
+    np.testing.assert_allclose(temps + temps[::-1], 1100.)
+
+
+def test_fit_arrhenius_exact():
+    temps = ramp_temperatures(300., 800.)
+    params = np.array([[1., -3., 0.], [0.5, 0., 1.5], [2e3, 1e4, 0.]])
+    k = arrhenius(params[:, :, np.newaxis], temps, 500.)
+    fitted, error = fit_arrhenius(temps, k, 500.)
+    assert error < 1e-10
+    np.testing.assert_allclose(fitted, params, rtol=1e-8, atol=1e-8)
+    T = np.linspace(300., 800., 11)
+    np.testing.assert_allclose(arrhenius(fitted[:, :, np.newaxis], T, 500.),
+                               arrhenius(params[:, :, np.newaxis], T, 500.),
+                               rtol=1e-8)
+
+
+def test_fit_arrhenius_zero():
+    temps = ramp_temperatures(300., 800.)
+    k = np.array([np.exp(-1e3 / temps), np.zeros_like(temps)])
+    params, error = fit_arrhenius(temps, k, 500.)
+    assert params[0, 1] == -np.inf
+    np.testing.assert_array_equal(arrhenius(params, 400., 500.)[1], 0.)
+    k[1, 3] = 1.
+    with pytest.raises(ValueError):
+        fit_arrhenius(temps, k, 500.)
+
+
+def test_model_fits():
+    """The fits of a model's rate constants against the rate constants
+    evaluated at temperatures in between the sampled ones"""
+    model = make_model(T0)[0]
+    model.set_initial_conditions(U0)
+    temp0, b, Tref, rampfor, ramprev = model._get_ramp(tend, beta)
+    assert (temp0, b) == (T0, beta)
+    assert model.T == T0
+
+    T = np.linspace(T0, T0 + beta * tend, 51)
+    kfor, krev = _rate_constants(model, T)
+    np.testing.assert_allclose(arrhenius(rampfor[:, :, np.newaxis], T, Tref),
+                               kfor, rtol=1e-2)
+    np.testing.assert_allclose(arrhenius(ramprev[:, :, np.newaxis], T, Tref),
+                               krev, rtol=1e-2)
+    # The rate constants at T0 are restored
+    np.testing.assert_array_equal(model._get_rate_constants()[0],
+                                  _rate_constants(model, [T0])[0][:, 0])
+
+
+def _check_ramp_rates(backend):
+    model = make_model(T0, backend=backend)[0]
+    model.set_initial_conditions(U0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        U, r = model.solve(tend, 26, beta=beta)
+    np.testing.assert_allclose(model.T1, T0 + beta * np.asarray(model.t))
+    assert model.T == T0
+
+    # Rates at the output times from the rate constants at T(t)
+    kfor, krev = _rate_constants(model, model.T1)
+    ma = model.massaction
+    for i, Ui in enumerate(U):
+        y = model._get_initial_values(Ui)
+        vac = [Ui[vacancy.label] for vacancy in model.vacancy]
+        rfor, rrev = ma.fluxes(y, vac, kfor[:, i], krev[:, i], model.yfix)
+        rates = [r[i][name] for name in model.reactions]
+        np.testing.assert_allclose(rates, rfor - rrev, rtol=1e-2,
+                                   atol=1e-12 * np.max(np.abs(rfor)))
+    return model
+
+
+def test_scipy_ramp_rates():
+    model = _check_ramp_rates('scipy')
+    # Adsorbates desorb and react as the surface heats up
+    assert model.U[-1]['COs'] < U0['COs']
+
+
+@requires_sundials
+def test_kernel_ramp_rates():
+    """The rate constants evaluated in the generated kernel"""
+    _check_ramp_rates('fortran')
@@ -0,0 +1,50 @@
+"""Adjoint gradients against finite differences"""
+
+from __future__ import print_function
+
+import warnings
+
+import pytest
+
+from micki import Model
+
+from conftest import U0, make_model, make_reactions, make_species
+
+# The adsorbates of a plug-flow reactor are algebraic variables
+U0_pfr = dict(U0, COs=0.3, Os=0.3)
+
+
+def _pfr(species):
+    model = Model(500., 1e-19, backend='scipy', reactor='PFR', rhocat=1.)
+    model.add_reactions(make_reactions(species))
+    model.set_fixed(['CO', 'O2'])
+    return model
+
+
+@pytest.mark.parametrize('reactor, t, U, name',
+                         [('PFR', 1., U0_pfr, 'COs'),
+                          ('PFR', 1., U0_pfr, 'Os'),
+                          # The adsorbates relax within nanoseconds
+                          ('CSTR', 0.1, U0, 'COs')])
+def test_gradient_matches_differences(reactor, t, U, name):
+    species = make_species()
+    if reactor == 'PFR':
+        model = _pfr(species)
+    else:
+        model, species = make_model()
+    model.set_initial_conditions(U)
+    thermo = dict((sp.label, sp) for sp in species.values())[name]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        G, grad = model.solve_adjoint(t, 'r3', [name])
+        h = 1e-4
+        values = []
+        for x in [h, -h]:
+            thermo.dE += x
+            model.set_initial_conditions(U)
+            values.append(model.solve_adjoint(t, 'r3', [])[0])
+            thermo.dE -= x
+    assert G > 0.
+    assert grad[name] == pytest.approx((values[0] - values[1]) / (2 * h),
+                                       rel=1e-4)
+
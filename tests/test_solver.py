@@ -0,0 +1,87 @@
+"""The SciPy backend against the compiled Fortran module"""
+
+from __future__ import print_function
+
+import warnings
+
+import pytest
+
+from conftest import U0, make_model, requires_sundials
+
+
+def _steady_state(backend, T=500., U0=U0, **kwargs):
+    model = make_model(T, backend=backend)[0]
+    model.set_initial_conditions(U0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        t, U, r = model.find_steady_state(**kwargs)
+    return model, U, r
+
+
+@pytest.mark.parametrize('method', ['newton', 'transient'])
+def test_scipy_steady_state(method):
+    model, U, r = _steady_state('scipy', method=method)
+    assert model.convergence.converged
+    # All sites are accounted for, and the surface species are balanced
+    # to within the tolerance of the residual
+    assert U['Pt'] + U['COs'] + U['Os'] == pytest.approx(1.)
+    assert r['r1'] == pytest.approx(r['r3'], abs=1e-7)
+    assert 2 * r['r2'] == pytest.approx(r['r3'], abs=1e-7)
+    assert r['r3'] > 0
+
+
+@pytest.mark.parametrize('backend, linear_solver, newton', [
+    ('fortran', 'dense', 1),
+    ('fortran', 'sparse', 0),
+    ('scipy', 'sparse', 1),
+])
+def test_newton_needs_dense_solver(backend, linear_solver, newton):
+    """The compiled Newton search factorises a dense Jacobian, so models
+    using the sparse solver integrate instead"""
+    model = make_model(backend=backend, linear_solver=linear_solver)[0]
+    assert model._get_newton('newton') == newton
+    assert model._get_newton('transient') == 0
+
+
+def test_scipy_solve_approaches_steady_state():
+    model, Uss, rss = _steady_state('scipy')
+    model.set_initial_conditions(U0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        U, r = model.solve(1e4, 10)
+    assert len(U) == len(model.t) == 10
+    for name in ['Pt', 'COs', 'Os']:
+        assert U[-1][name] == pytest.approx(Uss[name], rel=1e-4, abs=1e-12)
+    assert r[-1]['r3'] == pytest.approx(rss['r3'], rel=1e-4)
+
+
+@requires_sundials
+@pytest.mark.parametrize('T, U0', [
+    (500., U0),
+    (450., {'CO': 0.001, 'O2': 1., 'CO2': 0.}),
+    (600., {'CO': 1., 'O2': 1., 'CO2': 0.}),
+])
+def test_steady_state_matches_fortran(T, U0):
+    results = [_steady_state(backend, T, U0)
+               for backend in ['scipy', 'fortran']]
+    for model, U, r in results:
+        assert model.convergence.converged
+    (_, Us, rs), (_, Uf, rf) = results
+    for name in Us:
+        assert Uf[name] == pytest.approx(Us[name], rel=1e-6, abs=1e-12)
+    for name in rs:
+        assert rf[name] == pytest.approx(rs[name], rel=1e-6, abs=1e-12)
+
+
+@requires_sundials
+def test_solve_matches_fortran():
+    trajectories = []
+    for backend in ['scipy', 'fortran']:
+        model = make_model(backend=backend)[0]
+        model.set_initial_conditions(U0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            trajectories.append(model.solve(1e3, 5)[0])
+    for Us, Uf in zip(*trajectories):
+        for name in ['Pt', 'COs', 'Os']:
+            assert Uf[name] == pytest.approx(Us[name], rel=1e-3, abs=1e-9)
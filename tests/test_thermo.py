@@ -0,0 +1,52 @@
+"""Thermochemistry evaluated over arrays of temperatures"""
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from conftest import make_species
+
+Ts = np.linspace(300., 900., 7)
+species_names = sorted(make_species())
+
+
+@pytest.mark.parametrize('name', species_names)
+@pytest.mark.parametrize('quantity', ['get_H', 'get_S', 'get_G', 'get_E',
+                                      'get_q'])
+def test_array_matches_scalars(species, name, quantity):
+    get = getattr(species[name], quantity)
+    expected = [float(get(T)) for T in Ts]
+    values = get(Ts)
+    assert np.shape(values) == Ts.shape
+    np.testing.assert_allclose(values, expected, rtol=1e-13, atol=1e-300)
+
+
+@pytest.mark.parametrize('name', species_names)
+def test_array_shape(species, name):
+    T = Ts[:6].reshape(2, 3)
+    G = species[name].get_G(T)
+    assert G.shape == T.shape
+    np.testing.assert_allclose(G.ravel(), species[name].get_G(T.ravel()),
+                               rtol=1e-14)
+
+
+def test_array_keeps_state(species):
+    """Arrays of temperatures do not replace the stored properties, which
+    dependent reactions may still use"""
+    co = species['co']
+    G = co.get_G(500.)
+    revision = co.revision
+    co.get_G(Ts)
+    assert co.T == 500.
+    assert co.revision == revision
+    assert co.is_update_needed(500.) is False
+    assert co.get_G() == G
+
+
+def test_array_scales(species):
+    cos = species['cos']
+    cos.scale['S']['vib'] = 1.1
+    cos.dE = 0.2
+    np.testing.assert_allclose(cos.get_G(Ts), [cos.get_G(T) for T in Ts],
+                               rtol=1e-13)
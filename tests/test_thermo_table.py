@@ -0,0 +1,87 @@
+"""Interpolated thermochemistry against direct evaluation"""
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from ase.units import kB
+
+from conftest import make_species
+
+Ts = np.linspace(400., 600., 401)
+species_names = [name for name in sorted(make_species()) if name != 'star']
+
+
+def _errors(thermo, T, exact):
+    """Largest errors of G, T S and kB T ln q in eV"""
+    G, S, q = exact
+    return (np.max(np.abs(thermo.get_G(T) - G)),
+            np.max(np.abs(T * (thermo.get_S(T) - S))),
+            np.max(np.abs(kB * T * np.log(thermo.get_q(T) / q))))
+
+
+def _exact(thermo, T):
+    return thermo.get_G(T), thermo.get_S(T), thermo.get_q(T)
+
+
+@pytest.mark.parametrize('name', species_names)
+@pytest.mark.parametrize('dT, tol', [(10., 1e-6), (100., 1e-6), (100., 1e-8)])
+def test_table_error(species, name, dT, tol):
+    thermo = species[name]
+    exact = _exact(thermo, Ts)
+    thermo.set_thermo_table(Ts[0], Ts[-1], dT=dT, tol=tol)
+    assert thermo._table.error <= tol
+    assert max(_errors(thermo, Ts, exact)) <= 2 * tol
+    # Scalars take a separate path through the table
+    for T in Ts[::40]:
+        assert thermo.get_G(T) == pytest.approx(thermo.get_G(np.array([T]))[0],
+                                                rel=1e-14)
+
+
+def test_table_extends(species):
+    thermo = species['co2']
+    T = np.linspace(300., 800., 101)
+    exact = _exact(thermo, T)
+    thermo.set_thermo_table(400., 600.)
+    assert max(_errors(thermo, T, exact)) <= 2e-6
+    table = thermo._table
+    assert table.Tmin <= 300. and table.Tmax >= 800.
+
+
+def test_table_electronic_shift(species):
+    """Shifts of the electronic energy and entropy are added to the table
+    without rebuilding it"""
+    thermo = species['cos']
+    thermo.set_thermo_table(Ts[0], Ts[-1])
+    coeffs = thermo._table.coeffs
+    G = thermo.get_G(Ts)
+    S = thermo.get_S(Ts)
+    thermo.dE = 0.25
+    thermo.spin = 1.
+    assert thermo._table.coeffs is coeffs
+    np.testing.assert_allclose(thermo.get_S(Ts), S + kB * np.log(3.),
+                               rtol=1e-12)
+    np.testing.assert_allclose(thermo.get_G(Ts),
+                               G + 0.25 - Ts * kB * np.log(3.), rtol=1e-12)
+    thermo.clear_thermo_table()
+    np.testing.assert_allclose(thermo.get_G(Ts),
+                               G + 0.25 - Ts * kB * np.log(3.), atol=2e-6)
+
+
+@pytest.mark.parametrize('change', ['symm', 'scale', 'freqs'])
+def test_table_rebuilds(species, change):
+    thermo = species['co2']
+    thermo.set_thermo_table(Ts[0], Ts[-1])
+    coeffs = thermo._table.coeffs
+    if change == 'symm':
+        thermo.symm = 1
+    elif change == 'scale':
+        thermo.scale['S']['vib'] = 1.1
+    else:
+        thermo.freqs = thermo.freqs * 1.05
+    G = thermo.get_G(Ts)
+    assert thermo._table.coeffs is not coeffs
+    table = thermo._table
+    thermo.clear_thermo_table()
+    np.testing.assert_allclose(G, thermo.get_G(Ts), atol=2 * table.tol)
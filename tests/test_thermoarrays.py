@@ -0,0 +1,101 @@
+"""Thermochemistry of all reactions at once against Reaction.update"""
+
+from __future__ import print_function
+
+import warnings
+
+import numpy as np
+import pytest
+from ase.units import kB
+
+from micki import Adsorbate, Reaction
+from micki.thermoarrays import ThermoArrays
+
+from conftest import _atoms, make_reactions
+
+attributes = ['dH', 'dS', 'dG', 'keq', 'kfor', 'krev', 'dG_act', 'alpha']
+
+
+def _reactions(species):
+    sp = species
+    co2s = Adsorbate(_atoms('CO2', [[0, 0, 0], [0, 0, 1.16], [0, 0, -1.16]],
+                            -23.2), 'CO2s',
+                     freqs=[0.02, 0.03, 0.04, 0.05, 0.08, 0.08, 0.16, 0.29],
+                     sites=[sp['star']])
+    reactions = make_reactions(sp)
+    reactions.update(
+            r4=Reaction(sp['co2'], co2s, method='EQUIL'),
+            r5=Reaction(co2s, sp['cos'] + sp['os'], method='DIEQUIL',
+                        dG_act=0.9),
+            r6=Reaction(sp['cos'] + sp['os'], co2s, ts=sp['ts'],
+                        dground=True))
+    return [reactions[name] for name in sorted(reactions)]
+
+
+def _values(reactions):
+    return np.array([[np.nan if getattr(rxn, name) is None
+                      else float(getattr(rxn, name)) for name in attributes]
+                     for rxn in reactions])
+
+
+@pytest.mark.parametrize('T', [450., 520., 610.])
+def test_update_matches_reactions(species, T):
+    reactions = _reactions(species)
+    species['cos'].dE = 0.07
+    species['ts'].scale['S']['vib'] = 1.05
+    reactions[2].set_scale('dH_act', 1.02)
+    reactions[4].set_scale('kfor', 2.)
+
+    assert ThermoArrays(reactions).update(T, 1e-19, 0, force=True)
+    vectorised = _values(reactions)
+    for rxn in reactions:
+        rxn.update(T, 1e-19, 0, force=True)
+    np.testing.assert_allclose(vectorised, _values(reactions), rtol=1e-12)
+
+
+@pytest.mark.parametrize('reverse, scale', [(False, ('dS_act', -10.)),
+                                            (True, ('dH_act', 0.5))])
+def test_update_rounds_barriers(species, reverse, scale):
+    """Negative forward and reverse barriers of dground reactions are
+    rounded the same way"""
+    reactions = _reactions(species)
+    rxn = reactions[5]
+    if reverse:
+        rxn = Reaction(rxn.products, rxn.reactants, ts=rxn.ts, dground=True)
+        reactions.append(rxn)
+    rxn.set_scale(*scale)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        ThermoArrays(reactions).update(500., 1e-19, 0, force=True)
+    assert len(caught) == 1
+    assert rxn.dG_act == pytest.approx(rxn.dG if reverse else 0.)
+    vectorised = _values(reactions)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for rxn in reactions:
+            rxn.update(500., 1e-19, 0, force=True)
+    np.testing.assert_allclose(vectorised, _values(reactions), rtol=1e-12)
+
+
+def test_update_only_when_needed(species):
+    reactions = _reactions(species)
+    arrays = ThermoArrays(reactions)
+    arrays.update(500., 1e-19, 0)
+    kfor = [rxn.kfor for rxn in reactions]
+    # Nothing changed, so the rate constants are kept as they are
+    reactions[2].kfor = 0.
+    arrays.update(500., 1e-19, 0)
+    assert reactions[2].kfor == 0.
+    species['ts'].dE = 0.1
+    arrays.update(500., 1e-19, 0)
+    assert reactions[2].kfor == pytest.approx(
+            kfor[2] * np.exp(-0.1 / (kB * 500.)), rel=1e-6)
+
+
+def test_update_symbolic(species):
+    """Coverage-dependent energies are left to the reactions"""
+    reactions = _reactions(species)
+    species['cos'].lateral = 0.2 * species['os'].symbol
+    kfor = [rxn.kfor for rxn in reactions]
+    assert not ThermoArrays(reactions).update(500., 1e-19, 0, force=True)
+    assert [rxn.kfor for rxn in reactions] == kfor